@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class BoardsConfig(AppConfig):
     name = 'boards'
+
+    def ready(self):
+        import boards.signals  # noqa: F401
+        import boards.sqlite  # noqa: F401
@@ -0,0 +1,253 @@
+"""
+ASGI-native handling of the hot read endpoints:
+
+    GET /boards/                       GET /boards/{id}/
+    GET /boards/{id}/sections/         GET /boards/{id}/stickers/
+    GET /boards/{id}/users/            GET /stickers/
+
+(also under /api/). Django 3.0 has no async views, and its ASGI handler
+runs every request in one shared thread. Here, a signed access token is
+checked in memory on the event loop, as on the sync path, while a DRF
+token's active user is loaded on the thread pool; board membership is
+checked on the event loop from the membership cache. A request rejected
+at that point never reaches the view. The view then runs
+in one call on the thread pool, in parallel with other requests, through
+the project's middleware and the same viewset code as the sync path.
+Session and CSRF middleware, which only apply to cookie-authenticated
+requests, are left out; so is MetricsMiddleware, whose work the
+application does itself.
+
+Requests this path does not cover fall through to the wrapped
+application unchanged: other methods, Basic or session authentication,
+invalid tokens, and non-JSON or ?format= requests.
+"""
+import re
+import time
+from io import BytesIO
+from urllib.parse import parse_qs
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+from rest_framework.authtoken.models import Token
+
+from boards.membership import membership_cache
+from boards.metrics import PhaseTimer, registry
+from boards.querybudget import QueryRecorder
+from boards.tokens import access_token_user
+
+SKIPPED_MIDDLEWARE = (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'boards.metrics.MetricsMiddleware',
+)
+
+
+def _routes():
+    from boards.views import BoardViewSet, StickerViewSet
+
+    prefix = r'^/(?:api/)?'
+    return [
+        (re.compile(prefix + r'boards/$'), 'board-list', BoardViewSet, 'list'),
+        (re.compile(prefix + r'boards/(?P<pk>\d+)/$'), 'board-detail', BoardViewSet, 'retrieve'),
+        (re.compile(prefix + r'boards/(?P<pk>\d+)/sections/$'), 'board-sections', BoardViewSet, 'sections'),
+        (re.compile(prefix + r'boards/(?P<pk>\d+)/stickers/$'), 'board-stickers', BoardViewSet, 'stickers'),
+        (re.compile(prefix + r'boards/(?P<pk>\d+)/users/$'), 'board-users', BoardViewSet, 'users'),
+        (re.compile(prefix + r'stickers/$'), 'sticker-list', StickerViewSet, 'list'),
+    ]
+
+
+class AsyncReadApplication:
+    """
+    ASGI application serving the read endpoints above and passing every
+    other request on to `application`.
+    """
+    def __init__(self, application):
+        self.application = application
+        self.routes = _routes()
+        self.middleware = None
+
+    async def __call__(self, scope, receive, send):
+        route = self.match(scope)
+        if route is None:
+            return await self.application(scope, receive, send)
+        name, viewset, action, kwargs = route
+        request = ASGIRequest(scope, BytesIO())
+        request.metric_phases = {}
+        request.async_route = name
+        request.streaming_supported = True
+        started = time.perf_counter()
+        with PhaseTimer(request, 'auth'):
+            auth = await authenticate(request)
+        if auth is None:
+            return await self.application(scope, receive, send)
+        board_id = int(kwargs['pk']) if 'pk' in kwargs else None
+        if board_id is not None:
+            with PhaseTimer(request, 'permissions'):
+                allowed = await has_access(board_id, auth[0].pk)
+            if not allowed:
+                # what the viewset's queryset filter would answer
+                response = _json_response(404, b'{"detail":"Not found."}')
+                await self.send_response(send, response)
+                return self.record(request, response, name, started)
+        response = await sync_to_async(self.respond, thread_sensitive=False)(
+            request, auth, viewset, action, kwargs, send)
+        if not response.streaming:
+            await self.send_response(send, response)
+        self.record(request, response, name, started)
+
+    def match(self, scope):
+        if scope['type'] != 'http' or scope['method'] != 'GET' \
+                or not getattr(settings, 'ASYNC_READ_ENDPOINTS', True):
+            return None
+        if 'format' in parse_qs(scope.get('query_string', b'').decode()):
+            return None
+        for name, value in scope.get('headers', []):
+            if name == b'accept' and b'text/html' in value:
+                return None
+        path = scope.get('path', '')
+        for pattern, name, viewset, action in self.routes:
+            found = pattern.match(path)
+            if found is not None:
+                return name, viewset, action, found.groupdict()
+        return None
+
+    def respond(self, request, auth, viewset, action, kwargs, send):
+        close_old_connections()
+        recorder = QueryRecorder()
+        try:
+            with recorder.record():
+                request.async_view = (auth, viewset, action, kwargs)
+                if self.middleware is None:
+                    self.middleware = load_middleware(view_response)
+                response = self.middleware(request)
+                if response.streaming:
+                    # the rows are read while the body is sent, so from this thread
+                    self.send_streaming(async_to_sync(send), response)
+            request.metric_phases['db'] = recorder.seconds
+            registry.inc('boards_db_queries_total', (request.async_route,), recorder.count)
+            return response
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    async def send_response(send, response):
+        await send(start_message(response))
+        await send({'type': 'http.response.body', 'body': response.content})
+
+    @staticmethod
+    def send_streaming(send, response):
+        try:
+            send(start_message(response))
+            for chunk in response:
+                send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            send({'type': 'http.response.body', 'body': b''})
+        finally:
+            response.close()
+
+    @staticmethod
+    def record(request, response, route, started):
+        registry.inc('boards_http_requests_total', (route, 'GET', str(response.status_code)))
+        registry.observe('boards_http_request_duration_seconds', (route, 'GET'), time.perf_counter() - started)
+        for phase, seconds in request.metric_phases.items():
+            registry.observe('boards_http_request_phase_seconds', (route, phase), seconds)
+
+
+def start_message(response):
+    headers = [(name.encode('latin1'), value.encode('latin1')) for name, value in response.items()]
+    return {'type': 'http.response.start', 'status': response.status_code, 'headers': headers}
+
+
+def _json_response(status, body):
+    return HttpResponse(body, status=status, content_type='application/json')
+
+
+def load_middleware(get_response):
+    """
+    settings.MIDDLEWARE without SKIPPED_MIDDLEWARE around `get_response`.
+    """
+    handler = get_response
+    for path in reversed(settings.MIDDLEWARE):
+        if path not in SKIPPED_MIDDLEWARE:
+            handler = import_string(path)(handler)
+    return handler
+
+
+async def authenticate(request):
+    """
+    (user, auth) for a valid signed access token or DRF token of an active
+    user, as the sync path's authentication classes would return, or None.
+    """
+    parts = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(parts) != 2:
+        return None
+    keyword, key = parts[0].lower(), parts[1]
+    if keyword == 'bearer':
+        user = access_token_user(key)
+        return None if user is None else (user, None)
+    if keyword == 'token':
+        return await sync_to_async(_token_user, thread_sensitive=False)(key)
+    return None
+
+
+def _token_user(key):
+    close_old_connections()
+    try:
+        token = Token.objects.select_related('user').filter(key=key, user__is_active=True).first()
+        return None if token is None else (token.user, token)
+    finally:
+        close_old_connections()
+
+
+async def has_access(board_id, user_id):
+    entry = membership_cache.peek(board_id)
+    if entry is None:
+        return await sync_to_async(_load_access, thread_sensitive=False)(board_id, user_id)
+    owner_id, member_ids = entry
+    return owner_id == user_id or user_id in member_ids
+
+
+def _load_access(board_id, user_id):
+    close_old_connections()
+    try:
+        return membership_cache.has_access(board_id, user_id)
+    finally:
+        close_old_connections()
+
+
+def view_response(request):
+    """
+    Innermost handler of the middleware chain: the rendered response of the
+    view in `request.async_view`, as Django's handler returns it.
+    """
+    response = run_view(request, *request.async_view)
+    return response.render() if hasattr(response, 'render') else response
+
+
+def run_view(django_request, auth, viewset, action, kwargs):
+    """
+    Runs `action` of `viewset` for an already authenticated request, the way
+    the viewset's own view function would: through `initial` (content
+    negotiation, permissions, throttles), the handler and the exception
+    handling of APIView.dispatch.
+    """
+    view = viewset()
+    view.action_map = {'get': action}
+    view.action = action
+    view.args = ()
+    view.kwargs = kwargs
+    view.headers = view.default_response_headers
+    request = view.initialize_request(django_request)
+    request.user, request.auth = auth
+    view.request = request
+    try:
+        view.initial(request)
+        response = getattr(view, action)(request, **kwargs)
+    except Exception as exc:
+        response = view.handle_exception(exc)
+    return view.finalize_response(request, response)
@@ -0,0 +1,153 @@
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from rest_framework.authentication import BaseAuthentication, BasicAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+
+from boards.tokens import access_token_user
+
+DEFAULT_CREDENTIAL_CACHE_TTL = 300
+DEFAULT_CREDENTIAL_CACHE_SIZE = 10000
+
+
+class CredentialCache:
+    """
+    Remembers successful username/password verifications so that repeated
+    Basic auth requests skip the password hasher.
+
+    Entries are keyed by an HMAC of the credentials (the password itself is
+    never stored) and remember the user's password hash at verification
+    time: once the password changes the entry no longer matches, even if it
+    was changed by another process.
+    """
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.verifications = 0
+        self.verification_seconds = 0.0
+
+    @staticmethod
+    def key(userid, password):
+        message = '{}\0{}'.format(userid, password).encode()
+        return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > now:
+                self.hits += 1
+                return entry[0], entry[1]
+            self.misses += 1
+            if entry is not None:
+                self._remove(key)
+        return None
+
+    def set(self, key, user_id, password_hash):
+        ttl = getattr(settings, 'BASIC_AUTH_CACHE_TTL', DEFAULT_CREDENTIAL_CACHE_TTL)
+        max_size = getattr(settings, 'BASIC_AUTH_CACHE_SIZE', DEFAULT_CREDENTIAL_CACHE_SIZE)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (user_id, password_hash, time.monotonic() + ttl)
+            self._keys_by_user.setdefault(user_id, set()).add(key)
+            while len(self._entries) > max_size:
+                self._remove(next(iter(self._entries)))
+
+    def discard(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def record_verification(self, seconds):
+        with self._lock:
+            self.verifications += 1
+            self.verification_seconds += seconds
+
+    def stats(self):
+        with self._lock:
+            average = self.verification_seconds / self.verifications if self.verifications else 0.0
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'verifications': self.verifications,
+                'verification_cpu_seconds': self.verification_seconds,
+                # every hit would otherwise have cost one average verification
+                'cpu_seconds_saved': self.hits * average,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._keys_by_user.get(entry[0])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_user[entry[0]]
+
+
+credential_cache = CredentialCache()
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    BasicAuthentication that runs the password hasher only on the first
+    request with a given set of credentials within BASIC_AUTH_CACHE_TTL.
+    A cached hit still loads the user to check it is active and that its
+    password has not changed.
+    """
+    def authenticate_credentials(self, userid, password, request=None):
+        key = credential_cache.key(userid, password)
+        entry = credential_cache.get(key)
+        if entry is not None:
+            user_id, password_hash = entry
+            user = User.objects.filter(pk=user_id).first()
+            if user is not None and user.is_active and user.password == password_hash:
+                return user, None
+            credential_cache.discard(key)
+
+        started = time.thread_time()
+        user, auth = super().authenticate_credentials(userid, password, request)
+        credential_cache.record_verification(time.thread_time() - started)
+        credential_cache.set(key, user.pk, user.password)
+        return user, auth
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    Authenticates `Authorization: Bearer <access token>` by checking the
+    token signature and the deny list in memory; the user row is only
+    loaded if the view needs more than its id.
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed('Invalid token header.')
+        user = access_token_user(auth[1].decode('latin1'))
+        if user is None:
+            raise AuthenticationFailed('Invalid or expired token.')
+        return user, None
+
+    def authenticate_header(self, request):
+        return self.keyword
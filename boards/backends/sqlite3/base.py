@@ -0,0 +1,14 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite backend that can open transactions with BEGIN IMMEDIATE, taking
+    the write lock up front. A deferred transaction that reads before it
+    writes fails at once with "database is locked" when another connection
+    wrote meanwhile, without waiting for busy_timeout.
+    """
+    immediate_transactions = False
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE' if self.immediate_transactions else 'BEGIN')
@@ -0,0 +1,505 @@
+"""
+Load-test harness for the REST API.
+
+Seeds a database with boards, sections, stickers and members, replays a
+weighted mix of API calls and reports latency percentiles, throughput and
+query counts per endpoint. Calls go either through the WSGI handler
+in-process (`InProcessTarget`), over HTTP to a server such as a locally
+spawned gunicorn (`HttpTarget`) or straight into the ASGI application
+(`run_asgi`). Driven by `manage.py benchmark`.
+"""
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.db.models import Prefetch
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.authtoken.models import Token
+
+from boards.generate import Generator
+from boards.models import Board, BoardAccess, Section, Sticker
+from boards.readmodels import read_model
+from boards.serializers import BoardSerializer, SectionSerializer, StickerSerializer
+
+SEED_PASSWORD = 'Benchmark1'
+
+# SQLite as configured before the production profile, for comparison
+SQLITE_BASELINE = {
+    'SQLITE_PRAGMAS': {'journal_mode': 'DELETE'},
+    'SQLITE_WRITE_RETRIES': 0,
+    'CONN_MAX_AGE': 0,
+}
+
+DEFAULT_MIX = {
+    'board_list': 25,
+    'board_retrieve': 20,
+    'board_stickers': 20,
+    'section_stickers': 15,
+    'sticker_update': 12,
+    'invite': 4,
+    'registration': 4,
+}
+
+# the endpoints served by boards/asyncviews.py
+READ_MIX = {
+    'board_list': 25,
+    'board_retrieve': 25,
+    'board_sections': 15,
+    'board_stickers': 15,
+    'board_users': 10,
+    'sticker_list': 10,
+}
+
+ENDPOINTS = list(DEFAULT_MIX) + [endpoint for endpoint in READ_MIX if endpoint not in DEFAULT_MIX]
+
+
+def seed(users=50, boards=20, sections_per_board=5, stickers_per_section=20, members_per_board=5, seed=0):
+    """
+    Generates the given volumes and returns the workload description used
+    to pick request targets.
+    """
+    Generator(seed=seed, prefix='bench', password=SEED_PASSWORD).generate(
+        users, boards, members=members_per_board, sections=sections_per_board, stickers=stickers_per_section,
+    )
+    return Workload.load()
+
+
+class Workload:
+    """
+    Ids the request mix draws from: boards with their members' tokens,
+    sections and stickers.
+    """
+    def __init__(self, boards, sections, stickers, tokens):
+        self.boards = boards
+        self.sections = sections
+        self.stickers = stickers
+        self.tokens = tokens
+        self.board_ids = list(boards)
+        self.user_ids = list(tokens)
+
+    @classmethod
+    def load(cls):
+        boards = defaultdict(list)
+        for board_id, user_id in BoardAccess.objects.values_list('board_id', 'user_id'):
+            boards[board_id].append(user_id)
+        sections = defaultdict(list)
+        for section_id, board_id in Section.objects.values_list('id', 'board_id'):
+            sections[board_id].append(section_id)
+        stickers = defaultdict(list)
+        for sticker_id, section_id in Sticker.objects.values_list('id', 'section_id'):
+            stickers[section_id].append(sticker_id)
+        tokens = dict(Token.objects.values_list('user_id', 'key'))
+        return cls(dict(boards), dict(sections), dict(stickers), tokens)
+
+
+class Call:
+    def __init__(self, endpoint, method, path, token=None, data=None, board_id=None):
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        self.token = token
+        self.data = data
+        self.board_id = board_id
+
+    def prepare(self):
+        # a successful join rotates the invite link, so read the current one
+        if self.endpoint == 'invite':
+            link = Board.objects.filter(pk=self.board_id).values_list('invite_link', flat=True).first()
+            self.path = '/api/invite/{}/'.format(link)
+
+
+def build_call(endpoint, workload, rng):
+    board_id = rng.choice(workload.board_ids)
+    user_id = rng.choice(workload.boards[board_id])
+    token = workload.tokens.get(user_id)
+    sections = workload.sections.get(board_id) or [None]
+    section_id = rng.choice(sections)
+    if endpoint == 'board_list':
+        return Call(endpoint, 'GET', '/api/boards/', token)
+    if endpoint == 'board_retrieve':
+        return Call(endpoint, 'GET', '/api/boards/{}/'.format(board_id), token)
+    if endpoint == 'board_stickers':
+        return Call(endpoint, 'GET', '/api/boards/{}/stickers/'.format(board_id), token)
+    if endpoint == 'board_sections':
+        return Call(endpoint, 'GET', '/api/boards/{}/sections/'.format(board_id), token)
+    if endpoint == 'board_users':
+        return Call(endpoint, 'GET', '/api/boards/{}/users/'.format(board_id), token)
+    if endpoint == 'sticker_list':
+        return Call(endpoint, 'GET', '/api/stickers/', token)
+    if endpoint == 'section_stickers' and section_id is not None:
+        return Call(endpoint, 'GET', '/api/sections/{}/stickers/'.format(section_id), token)
+    if endpoint == 'sticker_update' and workload.stickers.get(section_id):
+        sticker_id = rng.choice(workload.stickers[section_id])
+        data = {'title': 'updated {}'.format(rng.getrandbits(16)), 'text': 'text', 'section': section_id}
+        return Call(endpoint, 'PUT', '/api/stickers/{}/'.format(sticker_id), token, data)
+    if endpoint == 'invite':
+        invitee = rng.choice(workload.user_ids)
+        return Call(endpoint, 'POST', None, workload.tokens[invitee], {}, board_id=board_id)
+    if endpoint == 'registration':
+        username = 'bench-new-{}-{}'.format(time.time_ns(), rng.getrandbits(32))
+        return Call(endpoint, 'POST', '/api/registration/', None, {
+            'username': username, 'password': SEED_PASSWORD, 'boards': [], 'guest_boards': [],
+        })
+    return Call('board_list', 'GET', '/api/boards/', token)
+
+
+class InProcessTarget:
+    """
+    Calls the WSGI application through Django's test client and counts the
+    queries each call runs.
+    """
+    name = 'in-process'
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def __call__(self, call):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client(SERVER_NAME='localhost', raise_request_exception=False)
+        headers = {'HTTP_AUTHORIZATION': 'Token {}'.format(call.token)} if call.token else {}
+        method = getattr(client, call.method.lower())
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            if call.data is None:
+                response = method(call.path, **headers)
+            else:
+                response = method(call.path, json.dumps(call.data), content_type='application/json', **headers)
+            elapsed = time.perf_counter() - started
+        return response.status_code, elapsed, len(queries)
+
+
+class SlowClient:
+    """
+    Wraps a target so that each call keeps its worker thread busy for
+    `delay` more seconds, as a sync worker is while it writes a response to a
+    slow client.
+    """
+    def __init__(self, target, delay):
+        self.target = target
+        self.delay = delay
+        self.name = target.name
+
+    def __call__(self, call):
+        code, elapsed, queries = self.target(call)
+        time.sleep(self.delay)
+        return code, elapsed + self.delay, queries
+
+
+class HttpTarget:
+    """
+    Calls a running server over HTTP; query counts are not available.
+    """
+    name = 'http'
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def __call__(self, call):
+        body = None if call.data is None else json.dumps(call.data).encode()
+        request = urllib.request.Request(self.base_url + call.path, data=body, method=call.method)
+        request.add_header('Content-Type', 'application/json')
+        if call.token:
+            request.add_header('Authorization', 'Token {}'.format(call.token))
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                code = response.status
+        except urllib.error.HTTPError as error:
+            error.read()
+            code = error.code
+        return code, time.perf_counter() - started, None
+
+
+def run(target, workload, requests=500, mix=None, concurrency=1, rng=None):
+    """
+    Replays `requests` calls drawn from `mix` against `target` and returns
+    the report produced by `summarize`.
+    """
+    calls = draw_calls(workload, requests, mix, rng or random.Random(1))
+    started = time.perf_counter()
+    samples = replay(target, calls, concurrency)
+    return summarize(samples, time.perf_counter() - started)
+
+
+def run_processes(workload, requests=500, mix=None, processes=2, seed=0, concurrency=1):
+    """
+    Like `run` with an `InProcessTarget`, but split over `processes` forked
+    worker processes hitting the same database file, as gunicorn workers do,
+    each with `concurrency` threads.
+    """
+    for connection in connections.all():
+        # a SQLite handle must not be carried across fork
+        connection.close()
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    share = -(-requests // processes)
+    workers = [
+        context.Process(target=_replay_worker, args=(
+            queue, draw_calls(workload, share, mix, random.Random(seed + index)), concurrency,
+        ))
+        for index in range(processes)
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    samples = []
+    for _ in workers:
+        samples.extend(queue.get())
+    for worker in workers:
+        worker.join()
+    return summarize(samples, time.perf_counter() - started)
+
+
+def _replay_worker(queue, calls, concurrency):
+    try:
+        queue.put(replay(InProcessTarget(), calls, concurrency))
+    finally:
+        connections.close_all()
+
+
+def run_asgi(application, calls, connections=100, client_delay=0.0):
+    """
+    Replays `calls` against an ASGI application from one event loop, with
+    at most `connections` open at a time, each held `client_delay` seconds
+    after its response as by a slow client. Returns samples like `replay`.
+    """
+    samples = []
+
+    async def main():
+        slots = asyncio.Semaphore(connections)
+
+        async def execute(call):
+            async with slots:
+                if call.endpoint == 'invite':
+                    await sync_to_async(call.prepare, thread_sensitive=False)()
+                started = time.perf_counter()
+                code = await asgi_request(application, call)
+                await asyncio.sleep(client_delay)
+                samples.append((call.endpoint, code, time.perf_counter() - started, None))
+
+        await asyncio.gather(*(execute(call) for call in calls))
+
+    asyncio.run(main())
+    return samples
+
+
+async def asgi_request(application, call):
+    """
+    Sends one call through `application` and returns the response status.
+    """
+    path, _, query = call.path.partition('?')
+    headers = [(b'host', b'localhost'), (b'content-type', b'application/json')]
+    if call.token:
+        headers.append((b'authorization', 'Token {}'.format(call.token).encode()))
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': call.method,
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+        'root_path': '', 'headers': headers, 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    body = b'' if call.data is None else json.dumps(call.data).encode()
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = []
+
+    async def receive():
+        return messages.pop() if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0] if status else 500
+
+
+def draw_calls(workload, requests, mix, rng):
+    mix = mix or DEFAULT_MIX
+    endpoints = list(mix)
+    weights = [mix[endpoint] for endpoint in endpoints]
+    return [build_call(endpoint, workload, rng) for endpoint in rng.choices(endpoints, weights, k=requests)]
+
+
+def replay(target, calls, concurrency=1):
+    samples = []
+    lock = threading.Lock()
+
+    def execute(call):
+        call.prepare()
+        code, elapsed, queries = target(call)
+        with lock:
+            samples.append((call.endpoint, code, elapsed, queries))
+
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(execute, calls))
+    else:
+        for call in calls:
+            execute(call)
+    return samples
+
+
+def read_model_throughput(repeat=3):
+    """
+    Rows per second rendering every board, section and sticker to JSON
+    through its serializer and through its read model, best of `repeat`.
+    Returns {name: (rows, serializer rows/s, read model rows/s)} and fails
+    if the two outputs differ.
+    """
+    cases = [
+        ('sticker', StickerSerializer, Sticker.objects.order_by('id')),
+        ('section', SectionSerializer, Section.objects.prefetch_related(
+            Prefetch('stickers', queryset=Sticker.objects.only('id', 'section_id'))).order_by('id')),
+        ('board', BoardSerializer, Board.objects.select_related('owner').prefetch_related(
+            Prefetch('sections', queryset=Section.objects.only('id', 'board_id')),
+            Prefetch('users', queryset=User.objects.only('id').order_by('id')),
+        ).order_by('id')),
+    ]
+    render = JSONRenderer().render
+    results = {}
+    for name, serializer_class, queryset in cases:
+        model = read_model(serializer_class)
+        timings = {'serializer': [], 'read model': []}
+        for _ in range(repeat):
+            started = time.perf_counter()
+            expected = render(serializer_class(queryset.all(), many=True).data)
+            timings['serializer'].append(time.perf_counter() - started)
+            started = time.perf_counter()
+            actual = render(model.represent(model.rows(queryset.all())))
+            timings['read model'].append(time.perf_counter() - started)
+            if actual != expected:
+                raise AssertionError('{} read model output differs from {}'.format(name, serializer_class.__name__))
+        rows = queryset.count()
+        results[name] = (rows, rows / min(timings['serializer']), rows / min(timings['read model']))
+    return results
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(samples, wall_seconds):
+    by_endpoint = defaultdict(list)
+    for sample in samples:
+        by_endpoint[sample[0]].append(sample)
+    endpoints = {}
+    for endpoint, rows in sorted(by_endpoint.items()):
+        latencies = [row[2] * 1000 for row in rows]
+        queries = [row[3] for row in rows if row[3] is not None]
+        endpoints[endpoint] = {
+            'requests': len(rows),
+            'errors': sum(1 for row in rows if row[1] >= 400),
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'rps': len(rows) / wall_seconds if wall_seconds else None,
+            'queries': sum(queries) / len(queries) if queries else None,
+        }
+    all_latencies = [sample[2] * 1000 for sample in samples]
+    return {
+        'requests': len(samples),
+        'seconds': wall_seconds,
+        'rps': len(samples) / wall_seconds if wall_seconds else None,
+        'p50_ms': percentile(all_latencies, 0.50),
+        'p95_ms': percentile(all_latencies, 0.95),
+        'p99_ms': percentile(all_latencies, 0.99),
+        'endpoints': endpoints,
+    }
+
+
+def compare(report, baseline, threshold=0.10):
+    """
+    Per-endpoint relative change of p95 latency and throughput against a
+    saved report. Returns (rows, regressed) where `regressed` lists the
+    endpoints whose p95 grew by more than `threshold`.
+    """
+    rows, regressed = [], []
+    for endpoint, current in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(endpoint)
+        if not previous or not previous.get('p95_ms'):
+            continue
+        p95_change = (current['p95_ms'] - previous['p95_ms']) / previous['p95_ms']
+        rps_change = (current['rps'] - previous['rps']) / previous['rps'] if previous.get('rps') else None
+        rows.append((endpoint, previous['p95_ms'], current['p95_ms'], p95_change, rps_change))
+        if p95_change > threshold:
+            regressed.append(endpoint)
+    return rows, regressed
+
+
+def format_report(report):
+    lines = ['{:<18} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9} {:>8}'.format(
+        'endpoint', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'rps', 'queries')]
+    for endpoint, row in report['endpoints'].items():
+        lines.append('{:<18} {:>8} {:>7} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.1f} {:>8}'.format(
+            endpoint, row['requests'], row['errors'], row['p50_ms'], row['p95_ms'], row['p99_ms'], row['rps'],
+            '-' if row['queries'] is None else '{:.1f}'.format(row['queries'])))
+    lines.append('total: {} requests in {:.2f}s, {:.1f} rps, p50 {:.2f} ms, p95 {:.2f} ms, p99 {:.2f} ms'.format(
+        report['requests'], report['seconds'], report['rps'], report['p50_ms'], report['p95_ms'], report['p99_ms']))
+    return '\n'.join(lines)
+
+
+class Gunicorn:
+    """
+    Context manager running gunicorn on a free local port against the
+    database named by `db_name`.
+    """
+    def __init__(self, db_name, workers=2, extra_args=()):
+        self.db_name = db_name
+        self.workers = workers
+        self.extra_args = list(extra_args)
+        self.port = free_port()
+        self.process = None
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{}'.format(self.port)
+
+    def __enter__(self):
+        env = dict(os.environ, BOARDS_DB_NAME=self.db_name)
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', 'inernSite.wsgi', '-b', '127.0.0.1:{}'.format(self.port),
+             '-w', str(self.workers)] + self.extra_args,
+            env=env,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError('gunicorn exited with code {}'.format(self.process.returncode))
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=0.2):
+                    return self
+            except OSError:
+                time.sleep(0.1)
+        self.__exit__(None, None, None)
+        raise RuntimeError('gunicorn did not start listening')
+
+    def __exit__(self, *exc_info):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
@@ -0,0 +1,214 @@
+import math
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Max
+from django.db import connections, router, transaction
+
+from boards.changes import record_board_changes
+from boards.deletion import raw_delete
+from boards.models import BoardAccess, BoardChange, Section, Sticker
+from boards.serializers import BulkStickerSerializer, StickerSerializer
+
+DEFAULT_BULK_MAX_OPERATIONS = 500
+
+OPERATIONS = ('create', 'update', 'move', 'delete')
+
+NOT_PERMITTED = 'request was not permitted'
+NO_SUCH_STICKER = 'Such sticker does not exist'
+NO_SUCH_SECTION = 'Such section does not exist'
+NO_SUCH_USER = 'Such user does not exist'
+
+
+def max_bulk_operations():
+    return getattr(settings, 'BOARDS_BULK_MAX_OPERATIONS', DEFAULT_BULK_MAX_OPERATIONS)
+
+
+class StickerBulkProcessor:
+    """
+    Validates and applies a list of sticker operations:
+
+        {"op": "create", "data": {...}}
+        {"op": "update", "id": 1, "data": {...}}
+        {"op": "move", "id": 1, "section": 2}
+        {"op": "delete", "id": 1}
+
+    Every referenced sticker, section and assignee is loaded up front in one
+    query per model and board access is checked once per distinct board, so
+    the number of queries does not depend on the number of operations.
+    """
+    def __init__(self, user, operations):
+        self.user = user
+        self.operations = operations
+        self.results = [None] * len(operations)
+        self.to_create = []
+        self.to_update = {}
+        self.to_delete = []
+        self.changes = []
+
+    def run(self, atomic=False):
+        self._load()
+        for index, operation in enumerate(self.operations):
+            self._validate(index, operation)
+        failed = any(result is not None and 'errors' in result for result in self.results)
+        if failed and atomic:
+            return self.results, False
+        with transaction.atomic():
+            self._write()
+        return self.results, not failed
+
+    def _load(self):
+        sticker_ids, section_ids, user_ids = set(), set(), set()
+        for operation in self.operations:
+            if not isinstance(operation, dict):
+                continue
+            data = operation.get('data') if isinstance(operation.get('data'), dict) else {}
+            if operation.get('id') is not None:
+                sticker_ids.add(operation['id'])
+            for section_id in (data.get('section'), operation.get('section')):
+                if section_id is not None:
+                    section_ids.add(section_id)
+            if data.get('assigned_to') is not None:
+                user_ids.add(data['assigned_to'])
+        self.stickers = Sticker.objects.select_related('section').in_bulk(_int_ids(sticker_ids))
+        self.sections = Section.objects.in_bulk(_int_ids(section_ids))
+        self.last_positions = dict(
+            Sticker.objects.filter(section_id__in=self.sections).order_by().values('section_id')
+            .annotate(last=Max('position')).values_list('section_id', 'last')
+        )
+        self.user_ids = set(User.objects.filter(pk__in=_int_ids(user_ids)).values_list('id', flat=True))
+        board_ids = {section.board_id for section in self.sections.values()}
+        board_ids.update(sticker.section.board_id for sticker in self.stickers.values())
+        # read from BoardAccess, not the membership cache, as for other writes
+        self.allowed_boards = set(BoardAccess.objects.filter(
+            user_id=self.user.id, board_id__in=board_ids, board__deleting=False).values_list('board_id', flat=True))
+
+    def _validate(self, index, operation):
+        if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+            self._error(index, {'op': ['Must be one of: {}.'.format(', '.join(OPERATIONS))]})
+            return
+        op = operation['op']
+        if op == 'create':
+            self._validate_create(index, operation)
+            return
+        sticker = self._get_sticker(operation.get('id'))
+        if sticker is None:
+            self._error(index, {'id': [NO_SUCH_STICKER]})
+        elif sticker.section.board_id not in self.allowed_boards:
+            self._error(index, {'status': NOT_PERMITTED})
+        elif op == 'delete':
+            self.to_delete.append(sticker.pk)
+            self.changes.append((sticker.section.board_id, BoardChange.STICKER, sticker.pk, BoardChange.DELETED))
+            self.results[index] = {'index': index, 'status': 'deleted', 'id': sticker.pk}
+        elif op == 'move':
+            self._validate_change(index, sticker, {'section': operation.get('section')}, 'moved')
+        else:
+            self._validate_change(index, sticker, operation.get('data'), 'updated')
+
+    def _validate_create(self, index, operation):
+        serializer = BulkStickerSerializer(data=operation.get('data'))
+        if not serializer.is_valid():
+            self._error(index, serializer.errors)
+            return
+        sticker = Sticker(**serializer.validated_data)
+        section = self.sections.get(sticker.section_id)
+        if section is None:
+            self._error(index, {'section': [NO_SUCH_SECTION]})
+        elif section.board_id not in self.allowed_boards:
+            self._error(index, {'status': NOT_PERMITTED})
+        elif self._check_assignee(index, sticker.assigned_to_id):
+            sticker.position = self._append_position(section.pk)
+            self.to_create.append((index, sticker))
+
+    def _validate_change(self, index, sticker, data, status):
+        serializer = BulkStickerSerializer(sticker, data=data, partial=True)
+        if not serializer.is_valid():
+            self._error(index, serializer.errors)
+            return
+        validated = serializer.validated_data
+        if 'section_id' in validated:
+            section = self.sections.get(validated['section_id'])
+            if section is None:
+                self._error(index, {'section': [NO_SUCH_SECTION]})
+                return
+            # stickers can only travel between sections of the same board
+            if section.board_id != sticker.section.board_id:
+                self._error(index, {'status': NOT_PERMITTED})
+                return
+        assigned_to_id = validated.get('assigned_to_id', sticker.assigned_to_id)
+        if not self._check_assignee(index, assigned_to_id):
+            return
+        self.changes.append((sticker.section.board_id, BoardChange.STICKER, sticker.pk, BoardChange.UPDATED))
+        if validated.get('section_id', sticker.section_id) != sticker.section_id:
+            sticker.position = self._append_position(validated['section_id'])
+        for attr, value in validated.items():
+            setattr(sticker, attr, value)
+        self.to_update[sticker.pk] = sticker
+        self.results[index] = {'index': index, 'status': status, 'id': sticker.pk}
+
+    def _check_assignee(self, index, user_id):
+        if user_id is not None and user_id not in self.user_ids:
+            self._error(index, {'assigned_to': [NO_SUCH_USER]})
+            return False
+        return True
+
+    def _append_position(self, section_id):
+        last = self.last_positions.get(section_id)
+        position = 1.0 if last is None else math.floor(last) + 1.0
+        self.last_positions[section_id] = position
+        return position
+
+    def _get_sticker(self, sticker_id):
+        try:
+            return self.stickers.get(int(sticker_id))
+        except (TypeError, ValueError):
+            return None
+
+    def _error(self, index, errors):
+        self.results[index] = {'index': index, 'errors': errors}
+
+    def _write(self):
+        deleted = set(self.to_delete)
+        # a plain DELETE: the post_delete receiver would load and log every row
+        raw_delete(Sticker, list(deleted))
+        updated = [sticker for pk, sticker in self.to_update.items() if pk not in deleted]
+        if updated:
+            Sticker.objects.bulk_update(updated, ['title', 'text', 'section', 'assigned_to', 'position'])
+        if self.to_create:
+            created = [sticker for _, sticker in self.to_create]
+            bulk_create_with_ids(Sticker, created)
+            for index, sticker in self.to_create:
+                self.results[index] = {'index': index, 'status': 'created', 'id': sticker.pk,
+                                       'sticker': StickerSerializer(sticker).data}
+                self.changes.append((self.sections[sticker.section_id].board_id, BoardChange.STICKER,
+                                     sticker.pk, BoardChange.CREATED))
+        # bulk writes bypass the model signals that log board changes
+        record_board_changes(self.changes)
+
+
+def bulk_create_with_ids(model, objs):
+    """
+    `bulk_create` that also sets primary keys on backends which cannot return
+    them from a bulk insert (SQLite on this Django version). Must run inside a
+    transaction: SQLite holds the write lock from the insert until commit, so
+    the newest ids in the table are exactly the rows just inserted.
+    """
+    model.objects.bulk_create(objs)
+    connection = connections[router.db_for_write(model)]
+    if connection.features.can_return_rows_from_bulk_insert or not objs:
+        return objs
+    ids = model.objects.order_by('-pk').values_list('pk', flat=True)[:len(objs)]
+    for obj, pk in zip(objs, reversed(list(ids))):
+        obj.pk = pk
+        obj._state.adding = False
+    return objs
+
+
+def _int_ids(values):
+    ids = set()
+    for value in values:
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            pass
+    return ids
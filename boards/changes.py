@@ -0,0 +1,110 @@
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from boards.events import publish_changes
+from boards.models import Board, BoardChange, Section, Sticker, bump_board_versions
+
+DEFAULT_CHANGES_RETAINED = 1000
+DEFAULT_CHANGES_COMPACT_EVERY = 100
+
+
+def changes_retained():
+    """
+    Number of most recent board versions whose changes are kept.
+    """
+    return getattr(settings, 'BOARD_CHANGES_RETAINED', DEFAULT_CHANGES_RETAINED)
+
+
+def record_board_changes(changes):
+    """
+    Bumps the version of every board in `changes` - an iterable of
+    (board_id, kind, object_id, action) - once and logs the changes under
+    the new version.
+    """
+    by_board = defaultdict(list)
+    for board_id, kind, object_id, action in changes:
+        if board_id is not None:
+            by_board[board_id].append((kind, object_id, action))
+    if not by_board:
+        return
+    with transaction.atomic():
+        bump_board_versions(by_board)
+        versions = dict(Board.objects.filter(pk__in=by_board).values_list('id', 'version'))
+        BoardChange.objects.bulk_create([
+            BoardChange(board_id=board_id, seq=versions[board_id], kind=kind, object_id=object_id, action=action)
+            for board_id, entries in by_board.items() if board_id in versions
+            for kind, object_id, action in entries
+        ])
+        compact_every = getattr(settings, 'BOARD_CHANGES_COMPACT_EVERY', DEFAULT_CHANGES_COMPACT_EVERY)
+        for board_id, version in versions.items():
+            if version % compact_every == 0:
+                compact(board_id, version)
+        transaction.on_commit(lambda: publish_changes(versions, by_board))
+
+
+def compact(board_id, version):
+    """
+    Drops changes that fell out of the retained window. Clients asking for
+    anything older get a full snapshot instead.
+    """
+    BoardChange.objects.filter(board_id=board_id, seq__lte=version - changes_retained()).delete()
+
+
+def is_retained(board, since):
+    return board.version - changes_retained() <= since <= board.version
+
+
+def changes_since(board, since):
+    """
+    Changes of `board` after version `since` up to its loaded version, one
+    entry per object holding its latest state, or a tombstone if it was deleted.
+    """
+    from boards.serializers import BoardMemberSerializer, BoardSerializer, SectionSerializer, StickerSerializer
+
+    latest = OrderedDict()
+    rows = BoardChange.objects.filter(board=board, seq__gt=since, seq__lte=board.version) \
+        .values_list('seq', 'kind', 'object_id', 'action')
+    for seq, kind, object_id, action in rows:
+        # a later change of the same object supersedes the earlier ones,
+        # but an object created within the window is still reported as created
+        previous = latest.pop((kind, object_id), None)
+        if previous is not None and previous[1] == BoardChange.CREATED and action == BoardChange.UPDATED:
+            action = BoardChange.CREATED
+        latest[(kind, object_id)] = (seq, action)
+
+    live = defaultdict(set)
+    for (kind, object_id), (seq, action) in latest.items():
+        if action != BoardChange.DELETED:
+            live[kind].add(object_id)
+    objects = {
+        BoardChange.SECTION: Section.objects.filter(board=board, pk__in=live[BoardChange.SECTION])
+        .prefetch_related('stickers'),
+        BoardChange.STICKER: Sticker.objects.filter(section__board=board, pk__in=live[BoardChange.STICKER]),
+        BoardChange.MEMBER: User.objects.filter(guest_boards=board, pk__in=live[BoardChange.MEMBER]),
+    }
+    serializers = {
+        BoardChange.SECTION: SectionSerializer,
+        BoardChange.STICKER: StickerSerializer,
+        BoardChange.MEMBER: BoardMemberSerializer,
+    }
+    data = {
+        kind: {obj.pk: serializers[kind](obj).data for obj in queryset} if live[kind] else {}
+        for kind, queryset in objects.items()
+    }
+    if live[BoardChange.BOARD]:
+        data[BoardChange.BOARD] = {board.pk: BoardSerializer(board).data}
+
+    result = []
+    for (kind, object_id), (seq, action) in latest.items():
+        entry = {'seq': seq, 'kind': kind, 'id': object_id, 'action': action}
+        current = data.get(kind, {}).get(object_id)
+        if action == BoardChange.DELETED or current is None:
+            # gone since, or no longer part of this board
+            entry['action'] = BoardChange.DELETED
+        else:
+            entry['data'] = current
+        result.append(entry)
+    return result
@@ -0,0 +1,43 @@
+import hashlib
+
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def board_etag(request, board):
+    """
+    Strong ETag for a representation of `board` at its current version.
+    The path, query string and Accept header are folded in, so every page,
+    action and media type gets its own tag.
+    """
+    variant = '{}|{}'.format(request.get_full_path(), request.META.get('HTTP_ACCEPT', ''))
+    digest = hashlib.sha1(variant.encode()).hexdigest()[:16]
+    return '"{}-{}-{}"'.format(board.pk, board.version, digest)
+
+
+def etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(',')]
+    if '*' in candidates:
+        return True
+    # If-None-Match uses the weak comparison function
+    return any((candidate[2:] if candidate.startswith('W/') else candidate) == etag for candidate in candidates)
+
+
+class BoardConditionalMixin:
+    """
+    Conditional GET for responses that depend only on one board's state.
+    `build` is called only when the client's copy is out of date, so a 304
+    costs the board lookup and permission check and nothing else: views
+    load the board bare and prefetch its relations inside `build`.
+    """
+    def conditional_response(self, board, build):
+        etag = board_etag(self.request, board)
+        if etag_matches(self.request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response = build()
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+        return response
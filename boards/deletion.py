@@ -0,0 +1,169 @@
+"""
+Background deletion of boards and users.
+
+A delete request only marks the target, which takes a few small writes.
+For a board, `deleting` is set and its BoardAccess rows are removed, so
+every viewset's get_queryset (all of them filter through BoardAccess) and
+the membership cache stop seeing it together with its sections and
+stickers. For a user, the account is deactivated, which revokes their
+tokens as boards/tokens.py describes (DRF tokens at once, signed access
+tokens in other processes when they expire), and the boards they own are
+marked as above; boards a request still in flight creates for them
+afterwards are found and removed by the same job.
+
+A job (boards/jobs.py) then does the rest, removing stickers and
+sections in DELETION_BATCH_SIZE batches of plain DELETE statements. Each
+batch is its own short write transaction, so other writers get in
+between. Per-row signals are skipped, since nothing outside the board is
+left to notify. What remains is deleted through the ORM as before. Rows
+that belong to other boards (a deleted user's assigned stickers and guest
+memberships) are still logged in those boards' change logs. Every step
+can run again after a failed or interrupted attempt.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+
+from boards.changes import record_board_changes
+from boards.jobs import enqueue, extend, progress, start, task
+from boards.membership import membership_cache
+from boards.models import Board, BoardAccess, BoardChange, Job, Section, Sticker
+from boards.sqlite import run_with_write_retry
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def batch_size():
+    return getattr(settings, 'DELETION_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+
+def delete_board(board_id, requested_by=None):
+    """
+    Hides board `board_id` and queues its deletion; returns the Job.
+    """
+    hide_boards([board_id])
+    return enqueue(purge_board, board_id, target_id=board_id, requested_by=requested_by)
+
+
+def delete_user(user, requested_by=None):
+    """
+    Deactivates `user`, revoking their tokens, hides the boards they own
+    and queues the deletion of both; returns the Job.
+    """
+    user.is_active = False
+    user.save(update_fields=['is_active'])
+    hide_boards(owned_board_ids(user.pk), user.pk)
+    return enqueue(purge_user, user.pk, target_id=user.pk, requested_by=requested_by)
+
+
+def hide_boards(board_ids, user_id=None):
+    """
+    Marks `board_ids` as deleting and removes their access rows, and those
+    of `user_id` if given.
+    """
+    Board.objects.filter(pk__in=board_ids).update(deleting=True)
+    access = Q(board_id__in=board_ids)
+    if user_id is not None:
+        access |= Q(user_id=user_id)
+    BoardAccess.objects.filter(access).delete()
+    membership_cache.invalidate(board_ids)
+
+
+def owned_board_ids(user_id):
+    return list(Board.objects.filter(owner_id=user_id).values_list('id', flat=True))
+
+
+def pending_user_ids():
+    return Job.objects.filter(name=purge_user.task_name).exclude(state=Job.DONE).values('target_id')
+
+
+def sticker_rows(board_ids):
+    return Sticker.objects.filter(section__board_id__in=board_ids)
+
+
+def board_work(board_ids):
+    return sticker_rows(board_ids).count() + Section.objects.filter(board_id__in=board_ids).count() + len(board_ids)
+
+
+@task
+def purge_board(job, board_id):
+    start(job, board_work([board_id]))
+    remove_board(job, board_id)
+
+
+@task
+def purge_user(job, user_id):
+    board_ids = owned_board_ids(user_id)
+    assigned = Sticker.objects.filter(assigned_to_id=user_id).values_list('id', 'section__board_id')
+    start(job, board_work(board_ids) + assigned.exclude(section__board_id__in=board_ids).count() + 1)
+    while board_ids:
+        for board_id in board_ids:
+            remove_board(job, board_id)
+        # created by requests that were in flight when the user was deactivated
+        board_ids = owned_board_ids(user_id)
+        if board_ids:
+            hide_boards(board_ids)
+            extend(job, board_work(board_ids))
+    remove_user(job, user_id)
+
+
+def remove_board(job, board_id):
+    delete_in_batches(job, Sticker, sticker_rows([board_id]))
+    # a section that got a sticker meanwhile is left to the cascade below
+    delete_in_batches(job, Section, Section.objects.filter(board_id=board_id, stickers__isnull=True))
+
+    def delete():
+        # members, access rows, invites and the change log go with it
+        Board.objects.filter(pk=board_id).delete()
+        progress(job, 1)
+    run_with_write_retry(delete)
+
+
+def remove_user(job, user_id):
+    # stickers assigned to the user on boards that stay
+    def delete_assigned(rows):
+        ids = [sticker_id for sticker_id, _ in rows]
+        raw_delete(Sticker, ids)
+        record_board_changes([(board_id, BoardChange.STICKER, sticker_id, BoardChange.DELETED)
+                              for sticker_id, board_id in rows])
+        progress(job, len(ids))
+    assigned = Sticker.objects.filter(assigned_to_id=user_id).values_list('id', 'section__board_id')
+    while True:
+        rows = list(assigned[:batch_size()])
+        if not rows:
+            break
+        run_with_write_retry(lambda: delete_assigned(rows))
+
+    def delete():
+        # guest memberships go through the m2m signals, which log them
+        User(pk=user_id).guest_boards.clear()
+        User.objects.filter(pk=user_id).delete()
+        progress(job, 1)
+    run_with_write_retry(delete)
+
+
+def delete_in_batches(job, model, queryset):
+    ids = queryset.values_list('id', flat=True)
+    while True:
+        batch = list(ids[:batch_size()])
+        if not batch:
+            return
+
+        def delete():
+            raw_delete(model, batch)
+            progress(job, len(batch))
+        run_with_write_retry(delete)
+
+
+def raw_delete(model, ids):
+    """
+    DELETE by primary key without loading rows or sending signals.
+    """
+    if not ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE {} IN ({})'.format(
+            connection.ops.quote_name(model._meta.db_table), connection.ops.quote_name(model._meta.pk.column),
+            ', '.join(['%s'] * len(ids))), ids)
+
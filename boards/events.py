@@ -0,0 +1,339 @@
+"""
+Server-Sent Events stream of board changes, served from the ASGI app.
+
+    GET /boards/{id}/events/   (or /api/boards/{id}/events/)
+
+Every change recorded by boards.changes.record_board_changes is published
+to the board's subscribers once its transaction commits. Events only name
+the change (seq, kind, id, action); clients fetch the data through
+/boards/{id}/changes/?since=<last seq>.
+
+The default DatabaseBroker reads the events back from the change log, so
+subscribers see the changes of every process; InProcessBroker only fans
+out the changes made by its own process.
+"""
+import asyncio
+import json
+import logging
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+
+from boards.membership import membership_cache
+from boards.models import Board, BoardChange
+from boards.tokens import access_token_user
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BROKER = 'boards.events.DatabaseBroker'
+DEFAULT_BUFFER_SIZE = 256
+DEFAULT_HEARTBEAT = 15
+DEFAULT_POLL_INTERVAL = 0.5
+
+EVENTS_PATH = re.compile(r'^/(?:api/)?boards/(?P<board_id>\d+)/events/?$')
+
+
+class Subscription:
+    """
+    One connection's bounded event buffer. Events are pushed from any thread
+    and consumed on the connection's event loop; when the consumer falls
+    behind by more than `maxsize` events the buffer is dropped and replaced
+    by a single `resync` event.
+    """
+    def __init__(self, board_id, user_id, maxsize, loop):
+        self.board_id = board_id
+        self.user_id = user_id
+        self.maxsize = maxsize
+        self.loop = loop
+        self.buffer = deque()
+        self.ready = asyncio.Event()
+        self.overflowed = False
+
+    def push(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._push, event)
+        except RuntimeError:
+            # the connection's loop is gone
+            pass
+
+    def _push(self, event):
+        if self.overflowed:
+            return
+        if len(self.buffer) >= self.maxsize:
+            self.buffer.clear()
+            self.buffer.append({'type': 'resync', 'board': self.board_id})
+            self.overflowed = True
+        else:
+            self.buffer.append(event)
+        self.ready.set()
+
+    async def get(self):
+        await self.ready.wait()
+        events = list(self.buffer)
+        self.buffer.clear()
+        self.ready.clear()
+        self.overflowed = False
+        return events
+
+
+class InProcessBroker:
+    """
+    Fans the events published by this process out to its subscriptions.
+    Enough for a single worker process; changes made by other processes
+    are never seen.
+    """
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, board_id, user_id, maxsize=None, since=None):
+        """
+        `since` is the board version the subscriber has seen, if known.
+        """
+        if maxsize is None:
+            maxsize = getattr(settings, 'BOARD_EVENT_BUFFER_SIZE', DEFAULT_BUFFER_SIZE)
+        subscription = Subscription(board_id, user_id, maxsize, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions[board_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.board_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.board_id]
+
+    def publish(self, board_id, events):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(board_id, ()))
+        for subscription in subscriptions:
+            for event in events:
+                subscription.push(event)
+
+    def subscriber_count(self, board_id=None):
+        with self._lock:
+            if board_id is not None:
+                return len(self._subscriptions.get(board_id, ()))
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+class DatabaseBroker(InProcessBroker):
+    """
+    Delivers the changes logged by any process. While this process has
+    subscribers, one thread checks the versions of their boards every
+    BOARD_EVENT_POLL_INTERVAL seconds and reads the changes logged since the
+    last check; publishing does nothing. A board whose missed changes were
+    compacted away gets a `resync` event.
+    """
+    def __init__(self):
+        super().__init__()
+        self._seqs = {}
+        self._thread = None
+
+    def subscribe(self, board_id, user_id, maxsize=None, since=None):
+        subscription = super().subscribe(board_id, user_id, maxsize)
+        with self._lock:
+            if self._seqs.get(board_id) is None:
+                self._seqs[board_id] = since
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='board-events', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def publish(self, board_id, events):
+        pass
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    for board_id in set(self._seqs) - set(self._subscriptions):
+                        del self._seqs[board_id]
+                    if not self._seqs:
+                        self._thread = None
+                        return
+                    seqs = dict(self._seqs)
+                try:
+                    self.poll(seqs)
+                except Exception:
+                    logger.exception('Polling board changes failed')
+                    connection.close()
+                time.sleep(getattr(settings, 'BOARD_EVENT_POLL_INTERVAL', DEFAULT_POLL_INTERVAL))
+        finally:
+            connection.close()
+
+    def poll(self, seqs):
+        """
+        Delivers the changes of the boards in `seqs` logged after the
+        versions it maps them to (None for the current version).
+        """
+        from boards.changes import changes_retained
+
+        for board_id, version in Board.objects.filter(pk__in=seqs).values_list('id', 'version'):
+            since = seqs[board_id]
+            if since is not None and since < version:
+                if since < version - changes_retained():
+                    events = [{'type': 'resync', 'board': board_id}]
+                else:
+                    rows = BoardChange.objects.filter(board_id=board_id, seq__gt=since, seq__lte=version) \
+                        .values_list('seq', 'kind', 'object_id', 'action')
+                    events = [{'type': 'change', 'board': board_id, 'seq': seq, 'kind': kind, 'id': object_id,
+                               'action': action} for seq, kind, object_id, action in rows]
+                super().publish(board_id, events)
+            with self._lock:
+                if board_id in self._seqs:
+                    self._seqs[board_id] = version
+
+
+broker = SimpleLazyObject(lambda: import_string(getattr(settings, 'BOARD_EVENT_BROKER', DEFAULT_BROKER))())
+
+
+def publish_changes(versions, by_board):
+    """
+    Publishes logged changes; `versions` maps board id to the seq the
+    changes were logged under and `by_board` to (kind, object_id, action) lists.
+    """
+    for board_id, entries in by_board.items():
+        if board_id not in versions:
+            continue
+        broker.publish(board_id, [
+            {'type': 'change', 'board': board_id, 'seq': versions[board_id],
+             'kind': kind, 'id': object_id, 'action': action}
+            for kind, object_id, action in entries
+        ])
+
+
+class BoardEventsApplication:
+    """
+    ASGI application serving the event stream and passing every other
+    request on to `application`.
+    """
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        match = EVENTS_PATH.match(scope.get('path', '')) if scope['type'] == 'http' else None
+        if match is None or scope['method'] != 'GET':
+            return await self.application(scope, receive, send)
+        await self.stream(int(match.group('board_id')), scope, receive, send)
+
+    async def stream(self, board_id, scope, receive, send):
+        user_id = await sync_to_async(authenticate, thread_sensitive=True)(scope)
+        if user_id is None:
+            return await self.reject(send, 401, 'Authentication credentials were not provided.')
+        version = await sync_to_async(board_version, thread_sensitive=True)(board_id, user_id)
+        if version is None:
+            return await self.reject(send, 404, 'Not found.')
+
+        subscription = broker.subscribe(board_id, user_id, since=version)
+        disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+        heartbeat = getattr(settings, 'BOARD_EVENT_HEARTBEAT', DEFAULT_HEARTBEAT)
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no'),
+                ],
+            })
+            await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+            while True:
+                pending = asyncio.ensure_future(subscription.get())
+                done, _ = await asyncio.wait({pending, disconnect}, timeout=heartbeat,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if disconnect in done:
+                    pending.cancel()
+                    return
+                if pending not in done:
+                    pending.cancel()
+                    await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                    continue
+                events = pending.result()
+                await send({'type': 'http.response.body', 'body': encode_events(events), 'more_body': True})
+                if await self.lost_access(subscription, events):
+                    break
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            broker.unsubscribe(subscription)
+            disconnect.cancel()
+
+    @staticmethod
+    async def lost_access(subscription, events):
+        removed = any(event.get('kind') == 'member' and event.get('action') == 'deleted'
+                      and event.get('id') == subscription.user_id for event in events)
+        if not removed:
+            return False
+        return not await sync_to_async(membership_cache.has_access, thread_sensitive=True)(
+            subscription.board_id, subscription.user_id)
+
+    @staticmethod
+    async def reject(send, status, detail):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json')],
+        })
+        await send({'type': 'http.response.body', 'body': json.dumps({'detail': detail}).encode()})
+
+
+def authenticate(scope):
+    """
+    Resolves the user id of a signed access token or a DRF token given in the
+    Authorization header (`Bearer <token>`, `Token <key>`) or, for
+    EventSource clients that cannot set headers, in the `token` query
+    parameter.
+    """
+    from rest_framework.authtoken.models import Token
+
+    key = None
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            parts = value.decode('latin1').split()
+            if len(parts) == 2 and parts[0].lower() in ('token', 'bearer'):
+                key = parts[1]
+    if key is None:
+        key = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+    if not key:
+        return None
+    user = access_token_user(key)
+    if user is not None:
+        return user.pk
+    return Token.objects.filter(key=key, user__is_active=True).values_list('user_id', flat=True).first()
+
+
+def board_version(board_id, user_id):
+    """
+    Current version of the board if the user may see it, else None.
+    """
+    if not membership_cache.has_access(board_id, user_id):
+        return None
+    return Board.objects.filter(pk=board_id).values_list('version', flat=True).first()
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+def encode_events(events):
+    chunks = []
+    for event in events:
+        line = 'event: {}\ndata: {}\n'.format(event['type'], json.dumps(event))
+        if 'seq' in event:
+            line = 'id: {}\n'.format(event['seq']) + line
+        chunks.append(line + '\n')
+    return ''.join(chunks).encode()
@@ -0,0 +1,123 @@
+"""
+Sparse fieldsets and expansion of related objects.
+
+On GET requests, `?fields=title,owner` limits a ShapedSerializerMixin
+serializer to those fields, and `?expand=sections` renders the listed
+relations as nested objects instead of ids (expanded fields are always
+included). Unknown names are ignored. Only the top-level serializer is
+shaped: expanded objects use their serializer's full, unexpanded shape.
+
+`shape_queryset` loads exactly what the requested shape renders:
+`select_related` for to-one relations and a `Prefetch` of only the
+needed columns for id lists, so narrower requests run fewer queries.
+"""
+import sys
+
+from django.db.models import Prefetch
+from rest_framework.permissions import SAFE_METHODS
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def split_param(request, name):
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    return [item.strip() for item in value.split(',') if item.strip()] or None
+
+
+def requested_shape(request):
+    """
+    (fields, expand) asked for by `request`: fields is None for all of them.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None, ()
+    fields = split_param(request, FIELDS_PARAM)
+    expand = tuple(split_param(request, EXPAND_PARAM) or ())
+    if fields is not None:
+        fields = set(fields) | set(expand)
+    return fields, expand
+
+
+class ShapedSerializerMixin:
+    """
+    `expandable` maps a field to (serializer class name in the same module,
+    many); `relations` maps an id field to what renders it without extra
+    queries: a field path to select_related or a Prefetch.
+    """
+    expandable = {}
+    relations = {}
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None and expand is None:
+            fields, expand = requested_shape(self.context.get('request'))
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        for name in expand or ():
+            if name in self.fields and name in self.expandable:
+                nested, many = self.nested(name)
+                self.fields[name] = nested(many=many, read_only=True, fields=None, expand=())
+
+    @classmethod
+    def nested(cls, name):
+        serializer, many = cls.expandable[name]
+        return getattr(sys.modules[cls.__module__], serializer), many
+
+    @classmethod
+    def lookups(cls, fields=None, expand=(), prefix='', prefetched=False):
+        """
+        (select_related paths, prefetch_related lookups) that render the
+        given shape. Under a prefetched relation to-one relations are
+        prefetched too.
+        """
+        selects, prefetches = [], []
+        for name in cls.Meta.fields:
+            if fields is not None and name not in fields:
+                continue
+            path = prefix + name
+            if name in expand and name in cls.expandable:
+                nested, many = cls.nested(name)
+                if many:
+                    queryset = nested.Meta.model.objects.all()
+                    if not queryset.ordered:
+                        queryset = queryset.order_by('pk')
+                    prefetches.append(Prefetch(path, queryset=queryset))
+                else:
+                    (prefetches if prefetched else selects).append(path)
+                nested_selects, nested_prefetches = nested.lookups(
+                    prefix=path + '__', prefetched=prefetched or many)
+                selects += nested_selects
+                prefetches += nested_prefetches
+            elif name in cls.relations:
+                lookup = cls.relations[name]
+                if isinstance(lookup, Prefetch):
+                    prefetches.append(Prefetch(prefix + lookup.prefetch_through, queryset=lookup.queryset))
+                else:
+                    (prefetches if prefetched else selects).append(prefix + lookup)
+        return selects, prefetches
+
+
+def shape_lookups(serializer_class, request):
+    """
+    (select_related paths, prefetch_related lookups) of what
+    `serializer_class` renders for `request`.
+    """
+    if not hasattr(serializer_class, 'lookups'):
+        return [], []
+    fields, expand = requested_shape(request)
+    return serializer_class.lookups(fields, expand)
+
+
+def shape_queryset(queryset, serializer_class, request):
+    """
+    `queryset` loading what `serializer_class` renders for `request`,
+    replacing any earlier prefetches.
+    """
+    if not hasattr(serializer_class, 'lookups'):
+        return queryset
+    selects, prefetches = shape_lookups(serializer_class, request)
+    queryset = queryset.prefetch_related(None).prefetch_related(*prefetches)
+    return queryset.select_related(*selects) if selects else queryset
@@ -0,0 +1,194 @@
+"""
+Synthetic data for benchmarks and query-plan checks.
+
+Everything is written with batched bulk inserts, so model signals do not
+run: auth tokens and BoardAccess rows are inserted alongside the users and
+boards instead. The data only depends on the seed and the arguments;
+password salts, token keys and invite links are random as usual.
+"""
+import math
+import random
+import re
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+
+from boards.bulk import bulk_create_with_ids
+from boards.models import Board, BoardAccess, Section, Sticker
+
+DEFAULT_PASSWORD = 'Generated1'
+DEFAULT_BATCH_SIZE = 5000
+
+
+class Distribution:
+    """
+    Non-negative integer distribution parsed from `N` (fixed), `A-B`
+    (uniform) or `geometric:MEAN` (long tail, mostly small values).
+    """
+    def __init__(self, kind, a, b=None):
+        self.kind = kind
+        self.a = a
+        self.b = b
+
+    @classmethod
+    def parse(cls, value):
+        value = str(value).strip()
+        try:
+            if value.startswith('geometric:'):
+                mean = float(value.split(':', 1)[1])
+                if mean < 0:
+                    raise ValueError
+                return cls('geometric', mean)
+            if '-' in value:
+                low, high = (int(part) for part in value.split('-', 1))
+                if not 0 <= low <= high:
+                    raise ValueError
+                return cls('uniform', low, high)
+            if int(value) < 0:
+                raise ValueError
+            return cls('fixed', int(value))
+        except ValueError:
+            raise ValueError('Invalid distribution {!r}: use N, A-B or geometric:MEAN.'.format(value))
+
+    def sample(self, rng):
+        if self.kind == 'fixed':
+            return self.a
+        if self.kind == 'uniform':
+            return rng.randint(self.a, self.b)
+        if self.a == 0:
+            return 0
+        # number of failures before the first success, with the given mean
+        p = 1.0 / (self.a + 1.0)
+        return int(math.log(1.0 - rng.random()) / math.log(1.0 - p))
+
+    def __str__(self):
+        if self.kind == 'fixed':
+            return str(self.a)
+        if self.kind == 'uniform':
+            return '{}-{}'.format(self.a, self.b)
+        return 'geometric:{}'.format(self.a)
+
+
+class Generator:
+    """
+    Writes `users` users with tokens, then `boards` boards with guests,
+    sections and stickers. Boards are planned one by one and flushed in a
+    transaction whenever the pending rows reach `batch_size`.
+
+    Guests are drawn uniformly from all generated users. A sticker is
+    assigned with probability `assigned`, to a member of its board picked
+    with Zipf weights of exponent `assignee_skew` (0 picks uniformly), so
+    a few members of each board hold most of its stickers.
+    """
+    def __init__(self, seed=0, batch_size=DEFAULT_BATCH_SIZE, prefix='user', password=DEFAULT_PASSWORD, log=None):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.prefix = prefix
+        self.password = password
+        self.log = log or (lambda message: None)
+        self.counts = {'users': 0, 'boards': 0, 'members': 0, 'sections': 0, 'stickers': 0}
+
+    def generate(self, users, boards, members='0-5', sections='1-5', stickers='0-20',
+                 assignee_skew=1.0, assigned=0.5):
+        members, sections, stickers = (Distribution.parse(value) for value in (members, sections, stickers))
+        self.check_usernames(users)
+        user_ids = self.create_users(users)
+        if boards and not user_ids:
+            raise ValueError('Boards need at least one user.')
+        pending, size = [], 0
+        for index in range(boards):
+            plan = self.plan_board(index, user_ids, members, sections, stickers, assignee_skew, assigned)
+            pending.append(plan)
+            size += 1 + len(plan['members']) + len(plan['sections']) + sum(map(len, plan['sections']))
+            if size >= self.batch_size:
+                self.flush_boards(pending)
+                pending, size = [], 0
+        if pending:
+            self.flush_boards(pending)
+        return self.counts
+
+    def check_usernames(self, count):
+        taken = User.objects.filter(username__regex=r'^{}[0-9]+$'.format(re.escape(self.prefix)))
+        for username in taken.values_list('username', flat=True).iterator():
+            index = int(username[len(self.prefix):])
+            if index < count and username == self.username(index):
+                raise ValueError('User {} already exists; choose another --prefix.'.format(username))
+
+    def username(self, index):
+        return '{}{}'.format(self.prefix, index)
+
+    def create_users(self, count):
+        password = make_password(self.password)
+        user_ids = []
+        for start in range(0, count, self.batch_size):
+            with transaction.atomic():
+                batch = bulk_create_with_ids(User, [
+                    User(username=self.username(index), password=password)
+                    for index in range(start, min(count, start + self.batch_size))
+                ])
+                # stands in for the per-user create_auth_token signal
+                tokens = [Token(user_id=user.pk) for user in batch]
+                for token in tokens:
+                    token.key = token.generate_key()
+                Token.objects.bulk_create(tokens)
+            user_ids.extend(user.pk for user in batch)
+            self.counts['users'] += len(batch)
+            self.log('users: {}/{}'.format(self.counts['users'], count))
+        return user_ids
+
+    def plan_board(self, index, user_ids, members, sections, stickers, assignee_skew, assigned):
+        rng = self.rng
+        owner_id = rng.choice(user_ids)
+        guests = set()
+        wanted = min(members.sample(rng), len(user_ids) - 1)
+        while len(guests) < wanted:
+            user_id = rng.choice(user_ids)
+            if user_id != owner_id:
+                guests.add(user_id)
+        guests = sorted(guests)
+        # owner first, so with skew the owner tends to hold the most stickers
+        people = [owner_id] + guests
+        weights = [1.0 / (rank + 1) ** assignee_skew for rank in range(len(people))]
+        planned = []
+        for _ in range(sections.sample(rng)):
+            planned.append([
+                rng.choices(people, weights)[0] if rng.random() < assigned else None
+                for _ in range(stickers.sample(rng))
+            ])
+        return {'title': 'Board {}'.format(index), 'owner_id': owner_id, 'members': guests, 'sections': planned}
+
+    def flush_boards(self, plans):
+        with transaction.atomic():
+            boards = bulk_create_with_ids(Board, [
+                Board(title=plan['title'], owner_id=plan['owner_id'])
+                for plan in plans
+            ])
+            access = []
+            guests = []
+            sections = []
+            for board, plan in zip(boards, plans):
+                access.append(BoardAccess(user_id=board.owner_id, board_id=board.pk, role=BoardAccess.OWNER))
+                for user_id in plan['members']:
+                    guests.append(Board.users.through(board_id=board.pk, user_id=user_id))
+                    access.append(BoardAccess(user_id=user_id, board_id=board.pk, role=BoardAccess.GUEST))
+                for position, _ in enumerate(plan['sections'], 1):
+                    sections.append(Section(title='Section {}'.format(position), board_id=board.pk,
+                                            position=float(position)))
+            Board.users.through.objects.bulk_create(guests)
+            BoardAccess.objects.bulk_create(access)
+            sections = bulk_create_with_ids(Section, sections)
+            assignees = [section for plan in plans for section in plan['sections']]
+            Sticker.objects.bulk_create([
+                Sticker(title='Sticker {}'.format(position), text='Text', section_id=section.pk,
+                        assigned_to_id=assignee, position=float(position))
+                for section, planned in zip(sections, assignees)
+                for position, assignee in enumerate(planned, 1)
+            ])
+        self.counts['boards'] += len(boards)
+        self.counts['members'] += len(guests)
+        self.counts['sections'] += len(sections)
+        self.counts['stickers'] += sum(map(len, assignees))
+        self.log('boards: {boards}, members: {members}, sections: {sections}, stickers: {stickers}'.format(
+            **self.counts))
@@ -0,0 +1,93 @@
+"""
+Board invites.
+
+`redeem` finds the invite token with one indexed lookup, which also
+checks existing membership through BoardAccess. It then consumes one use
+with a conditional UPDATE, so concurrent redemptions can never exceed
+`max_uses`. Finally it inserts the membership row directly, sending the
+m2m_changed signals that `board.users.add()` would send, so access rows,
+the change log and the membership cache stay in sync. The board row is
+not loaded or saved.
+
+A board's legacy `invite_link` still works: it is single-use and rotated
+with one UPDATE on each join.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Exists, F, OuterRef, Q
+from django.db.models.signals import m2m_changed
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from boards.models import Board, BoardAccess, BoardInvite
+
+DEFAULT_INVITE_TTL = 7 * 24 * 3600
+
+
+class InviteUnavailable(Exception):
+    pass
+
+
+def create_invite(board, user_id, expires_in=None, max_uses=None):
+    """
+    New invite to `board`, valid for `expires_in` seconds (BOARD_INVITE_TTL
+    by default; 0 for no expiry) and `max_uses` joins (no limit when None).
+    """
+    if expires_in is None:
+        expires_in = getattr(settings, 'BOARD_INVITE_TTL', DEFAULT_INVITE_TTL)
+    expires_at = timezone.now() + timedelta(seconds=expires_in) if expires_in else None
+    return BoardInvite.objects.create(board=board, created_by_id=user_id, expires_at=expires_at, max_uses=max_uses)
+
+
+def redeem(token, user_id):
+    """
+    Makes `user_id` a member of the board `token` invites to and returns
+    the board id, or None if there is no such token. Members and the owner
+    get the board id without using up the invite. Raises InviteUnavailable
+    for an expired or used up invite.
+    """
+    member = Exists(BoardAccess.objects.filter(board_id=OuterRef('board_id'), user_id=user_id))
+    invite = BoardInvite.objects.filter(token=token, board__deleting=False).annotate(member=member) \
+        .values('id', 'board_id', 'expires_at', 'member').first()
+    if invite is None:
+        return redeem_link(token, user_id)
+    if invite['member']:
+        return invite['board_id']
+    now = timezone.now()
+    if invite['expires_at'] is not None and invite['expires_at'] <= now:
+        raise InviteUnavailable('This invite has expired')
+    consumed = BoardInvite.objects.filter(pk=invite['id']) \
+        .filter(Q(max_uses__isnull=True) | Q(uses__lt=F('max_uses'))) \
+        .filter(Q(expires_at__isnull=True) | Q(expires_at__gt=now)) \
+        .update(uses=F('uses') + 1)
+    if not consumed:
+        raise InviteUnavailable('This invite has been used up')
+    add_member(invite['board_id'], user_id)
+    return invite['board_id']
+
+
+def redeem_link(link, user_id):
+    member = Exists(BoardAccess.objects.filter(board_id=OuterRef('pk'), user_id=user_id))
+    board = Board.objects.filter(invite_link=link, deleting=False).annotate(member=member).values('id', 'member').first()
+    if board is None:
+        return None
+    if not board['member']:
+        Board.objects.filter(pk=board['id']).update(invite_link=get_random_string())
+        add_member(board['id'], user_id)
+    return board['id']
+
+
+def add_member(board_id, user_id):
+    """
+    `Board.users.add(user_id)` without loading the board or re-checking
+    existing rows.
+    """
+    through = Board.users.through
+    board = Board(pk=board_id)
+    signal = {'sender': through, 'instance': board, 'reverse': False, 'model': User,
+              'pk_set': {user_id}, 'using': through.objects.db}
+    m2m_changed.send(action='pre_add', **signal)
+    through.objects.create(board_id=board_id, user_id=user_id)
+    m2m_changed.send(action='post_add', **signal)
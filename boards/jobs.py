@@ -0,0 +1,238 @@
+"""
+Background jobs stored in the database.
+
+A job is a call of a function registered with `@task`, stored as a Job row
+by `enqueue` in the caller's transaction, so it exists exactly when the
+work that asked for it committed. Tasks take the Job as first argument,
+followed by the JSON-encoded arguments given to `enqueue`, and may report
+`progress` after `start`.
+
+Workers (`manage.py run_jobs`) claim the highest-priority due job with a
+conditional UPDATE and run it. A failing job is retried with exponential
+backoff until it has run `max_attempts` times, then marked failed. A
+claim holds a lease of JOBS_LEASE seconds; if the worker dies, the job is
+claimed again once the lease expires, so tasks must be safe to run twice.
+
+With JOBS_IN_PROCESS on, every process that enqueues jobs also runs them
+in one background thread after commit, for setups without dedicated
+workers.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from boards.models import Job
+from boards.sqlite import run_with_write_retry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_LEASE = 600
+DEFAULT_RETRY_BACKOFF = 5
+DEFAULT_RETRY_BACKOFF_MAX = 600
+DEFAULT_POLL_INTERVAL = 1.0
+
+
+def task(func=None, max_attempts=None, priority=0):
+    """
+    Registers `func` as a task, optionally with its default retry limit and
+    priority; usable as `@task` or `@task(max_attempts=5)`.
+    """
+    if func is None:
+        return lambda func: task(func, max_attempts, priority)
+    func.task_name = '{}.{}'.format(func.__module__, func.__qualname__)
+    func.task_max_attempts = max_attempts
+    func.task_priority = priority
+    return func
+
+
+def enqueue(func, *args, priority=None, delay=0, max_attempts=None, target_id=None, requested_by=None):
+    """
+    Stores a call of task `func` with `args` to run `delay` seconds from now
+    and returns its Job.
+    """
+    if max_attempts is None:
+        max_attempts = func.task_max_attempts or getattr(settings, 'JOBS_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    job = Job.objects.create(
+        name=func.task_name, args=json.dumps(args), priority=func.task_priority if priority is None else priority,
+        max_attempts=max_attempts, run_at=timezone.now() + timedelta(seconds=delay), target_id=target_id,
+        requested_by_id=requested_by,
+    )
+    if getattr(settings, 'JOBS_IN_PROCESS', True):
+        transaction.on_commit(in_process.notify)
+    return job
+
+
+def start(job, total):
+    """
+    Sets the amount of work `job` has to do, restarting its progress.
+    """
+    Job.objects.filter(pk=job.pk).update(progress=0, total=total)
+
+
+def extend(job, more):
+    """
+    Adds `more` to the amount of work `job` has to do.
+    """
+    Job.objects.filter(pk=job.pk).update(total=F('total') + more)
+
+
+def progress(job, done):
+    Job.objects.filter(pk=job.pk).update(progress=F('progress') + done)
+
+
+def resolve(name):
+    func = import_string(name)
+    if getattr(func, 'task_name', None) != name:
+        raise ImportError('{} is not a registered task'.format(name))
+    return func
+
+
+def retry_delay(attempt):
+    backoff = getattr(settings, 'JOBS_RETRY_BACKOFF', DEFAULT_RETRY_BACKOFF)
+    return min(getattr(settings, 'JOBS_RETRY_BACKOFF_MAX', DEFAULT_RETRY_BACKOFF_MAX), backoff * 2 ** (attempt - 1))
+
+
+class Worker:
+    """
+    Runs due jobs on `threads` threads until `stop` is called, or with
+    `burst` until none are due; a job that has started is always finished
+    first.
+    """
+    def __init__(self, threads=1, poll_interval=None, name=None, burst=False):
+        self.threads = threads
+        self.burst = burst
+        self.poll_interval = poll_interval or getattr(settings, 'JOBS_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+        self.name = name or '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.stopping = threading.Event()
+        self.processed = 0
+        self._lock = threading.Lock()
+
+    def run(self):
+        threads = [threading.Thread(target=self.loop, name='job-worker-{}'.format(index))
+                   for index in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def stop(self):
+        self.stopping.set()
+
+    def loop(self):
+        try:
+            while not self.stopping.is_set():
+                if not self.run_one():
+                    if self.burst:
+                        return
+                    self.stopping.wait(self.poll_interval)
+        finally:
+            connection.close()
+
+    def drain(self):
+        """
+        Runs due jobs until there are none; returns how many ran.
+        """
+        count = 0
+        while not self.stopping.is_set() and self.run_one():
+            count += 1
+        return count
+
+    def run_one(self):
+        job = self.claim()
+        if job is None:
+            return False
+        self.execute(job)
+        with self._lock:
+            self.processed += 1
+        return True
+
+    def claim(self):
+        while True:
+            now = timezone.now()
+            due = Q(state=Job.PENDING, run_at__lte=now) | Q(state=Job.RUNNING, lease_expires__lt=now)
+            job = Job.objects.filter(due).order_by('-priority', 'run_at', 'id').first()
+            if job is None:
+                return None
+            lease = timedelta(seconds=getattr(settings, 'JOBS_LEASE', DEFAULT_LEASE))
+            claimed = run_with_write_retry(lambda: Job.objects.filter(due, pk=job.pk).update(
+                state=Job.RUNNING, attempts=F('attempts') + 1, started=now, lease_expires=now + lease,
+                worker=self.name,
+            ))
+            if claimed:
+                job.refresh_from_db()
+                return job
+
+    def execute(self, job):
+        try:
+            result = resolve(job.name)(job, *json.loads(job.args))
+        except Exception as error:
+            logger.exception('Job %s (%s) failed on attempt %s', job.pk, job.name, job.attempts)
+            connection.close_if_unusable_or_obsolete()
+            self.fail(job, error)
+        else:
+            run_with_write_retry(lambda: Job.objects.filter(pk=job.pk, worker=self.name).update(
+                state=Job.DONE, result=json.dumps(result), error='', finished=timezone.now(), lease_expires=None,
+            ))
+
+    def fail(self, job, error):
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            fields = {'state': Job.PENDING, 'run_at': now + timedelta(seconds=retry_delay(job.attempts))}
+        else:
+            fields = {'state': Job.FAILED, 'finished': now}
+        run_with_write_retry(lambda: Job.objects.filter(pk=job.pk, worker=self.name).update(
+            error='{}: {}'.format(type(error).__name__, error), lease_expires=None, **fields))
+
+
+class InProcessRunner:
+    """
+    One background thread per process that runs jobs while any are pending,
+    waiting for retries that are due soon, and exits once none are left.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wake = False
+
+    def notify(self):
+        with self._lock:
+            self._wake = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='job-runner', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        worker = Worker(name='{}:{}:in-process'.format(socket.gethostname(), os.getpid()))
+        try:
+            while True:
+                with self._lock:
+                    if not self._wake:
+                        self._thread = None
+                        return
+                    self._wake = False
+                worker.drain()
+                next_run = Job.objects.filter(state=Job.PENDING).aggregate(next_run=Min('run_at'))['next_run']
+                if next_run is not None:
+                    time.sleep(max(0.0, (next_run - timezone.now()).total_seconds()))
+                    with self._lock:
+                        self._wake = True
+        except Exception:
+            logger.exception('In-process job runner failed')
+            with self._lock:
+                self._thread = None
+        finally:
+            connection.close()
+
+
+in_process = InProcessRunner()
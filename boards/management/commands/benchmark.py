@@ -0,0 +1,190 @@
+import json
+import os
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connections
+
+from boards import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Seeds a scratch database, replays a mix of API calls and reports latency, throughput and query counts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--boards', type=int, default=20)
+        parser.add_argument('--sections', type=int, default=5, help='Sections per board.')
+        parser.add_argument('--stickers', type=int, default=20, help='Stickers per section.')
+        parser.add_argument('--members', type=int, default=5, help='Guests per board.')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--mix', help='Endpoint weights, e.g. "board_list=5,sticker_update=1".')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Replay the in-process mix from this many forked processes sharing the database.')
+        parser.add_argument('--threads', type=int, default=1, help='Client threads per in-process worker.')
+        parser.add_argument('--write-queue', action='store_true',
+                            help='Repeat the in-process runs with writes going through the single-writer queue.')
+        parser.add_argument('--sqlite-baseline', action='store_true',
+                            help='Repeat the in-process runs without the SQLite production profile.')
+        parser.add_argument('--gunicorn', action='store_true',
+                            help='Also run the mix over HTTP against a locally spawned gunicorn.')
+        parser.add_argument('--workers', type=int, default=2, help='gunicorn workers.')
+        parser.add_argument('--asgi', action='store_true',
+                            help='Also compare the ASGI application against --threads sync workers with slow clients; '
+                                 'uses the read-only mix unless --mix is given.')
+        parser.add_argument('--client-delay', type=float, default=0.05,
+                            help='Seconds each slow client holds its connection after the response.')
+        parser.add_argument('--connections', type=int, default=100, help='Concurrent connections for the ASGI run.')
+        parser.add_argument('--concurrency', type=int, default=4, help='Client threads for the gunicorn run.')
+        parser.add_argument('--read-models', action='store_true',
+                            help='Also report rows/s of list serialization with and without the read models.')
+        parser.add_argument('--save', help='Write the report as JSON to this file.')
+        parser.add_argument('--compare', help='Compare against a report saved with --save.')
+        parser.add_argument('--threshold', type=float, default=0.10,
+                            help='Relative p95 growth that counts as a regression.')
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix']) if options['mix'] else benchmark.DEFAULT_MIX
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        reports = {}
+        profiles = [('', {})]
+        if options['write_queue']:
+            profiles.append(('write-queue/', {'SQLITE_WRITE_QUEUE': True}))
+        if options['sqlite_baseline']:
+            profiles.append(('baseline/', benchmark.SQLITE_BASELINE))
+        for prefix, overrides in profiles:
+            with sqlite_profile(overrides):
+                reports.update({prefix + name: report for name, report in self.run_profile(
+                    options, mix, gunicorn=options['gunicorn'] and not overrides,
+                    asgi=options['asgi'] and not overrides,
+                    read_models=options['read_models'] and not overrides).items()})
+
+        for name, report in reports.items():
+            self.stdout.write('[{}]'.format(name))
+            self.stdout.write(benchmark.format_report(report))
+            self.stdout.write('')
+
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump(reports, f, indent=2)
+
+        if baseline is not None:
+            regressed = []
+            for name, report in reports.items():
+                if name not in baseline:
+                    continue
+                rows, worse = benchmark.compare(report, baseline[name], options['threshold'])
+                self.stdout.write('[{} vs baseline]'.format(name))
+                for endpoint, before, after, p95_change, rps_change in rows:
+                    self.stdout.write('{:<18} p95 {:>9.2f} -> {:>9.2f} ms ({:+.1%}){}'.format(
+                        endpoint, before, after, p95_change,
+                        '' if rps_change is None else ', rps {:+.1%}'.format(rps_change)))
+                regressed += ['{}:{}'.format(name, endpoint) for endpoint in worse]
+            if regressed:
+                raise CommandError('p95 regressed by more than {:.0%}: {}'.format(
+                    options['threshold'], ', '.join(regressed)))
+
+
+    def run_profile(self, options, mix, gunicorn, asgi, read_models):
+        fd, db_name = tempfile.mkstemp(suffix='.sqlite3', prefix='boards-bench-')
+        os.close(fd)
+        original = settings.DATABASES['default']['NAME']
+        reports = {}
+        try:
+            use_database(db_name)
+            call_command('migrate', verbosity=0, interactive=False)
+            workload = benchmark.seed(
+                users=options['users'], boards=options['boards'], sections_per_board=options['sections'],
+                stickers_per_section=options['stickers'], members_per_board=options['members'], seed=options['seed'],
+            )
+            if options['processes'] > 1:
+                reports['in-process x{}'.format(options['processes'])] = benchmark.run_processes(
+                    workload, options['requests'], mix, options['processes'], seed=options['seed'],
+                    concurrency=options['threads'])
+            else:
+                reports['in-process'] = benchmark.run(
+                    benchmark.InProcessTarget(), workload, options['requests'], mix,
+                    concurrency=options['threads'], rng=random.Random(options['seed']))
+            if gunicorn:
+                with benchmark.Gunicorn(db_name, workers=options['workers']) as server:
+                    reports['gunicorn'] = benchmark.run(
+                        benchmark.HttpTarget(server.base_url), workload, options['requests'], mix,
+                        concurrency=options['concurrency'], rng=random.Random(options['seed']))
+            if read_models:
+                for name, (rows, before, after) in benchmark.read_model_throughput().items():
+                    self.stdout.write('{:<8} {:>7} rows  serializer {:>9.0f} rows/s  read model {:>9.0f} rows/s'
+                                      '  x{:.1f}'.format(name, rows, before, after, after / before))
+            if asgi:
+                reports.update(compare_asgi(options, workload, mix if options['mix'] else benchmark.READ_MIX))
+        finally:
+            use_database(original)
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(db_name + suffix):
+                    os.unlink(db_name + suffix)
+        return reports
+
+
+def compare_asgi(options, workload, mix):
+    """
+    The same calls through sync worker threads and through the ASGI
+    application, both with slow clients.
+    """
+    from inernSite.asgi import application
+
+    delay = options['client_delay']
+    calls = benchmark.draw_calls(workload, options['requests'], mix, random.Random(options['seed']))
+    started = time.perf_counter()
+    samples = benchmark.replay(benchmark.SlowClient(benchmark.InProcessTarget(), delay), calls, options['threads'])
+    reports = {'wsgi x{}'.format(options['threads']): benchmark.summarize(samples, time.perf_counter() - started)}
+    calls = benchmark.draw_calls(workload, options['requests'], mix, random.Random(options['seed']))
+    started = time.perf_counter()
+    samples = benchmark.run_asgi(application, calls, options['connections'], delay)
+    reports['asgi'] = benchmark.summarize(samples, time.perf_counter() - started)
+    return reports
+
+
+@contextmanager
+def sqlite_profile(overrides):
+    """
+    Temporarily applies SQLite settings such as `benchmark.SQLITE_BASELINE`.
+    """
+    connection = connections['default']
+    saved = {name: getattr(settings, name) for name in overrides if name != 'CONN_MAX_AGE'}
+    saved_age = connection.settings_dict['CONN_MAX_AGE']
+    for name, value in overrides.items():
+        if name == 'CONN_MAX_AGE':
+            connection.settings_dict['CONN_MAX_AGE'] = value
+        else:
+            setattr(settings, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(settings, name, value)
+        connection.settings_dict['CONN_MAX_AGE'] = saved_age
+
+
+def use_database(name):
+    connections['default'].close()
+    settings.DATABASES['default']['NAME'] = name
+    connections['default'].settings_dict['NAME'] = name
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        endpoint, _, weight = item.partition('=')
+        if endpoint not in benchmark.ENDPOINTS:
+            raise CommandError('Unknown endpoint {!r}; choose from {}.'.format(
+                endpoint, ', '.join(benchmark.ENDPOINTS)))
+        mix[endpoint] = int(weight or 1)
+    return mix
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+
+from boards.generate import DEFAULT_BATCH_SIZE, DEFAULT_PASSWORD, Distribution, Generator
+
+
+class Command(BaseCommand):
+    help = ('Generates synthetic users, boards, members, sections and stickers with bulk inserts. '
+            'Distributions are N (fixed), A-B (uniform) or geometric:MEAN.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--boards', type=int, default=100)
+        parser.add_argument('--members', default='0-5', help='Guests per board.')
+        parser.add_argument('--sections', default='1-5', help='Sections per board.')
+        parser.add_argument('--stickers', default='0-20', help='Stickers per section.')
+        parser.add_argument('--assignee-skew', type=float, default=1.0,
+                            help='Zipf exponent for picking a sticker assignee among board members; 0 is uniform.')
+        parser.add_argument('--assigned', type=float, default=0.5, help='Share of stickers with an assignee.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--prefix', default='user', help='Username prefix; usernames are <prefix><n>.')
+        parser.add_argument('--password', default=DEFAULT_PASSWORD, help='Password of every generated user.')
+
+    def handle(self, *args, **options):
+        try:
+            for name in ('members', 'sections', 'stickers'):
+                Distribution.parse(options[name])
+        except ValueError as error:
+            raise CommandError(error)
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        if not 0 <= options['assigned'] <= 1:
+            raise CommandError('--assigned must be between 0 and 1.')
+
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        generator = Generator(seed=options['seed'], batch_size=options['batch_size'], prefix=options['prefix'],
+                              password=options['password'], log=log)
+        started = time.monotonic()
+        try:
+            counts = generator.generate(
+                options['users'], options['boards'], members=options['members'], sections=options['sections'],
+                stickers=options['stickers'], assignee_skew=options['assignee_skew'], assigned=options['assigned'],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write('Created {users} users, {boards} boards, {members} members, {sections} sections and '
+                          '{stickers} stickers in {seconds:.1f}s.'.format(
+                              seconds=time.monotonic() - started, **counts))
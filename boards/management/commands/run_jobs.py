@@ -0,0 +1,54 @@
+import multiprocessing
+import signal
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import connections
+
+from boards.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = 'Runs background jobs (boards/jobs.py) until SIGTERM or Ctrl-C, finishing the jobs already started.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=1, help='Worker threads per process.')
+        parser.add_argument('--processes', type=int, default=1, help='Forked worker processes.')
+        parser.add_argument('--poll-interval', type=float, help='Seconds between polls while no job is due.')
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is due.')
+
+    def handle(self, *args, **options):
+        # this process runs them already
+        settings.JOBS_IN_PROCESS = False
+        if options['processes'] <= 1:
+            processed = work(options['threads'], options['poll_interval'], options['burst'])
+            self.stdout.write('Ran {} jobs.'.format(processed))
+            return
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        children = [
+            context.Process(target=work, args=(options['threads'], options['poll_interval'], options['burst']))
+            for _ in range(options['processes'])
+        ]
+        for child in children:
+            child.start()
+
+        def forward(signum, frame):
+            for child in children:
+                if child.is_alive():
+                    child.terminate()
+        signal.signal(signal.SIGTERM, forward)
+        signal.signal(signal.SIGINT, forward)
+        for child in children:
+            child.join()
+
+
+def work(threads, poll_interval, burst):
+    worker = Worker(threads, poll_interval, burst=burst)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+    try:
+        worker.run()
+    finally:
+        connections.close_all()
+    return worker.processed
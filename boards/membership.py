@@ -0,0 +1,114 @@
+import threading
+import time
+
+from django.conf import settings
+
+DEFAULT_MEMBERSHIP_CACHE_TTL = 60
+
+
+class BoardMembershipCache:
+    """
+    Per-process cache of board access: board id -> (owner id, member ids).
+
+    Entries are dropped by the signal receivers in boards/signals.py whenever
+    board ownership or membership changes; the TTL bounds staleness for
+    changes made by other worker processes. Checks with `fresh` read
+    BoardAccess instead, so such changes count at once; writes use them.
+    """
+    def __init__(self, ttl=None):
+        self._ttl = ttl
+        self._entries = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return getattr(settings, 'BOARD_MEMBERSHIP_CACHE_TTL', DEFAULT_MEMBERSHIP_CACHE_TTL)
+
+    def get(self, board_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(board_id)
+            if entry is not None and entry[2] > now:
+                self.hits += 1
+                return entry[0], entry[1]
+            self.misses += 1
+            generation = self._generation
+        owner_id, member_ids = self._load(board_id)
+        with self._lock:
+            # a concurrent invalidation means the rows we read may already be stale
+            if generation == self._generation:
+                self._entries[board_id] = (owner_id, member_ids, now + self.ttl)
+        return owner_id, member_ids
+
+    def is_owner(self, board_id, user_id, fresh=False):
+        if fresh:
+            return self._has_role(board_id, user_id, owner=True)
+        return user_id is not None and self.get(board_id)[0] == user_id
+
+    def is_member(self, board_id, user_id):
+        return user_id in self.get(board_id)[1]
+
+    def peek(self, board_id):
+        """
+        Like `get`, but returns None instead of loading a missing entry.
+        """
+        with self._lock:
+            entry = self._entries.get(board_id)
+            if entry is not None and entry[2] > time.monotonic():
+                self.hits += 1
+                return entry[0], entry[1]
+        return None
+
+    def has_access(self, board_id, user_id, fresh=False):
+        if fresh:
+            return self._has_role(board_id, user_id)
+        owner_id, member_ids = self.get(board_id)
+        return user_id is not None and (owner_id == user_id or user_id in member_ids)
+
+    def invalidate(self, board_ids=None):
+        with self._lock:
+            self._generation += 1
+            if board_ids is None:
+                self._entries.clear()
+            else:
+                for board_id in board_ids:
+                    self._entries.pop(board_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+            }
+
+    @staticmethod
+    def _has_role(board_id, user_id, owner=False):
+        from boards.models import BoardAccess
+
+        if user_id is None:
+            return False
+        access = BoardAccess.objects.filter(board_id=board_id, user_id=user_id, board__deleting=False)
+        if owner:
+            access = access.filter(role=BoardAccess.OWNER)
+        return access.exists()
+
+    @staticmethod
+    def _load(board_id):
+        from boards.models import Board
+
+        owner_id = Board.objects.filter(pk=board_id, deleting=False).values_list('owner_id', flat=True).first()
+        if owner_id is None:
+            return None, frozenset()
+        member_ids = frozenset(
+            Board.users.through.objects.filter(board_id=board_id).values_list('user_id', flat=True)
+        )
+        return owner_id, member_ids
+
+
+membership_cache = BoardMembershipCache()
@@ -0,0 +1,306 @@
+"""
+Prometheus-style request metrics, served at /metrics in the text
+exposition format.
+
+Per route (URL name) this counts requests by status and keeps latency
+histograms of the whole request and of its phases: authentication,
+permission checks, DB time and serialization. Phases are wall time and
+may overlap: a query run while checking permissions counts towards both
+`permissions` and `db`.
+
+Values live in memory. With several worker processes, set
+METRICS_MULTIPROCESS_DIR (or BOARDS_METRICS_DIR in the environment) to a
+directory shared by the workers: each process then writes its values to
+its own file there at most every METRICS_FLUSH_INTERVAL seconds and at
+exit, and /metrics adds up all files. Files of exited workers are kept so
+that counters do not go backwards; empty the directory when the server
+starts (e.g. from gunicorn's `on_starting` hook).
+
+/metrics answers staff users (session login), clients whose address is in
+METRICS_ALLOWED_IPS and requests with `Authorization: Bearer <METRICS_TOKEN>`;
+everyone else gets 404.
+"""
+import atexit
+import bisect
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'boards_http_requests_total': ('counter', 'Requests by route, method and status.', ('route', 'method', 'status')),
+    'boards_http_request_duration_seconds': ('histogram', 'Request latency.', ('route', 'method')),
+    'boards_http_request_phase_seconds': (
+        'histogram', 'Time spent per request in authentication, permissions, db and serialization.',
+        ('route', 'phase')),
+    'boards_db_queries_total': ('counter', 'Database queries by route.', ('route',)),
+    'boards_cache_hits_total': ('counter', 'Per-process cache hits.', ('cache',)),
+    'boards_cache_misses_total': ('counter', 'Per-process cache misses.', ('cache',)),
+    'boards_cache_evictions_total': ('counter', 'Entries evicted to stay within the size limit.', ('cache',)),
+    'boards_cache_bytes': ('gauge', 'Memory held by cached response bodies.', ('cache',)),
+}
+
+
+def multiprocess_dir():
+    return getattr(settings, 'METRICS_MULTIPROCESS_DIR', None) or os.environ.get('BOARDS_METRICS_DIR')
+
+
+class Registry:
+    """
+    Counters and histograms of this process, keyed by metric name and a
+    tuple of label values.
+    """
+    def __init__(self):
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._flushed = 0.0
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self._counters[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = [[0] * len(BUCKETS), 0.0, 0]
+            index = bisect.bisect_left(BUCKETS, value)
+            if index < len(BUCKETS):
+                histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self._counters.items()]
+            histograms = [[name, list(labels), list(buckets), total, count]
+                          for (name, labels), (buckets, total, count) in self._histograms.items()]
+        counters.extend(cache_counters())
+        return {'counters': counters, 'histograms': histograms}
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def maybe_flush(self):
+        directory = multiprocess_dir()
+        if not directory:
+            return
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+        now = time.monotonic()
+        if now - self._flushed >= interval:
+            self._flushed = now
+            self.flush(directory)
+
+    def flush(self, directory=None):
+        directory = directory or multiprocess_dir()
+        if not directory:
+            return
+        path = process_file(directory, os.getpid())
+        temporary = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temporary, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temporary, path)
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+def process_file(directory, pid):
+    return os.path.join(directory, 'metrics-{}.json'.format(pid))
+
+
+def cache_counters():
+    from boards.authentication import credential_cache
+    from boards.membership import membership_cache
+    from boards.responsecache import response_cache
+
+    counters = []
+    response = response_cache.stats()
+    for cache, stats in (('membership', membership_cache.stats()), ('basic_auth', credential_cache.stats()),
+                         ('response', response)):
+        counters.append(['boards_cache_hits_total', [cache], stats['hits']])
+        counters.append(['boards_cache_misses_total', [cache], stats['misses']])
+    counters.append(['boards_cache_evictions_total', ['response'], response['evictions']])
+    counters.append(['boards_cache_bytes', ['response'], response['bytes']])
+    return counters
+
+
+def collect():
+    """
+    Values of this process plus, in multiprocess mode, those last written
+    by every other process.
+    """
+    snapshots = [registry.snapshot()]
+    directory = multiprocess_dir()
+    if directory:
+        own = process_file(directory, os.getpid())
+        for path in glob.glob(process_file(directory, '*')):
+            if path == own:
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # removed or being replaced meanwhile
+                continue
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[(name, tuple(labels))] += value
+        for name, labels, buckets, total, count in snapshot['histograms']:
+            merged = histograms.setdefault((name, tuple(labels)), [[0] * len(BUCKETS), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += total
+            merged[2] += count
+    return counters, histograms
+
+
+def exposition():
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, help_text, label_names) in METRICS.items():
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        if kind in ('counter', 'gauge'):
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append('{}{} {}'.format(name, format_labels(label_names, labels), format_value(value)))
+            continue
+        for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, buckets):
+                cumulative += bucket
+                lines.append('{}_bucket{} {}'.format(
+                    name, format_labels(label_names + ('le',), labels + (repr(bound),)), cumulative))
+            lines.append('{}_bucket{} {}'.format(name, format_labels(label_names + ('le',), labels + ('+Inf',)), count))
+            lines.append('{}_sum{} {}'.format(name, format_labels(label_names, labels), format_value(total)))
+            lines.append('{}_count{} {}'.format(name, format_labels(label_names, labels), count))
+    return '\n'.join(lines) + '\n'
+
+
+def format_labels(names, values):
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in zip(names, values)) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def may_read_metrics(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_active and user.is_staff:
+        return True
+    if request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ()):
+        return True
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    parts = request.META.get('HTTP_AUTHORIZATION', '').split()
+    return bool(token) and len(parts) == 2 and parts[0].lower() == 'bearer' \
+        and hmac.compare_digest(parts[1].encode(), token.encode())
+
+
+def metrics_view(request):
+    if not may_read_metrics(request):
+        raise Http404
+    return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class PhaseTimer:
+    """
+    Adds the time spent in the block to `phase` of the current request.
+    """
+    __slots__ = ('phases', 'phase', 'started')
+
+    def __init__(self, request, phase):
+        self.phases = getattr(getattr(request, '_request', request), 'metric_phases', None)
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.phases is not None:
+            self.phases[self.phase] = self.phases.get(self.phase, 0.0) + time.perf_counter() - self.started
+
+
+class InstrumentedViewMixin:
+    """
+    Times authentication, permission checks and serialization of an APIView.
+    """
+    def perform_authentication(self, request):
+        with PhaseTimer(request, 'auth'):
+            super().perform_authentication(request)
+
+    def check_permissions(self, request):
+        with PhaseTimer(request, 'permissions'):
+            super().check_permissions(request)
+
+    def check_object_permissions(self, request, obj):
+        with PhaseTimer(request, 'permissions'):
+            super().check_object_permissions(request, obj)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        to_representation = serializer.to_representation
+
+        def timed(instance):
+            with PhaseTimer(self.request, 'serialization'):
+                return to_representation(instance)
+        serializer.to_representation = timed
+        return serializer
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        renderer = getattr(response, 'accepted_renderer', None)
+        if renderer is not None:
+            render = renderer.render
+
+            def timed(*render_args, **render_kwargs):
+                with PhaseTimer(request, 'serialization'):
+                    return render(*render_args, **render_kwargs)
+            renderer.render = timed
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Records every request; must sit above QueryBudgetMiddleware, whose query
+    recorder supplies the DB time.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.metric_phases = {}
+        started = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        route = match.view_name if match is not None else 'unmatched'
+        registry.inc('boards_http_requests_total', (route, request.method, str(response.status_code)))
+        registry.observe('boards_http_request_duration_seconds', (route, request.method), elapsed)
+        recorder = getattr(request, 'query_recorder', None)
+        if recorder is not None:
+            request.metric_phases['db'] = recorder.seconds
+            registry.inc('boards_db_queries_total', (route,), recorder.count)
+        for phase, seconds in request.metric_phases.items():
+            registry.observe('boards_http_request_phase_seconds', (route, phase), seconds)
+        registry.maybe_flush()
+        return response
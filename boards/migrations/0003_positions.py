@@ -0,0 +1,47 @@
+from django.db import migrations, models
+from django.db.models import F
+
+
+def initial_positions(apps, schema_editor):
+    # ids follow creation order, which was the previous ordering
+    apps.get_model('boards', 'Section').objects.update(position=F('id'))
+    apps.get_model('boards', 'Sticker').objects.update(position=F('id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0002_auto_20211111_1634'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='section',
+            options={'ordering': ['position', 'id']},
+        ),
+        migrations.AlterModelOptions(
+            name='sticker',
+            options={'ordering': ['position', 'id']},
+        ),
+        migrations.AddField(
+            model_name='section',
+            name='position',
+            field=models.FloatField(blank=True, default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='sticker',
+            name='position',
+            field=models.FloatField(blank=True, default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(initial_positions, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='section',
+            index=models.Index(fields=['board', 'position'], name='boards_sect_board_i_0ec7f5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sticker',
+            index=models.Index(fields=['section', 'position'], name='boards_stic_section_32cab5_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boards', '0004_board_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoardChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('section', 'section'), ('sticker', 'sticker'), ('member', 'member'), ('board', 'board')], max_length=10)),
+                ('object_id', models.IntegerField()),
+                ('action', models.CharField(choices=[('created', 'created'), ('updated', 'updated'), ('deleted', 'deleted')], max_length=10)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('board', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='changes', to='boards.Board')),
+            ],
+            options={
+                'ordering': ['seq', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='boardchange',
+            index=models.Index(fields=['board', 'seq'], name='boards_boar_board_i_c6e908_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_access(apps, schema_editor):
+    Board = apps.get_model('boards', 'Board')
+    BoardAccess = apps.get_model('boards', 'BoardAccess')
+    BoardAccess.objects.bulk_create(
+        [BoardAccess(user_id=owner_id, board_id=board_id, role='owner')
+         for board_id, owner_id in Board.objects.values_list('id', 'owner_id').iterator()],
+        batch_size=500,
+    )
+    BoardAccess.objects.bulk_create(
+        [BoardAccess(user_id=user_id, board_id=board_id, role='guest')
+         for board_id, user_id in Board.users.through.objects.values_list('board_id', 'user_id').iterator()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('boards', '0005_board_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoardAccess',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('owner', 'owner'), ('guest', 'guest')], max_length=5)),
+                ('board', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='access', to='boards.Board')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='board_access', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='boardaccess',
+            constraint=models.UniqueConstraint(fields=('user', 'board', 'role'), name='boards_boardaccess_user_board_role'),
+        ),
+        migrations.RunPython(populate_access, migrations.RunPython.noop),
+    ]
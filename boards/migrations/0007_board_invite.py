@@ -0,0 +1,39 @@
+# Generated by Django 3.0.8 on 2026-10-18 07:55
+
+import boards.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.crypto
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('boards', '0006_board_access'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='board',
+            name='invite_link',
+            field=models.CharField(db_index=True, default=django.utils.crypto.get_random_string, max_length=100),
+        ),
+        migrations.CreateModel(
+            name='BoardInvite',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(default=boards.models.invite_token, max_length=64, unique=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('max_uses', models.PositiveIntegerField(blank=True, null=True)),
+                ('uses', models.PositiveIntegerField(default=0)),
+                ('board', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invites', to='boards.Board')),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
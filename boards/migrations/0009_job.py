@@ -0,0 +1,70 @@
+# Generated by Django 3.0.8 on 2026-10-18 08:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def move_deletion_jobs(apps, schema_editor):
+    # unfinished and failed deletions are run again as jobs
+    DeletionJob = apps.get_model('boards', 'DeletionJob')
+    Job = apps.get_model('boards', 'Job')
+    tasks = {'board': 'boards.deletion.purge_board', 'user': 'boards.deletion.purge_user'}
+    now = django.utils.timezone.now()
+    Job.objects.bulk_create(
+        [Job(name=tasks[job.kind], args='[{}]'.format(job.object_id), target_id=job.object_id,
+             requested_by_id=job.requested_by_id, max_attempts=3, run_at=now)
+         for job in DeletionJob.objects.exclude(state='done').iterator()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('boards', '0008_deletion_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('args', models.TextField(default='[]')),
+                ('priority', models.SmallIntegerField(default=0)),
+                ('target_id', models.IntegerField(null=True)),
+                ('state', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=7)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('max_attempts', models.PositiveSmallIntegerField(default=1)),
+                ('run_at', models.DateTimeField()),
+                ('lease_expires', models.DateTimeField(null=True)),
+                ('worker', models.CharField(blank=True, default='', max_length=100)),
+                ('progress', models.IntegerField(default=0)),
+                ('total', models.IntegerField(null=True)),
+                ('result', models.TextField(null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(null=True)),
+                ('finished', models.DateTimeField(null=True)),
+                ('requested_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunPython(move_deletion_jobs, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='DeletionJob',
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['state', 'run_at'], name='boards_job_state_970c10_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['name', 'target_id'], name='boards_job_name_2d532d_idx'),
+        ),
+    ]
@@ -3,6 +3,7 @@ from django.conf import settings
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
+import math
 import re
 from django.contrib.auth.models import AnonymousUser
 from rest_framework.authtoken.models import Token
@@ -38,26 +39,126 @@ class SetPasswordField(CharField):
         return super().run_validators(value)
 
 
+def next_position(queryset):
+    """
+    Position that places a new row after every row of `queryset`.
+    """
+    last = queryset.aggregate(last=models.Max('position'))['last']
+    return 1.0 if last is None else math.floor(last) + 1.0
+
+
 class Board(models.Model):
     created = models.DateField(auto_now_add=True)
     title = models.CharField(max_length=100)
     description = models.CharField(max_length=200, default='', blank=True)
     owner = models.ForeignKey('auth.User', related_name='boards', on_delete=models.CASCADE)
     users = models.ManyToManyField(User, blank=True, related_name='guest_boards')
-    invite_link = models.CharField(max_length=100, default=get_random_string)
+    # single-use join link, rotated on every join; see BoardInvite for shareable links
+    invite_link = models.CharField(max_length=100, default=get_random_string, db_index=True)
+    # bumped on every change to the board, its sections, stickers or members
+    version = models.BigIntegerField(default=0, editable=False)
+    # set when a delete is requested; boards/deletion.py removes the rows later
+    deleting = models.BooleanField(default=False, editable=False)
 
     class Meta:
         ordering = ['created']
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        board = super().from_db(db, field_names, values)
+        # lets boards/signals.py skip the owner's BoardAccess row when it did not change
+        board.loaded_owner_id = board.__dict__.get('owner_id')
+        return board
+
+    def save(self, *args, **kwargs):
+        # version is only ever written by bump_board_versions, so a stale
+        # instance cannot roll it back
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'version'
+            ]
+        super().save(*args, **kwargs)
+        self.loaded_owner_id = self.owner_id
+
+
+def bump_board_versions(board_ids):
+    board_ids = set(board_ids)
+    if board_ids:
+        Board.objects.filter(pk__in=board_ids).update(version=models.F('version') + 1)
+
+
+class BoardAccess(models.Model):
+    """
+    Denormalized (user, board, role) rows mirroring Board.owner and
+    Board.users, kept in sync by boards/signals.py. Visibility queries filter
+    through it with one indexed semi-join instead of OR-ing two joins.
+    """
+    OWNER = 'owner'
+    GUEST = 'guest'
+    ROLE_CHOICES = [(OWNER, 'owner'), (GUEST, 'guest')]
+
+    user = models.ForeignKey(User, related_name='board_access', on_delete=models.CASCADE)
+    board = models.ForeignKey(Board, related_name='access', on_delete=models.CASCADE)
+    role = models.CharField(max_length=5, choices=ROLE_CHOICES)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'board', 'role'], name='boards_boardaccess_user_board_role'),
+        ]
+
+    @staticmethod
+    def board_ids(user):
+        return BoardAccess.objects.filter(user_id=user.id).values('board_id')
+
+
+class RevokedToken(models.Model):
+    """
+    Generation of signed tokens revoked through /token/revoke/
+    (boards/tokens.py); kept until its refresh token would have expired.
+    """
+    generation = models.CharField(max_length=12, unique=True)
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    expires_at = models.DateTimeField(db_index=True)
+
+
+def invite_token():
+    return get_random_string(32)
+
+
+class BoardInvite(models.Model):
+    """
+    Shareable invite to a board, redeemed through /invite/{token}/ by
+    boards/invites.py until it expires or has been used `max_uses` times
+    (no limit when null).
+    """
+    token = models.CharField(max_length=64, unique=True, default=invite_token)
+    board = models.ForeignKey(Board, related_name='invites', on_delete=models.CASCADE)
+    created_by = models.ForeignKey(User, related_name='+', on_delete=models.SET_NULL, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    max_uses = models.PositiveIntegerField(null=True, blank=True)
+    uses = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['id']
+
 
 class Section(models.Model):
     created = models.DateField(auto_now_add=True)
     title = models.CharField(max_length=100)
     description = models.CharField(max_length=200, default='', blank=True)
     board = models.ForeignKey(Board, related_name="sections", on_delete=models.CASCADE)
+    position = models.FloatField(blank=True)
 
     class Meta:
-        ordering = ['created']
+        ordering = ['position', 'id']
+        indexes = [models.Index(fields=['board', 'position'])]
+
+    def save(self, *args, **kwargs):
+        if self.position is None:
+            self.position = next_position(Section.objects.filter(board_id=self.board_id))
+        super().save(*args, **kwargs)
 
 
 class Sticker(models.Model):
@@ -67,6 +168,84 @@ class Sticker(models.Model):
     section = models.ForeignKey(Section, related_name="stickers", on_delete=models.CASCADE)
     assigned_to = models.ForeignKey(User, related_name="assigned_stickers",
                                     on_delete=models.CASCADE, null=True)
+    position = models.FloatField(blank=True)
 
     class Meta:
-        ordering = ['created']
+        ordering = ['position', 'id']
+        indexes = [models.Index(fields=['section', 'position'])]
+
+    def save(self, *args, **kwargs):
+        if self.position is None:
+            self.position = next_position(Sticker.objects.filter(section_id=self.section_id))
+        super().save(*args, **kwargs)
+
+
+class BoardChange(models.Model):
+    """
+    Change log entry of a board. `seq` is the board version the change
+    produced; a batch of changes applied together shares one seq.
+    """
+    SECTION = 'section'
+    STICKER = 'sticker'
+    MEMBER = 'member'
+    BOARD = 'board'
+    KIND_CHOICES = [(SECTION, 'section'), (STICKER, 'sticker'), (MEMBER, 'member'), (BOARD, 'board')]
+
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTION_CHOICES = [(CREATED, 'created'), (UPDATED, 'updated'), (DELETED, 'deleted')]
+
+    # no constraint: changes logged while a board is being deleted must not
+    # block the delete; its rows are removed by a post_delete receiver
+    board = models.ForeignKey(Board, related_name='changes', on_delete=models.DO_NOTHING, db_constraint=False)
+    seq = models.BigIntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['seq', 'id']
+        indexes = [models.Index(fields=['board', 'seq'])]
+
+
+class Job(models.Model):
+    """
+    Deferred call of a task registered with boards.jobs.task: `name` is the
+    task's dotted path and `args` its JSON-encoded positional arguments.
+    Higher `priority` runs first; `target_id` is the id of the object the
+    job works on, for lookups such as pending deletions.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATE_CHOICES = [(PENDING, 'pending'), (RUNNING, 'running'), (DONE, 'done'), (FAILED, 'failed')]
+
+    name = models.CharField(max_length=200)
+    args = models.TextField(default='[]')
+    priority = models.SmallIntegerField(default=0)
+    target_id = models.IntegerField(null=True)
+    requested_by = models.ForeignKey(User, related_name='+', on_delete=models.SET_NULL, null=True)
+    state = models.CharField(max_length=7, choices=STATE_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=1)
+    run_at = models.DateTimeField()
+    # a running job whose lease expired is claimed again
+    lease_expires = models.DateTimeField(null=True)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    progress = models.IntegerField(default=0)
+    total = models.IntegerField(null=True)
+    result = models.TextField(null=True)
+    error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['state', 'run_at']),
+            models.Index(fields=['name', 'target_id']),
+        ]
@@ -0,0 +1,98 @@
+import math
+
+from django.apps import apps
+from django.db import transaction
+
+from boards.changes import record_board_changes
+from boards.jobs import enqueue, task
+from boards.models import BoardChange
+
+# Neighbours closer than this trigger a rebalance of the whole scope
+MIN_POSITION_GAP = 1e-6
+
+
+def position_between(queryset, after=None, before=None):
+    """
+    Position for an item placed right after `after` or right before `before`
+    among the rows of `queryset` (the item's siblings, itself excluded), or at
+    the end of them when neither is given.
+
+    Returns (position, needs_rebalance).
+    """
+    if after is not None:
+        low = after.position
+        high = queryset.filter(position__gt=low).order_by('position').values_list('position', flat=True).first()
+    elif before is not None:
+        high = before.position
+        low = queryset.filter(position__lt=high).order_by('-position').values_list('position', flat=True).first()
+    else:
+        high = None
+        low = queryset.order_by('-position').values_list('position', flat=True).first()
+
+    if low is None and high is None:
+        return 1.0, False
+    if high is None:
+        return math.floor(low) + 1.0, False
+    if low is None:
+        return math.floor(high) - 1.0, False
+    return (low + high) / 2, high - low < MIN_POSITION_GAP * 2
+
+
+def resolve_neighbours(model, scope, data):
+    """
+    Looks up the `after`/`before` ids of a move request inside `scope`.
+    Returns (after, before, errors).
+    """
+    found, errors = {}, {}
+    for key in ('after', 'before'):
+        value = data.get(key)
+        if value is None:
+            found[key] = None
+            continue
+        try:
+            found[key] = model.objects.filter(pk=int(value), **scope).only('id', 'position').first()
+        except (TypeError, ValueError):
+            found[key] = None
+        if found[key] is None:
+            errors[key] = ['Such item does not exist in the target list']
+    return found['after'], found['before'], errors
+
+
+def move(model, pk, scope, board_id, after=None, before=None):
+    """
+    Moves row `pk` of `model` into `scope` (a dict of filter kwargs such as
+    {'section_id': 3}) next to `after`/`before`. Writes exactly one row; if the
+    neighbours are packed too densely a rebalance of the scope is queued as
+    a job. `board_id` is the board whose version the
+    move bumps.
+    """
+    siblings = model.objects.filter(**scope).exclude(pk=pk)
+    position, needs_rebalance = position_between(siblings, after=after, before=before)
+    model.objects.filter(pk=pk).update(position=position, **scope)
+    record_board_changes([(board_id, _kind(model), pk, BoardChange.UPDATED)])
+    if needs_rebalance:
+        enqueue(rebalance_positions, model._meta.label, scope, board_id, target_id=board_id)
+    return position
+
+
+def rebalance(model, scope, board_id):
+    """
+    Spreads the positions of every row in `scope` back to whole numbers,
+    keeping their current order.
+    """
+    with transaction.atomic():
+        rows = list(model.objects.filter(**scope).order_by('position', 'id').only('id', 'position'))
+        for index, row in enumerate(rows, start=1):
+            row.position = float(index)
+        model.objects.bulk_update(rows, ['position'], batch_size=500)
+        record_board_changes([(board_id, _kind(model), row.pk, BoardChange.UPDATED) for row in rows])
+    return len(rows)
+
+
+@task
+def rebalance_positions(job, model_label, scope, board_id):
+    return rebalance(apps.get_model(model_label), scope, board_id)
+
+
+def _kind(model):
+    return BoardChange.SECTION if model._meta.model_name == 'section' else BoardChange.STICKER
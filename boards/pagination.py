@@ -0,0 +1,91 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+from boards.fieldsets import requested_shape, shape_queryset
+from boards.metrics import PhaseTimer
+from boards.readmodels import read_model
+from boards.streaming import stream_response, wants_stream
+
+DEFAULT_MAX_PAGE_SIZE = 1000
+
+
+class BoardsCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the primary key.
+
+    Ids grow together with `created`, so ordering by id keeps the creation
+    order while giving every row a unique, indexed cursor position: deep
+    pages cost the same as the first one. Views may override the ordering
+    with a `cursor_ordering` attribute.
+
+    Only requests with ?page_size= or ?cursor= are paginated, so existing
+    clients keep getting every row. The body stays a plain list either way;
+    the next/previous page links are sent in the `Link` header.
+    """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+
+    @property
+    def max_page_size(self):
+        return getattr(settings, 'BOARDS_MAX_PAGE_SIZE', DEFAULT_MAX_PAGE_SIZE)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.requested(request):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def requested(self, request):
+        params = request.query_params
+        return self.page_size_query_param in params or self.cursor_query_param in params
+
+    def get_ordering(self, request, queryset, view):
+        return getattr(view, 'cursor_ordering', None) or super().get_ordering(request, queryset, view)
+
+    def get_paginated_response(self, data):
+        links = []
+        next_link = self.get_next_link()
+        previous_link = self.get_previous_link()
+        if next_link:
+            links.append('<{}>; rel="next"'.format(next_link))
+        if previous_link:
+            links.append('<{}>; rel="prev"'.format(previous_link))
+        headers = {'Link': ', '.join(links)} if links else None
+        return Response(data, headers=headers)
+
+
+class PaginatedActionMixin:
+    """
+    Pagination for list-returning `@action`s, which do not go through
+    ListModelMixin, and for `list` itself. Serializers with a read model
+    (boards/readmodels.py) are bypassed for the rows unless ?expand= is
+    given; otherwise the queryset loads only what the requested shape needs
+    (boards/fieldsets.py). With `streamable`, ?stream=1 returns every row in
+    one streamed response (boards/streaming.py) instead;
+    only for serializers that need no prefetching, which `.iterator()` skips.
+    """
+    def paginated_response(self, queryset, serializer_class, streamable=False):
+        context = self.get_serializer_context()
+        # whole lists come in the order pages would
+        queryset = queryset.order_by(*self.paginator.get_ordering(self.request, queryset, self))
+        if streamable and wants_stream(self.request):
+            queryset = shape_queryset(queryset, serializer_class, self.request)
+            return stream_response(queryset, serializer_class(context=context))
+        fields, expand = requested_shape(self.request)
+        model = None if expand else read_model(serializer_class)
+        if model is not None:
+            queryset = model.rows(queryset, fields)
+        else:
+            queryset = shape_queryset(queryset, serializer_class, self.request)
+        page = self.paginate_queryset(queryset)
+        with PhaseTimer(self.request, 'serialization'):
+            if model is not None:
+                data = model.represent(queryset if page is None else page, fields)
+            else:
+                data = serializer_class(queryset if page is None else page, many=True, context=context).data
+        if page is None:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    def list(self, request, *args, **kwargs):
+        return self.paginated_response(self.filter_queryset(self.get_queryset()), self.get_serializer_class())
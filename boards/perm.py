@@ -1,5 +1,14 @@
 from rest_framework import permissions
 from django.contrib.auth.models import User
+from boards.membership import membership_cache
+
+
+def is_write(request):
+    """
+    Writes check membership against the database rather than the
+    per-process cache, which may not have seen another process's change.
+    """
+    return request.method not in permissions.SAFE_METHODS
 
 
 class IsOwnerOrBoardUser(permissions.BasePermission):
@@ -7,19 +16,21 @@ class IsOwnerOrBoardUser(permissions.BasePermission):
     Custom permission to only allow owners of an object to edit it.
     """
     def has_object_permission(self, request, view, obj):
-        if (request.method in permissions.SAFE_METHODS or request.method == 'POST') and request.user in obj.users.all():
+        fresh = is_write(request)
+        if (request.method in permissions.SAFE_METHODS or request.method == 'POST') \
+                and membership_cache.has_access(obj.pk, request.user.id, fresh):
             return True
-        return obj.owner == request.user
+        return membership_cache.is_owner(obj.pk, request.user.id, fresh)
 
 
 class IsSectionUser(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        return obj.board.owner == request.user or request.user in obj.board.users.all()
+        return membership_cache.has_access(obj.board_id, request.user.id, is_write(request))
 
 
 class IsStickerUser(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        return obj.section.board.owner == request.user or request.user in obj.section.board.users.all()
+        return membership_cache.has_access(obj.section.board_id, request.user.id, is_write(request))
 
 
 class IsAdminOrReadOnly(permissions.BasePermission):
@@ -0,0 +1,167 @@
+"""
+Per-request query accounting.
+
+`QueryRecorder` times every query run on any connection while it is
+recording, whether or not DEBUG is on, and groups queries by shape - the
+SQL with literals and parameter lists collapsed - so N+1 patterns show up
+as one shape repeated many times.
+
+Views declare their budget as a `query_budget` attribute: an int for the
+whole view or a dict keyed by viewset action. `QueryBudgetMiddleware`
+checks every API response against it and against QUERY_BUDGET_MAX_REPEATS,
+and logs or raises according to QUERY_BUDGET_ACTION. Tests use
+`assert_query_budget` the same way.
+
+Budgets count statements: transaction control (BEGIN, SAVEPOINT, ...)
+depends on the transaction a request runs in, not on the endpoint, and is
+left out.
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_REPEATS = 3
+DEFAULT_ACTION = 'log'
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PARAMETER_LISTS = re.compile(r'\(\s*%s(?:\s*,\s*%s)+\s*\)')
+TRANSACTION_CONTROL = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT', 'BEGIN', 'COMMIT', 'ROLLBACK')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_shape(sql):
+    return PARAMETER_LISTS.sub('(%s, ...)', LITERALS.sub('%s', sql))
+
+
+def is_transaction_control(sql):
+    return sql.lstrip().upper().startswith(TRANSACTION_CONTROL)
+
+
+class QueryRecorder:
+    """
+    `connection.execute_wrapper` that records (sql, seconds) of every query.
+    """
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started))
+
+    @contextmanager
+    def record(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def statements(self):
+        return [sql for sql, _ in self.queries if not is_transaction_control(sql)]
+
+    @property
+    def seconds(self):
+        return sum(seconds for _, seconds in self.queries)
+
+    def repeated(self, max_repeats):
+        """
+        Shapes run more than `max_repeats` times, most frequent first.
+        """
+        shapes = Counter(query_shape(sql) for sql in self.statements)
+        return [(shape, count) for shape, count in shapes.most_common() if count > max_repeats]
+
+    def violations(self, max_queries=None, max_repeats=None):
+        problems = []
+        count = len(self.statements)
+        if max_queries is not None and count > max_queries:
+            problems.append('{} queries, budget is {}'.format(count, max_queries))
+        if max_repeats is not None:
+            for shape, count in self.repeated(max_repeats):
+                problems.append('{} runs of the same query (N+1?): {}'.format(count, shape))
+        return problems
+
+
+def max_repeats():
+    return getattr(settings, 'QUERY_BUDGET_MAX_REPEATS', DEFAULT_MAX_REPEATS)
+
+
+def view_budget(view):
+    """
+    Query budget declared on a view instance for its current action, or None.
+    """
+    budget = getattr(view, 'query_budget', None)
+    if isinstance(budget, dict):
+        budget = budget.get(getattr(view, 'action', None))
+    return budget
+
+
+def query_budget(budget):
+    """
+    Declares the budget of a function view, above `@api_view`.
+    """
+    def decorator(view):
+        setattr(getattr(view, 'cls', view), 'query_budget', budget)
+        return view
+    return decorator
+
+
+@contextmanager
+def assert_query_budget(max_queries=None, max_repeats=DEFAULT_MAX_REPEATS):
+    """
+    Fails with the offending shapes if the block runs more than `max_queries`
+    queries or repeats a query shape more than `max_repeats` times.
+    """
+    recorder = QueryRecorder()
+    with recorder.record():
+        yield recorder
+    problems = recorder.violations(max_queries, max_repeats)
+    if problems:
+        raise AssertionError('Query budget exceeded:\n' + '\n'.join(problems))
+
+
+class QueryBudgetMiddleware:
+    """
+    Records the queries of every request and checks API responses against
+    the budget of the view that produced them.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = request.query_recorder = QueryRecorder()
+        with recorder.record():
+            response = self.get_response(request)
+        view = getattr(response, 'renderer_context', {}).get('view')
+        if view is not None:
+            problems = recorder.violations(view_budget(view), max_repeats())
+            if problems:
+                self.report(request, view, recorder, problems)
+        return response
+
+    @staticmethod
+    def report(request, view, recorder, problems):
+        action = getattr(settings, 'QUERY_BUDGET_ACTION', DEFAULT_ACTION)
+        message = '{} {} ({}.{}): {}'.format(
+            request.method, request.path, type(view).__name__, getattr(view, 'action', None) or request.method.lower(),
+            '; '.join(problems))
+        if action == 'raise':
+            raise QueryBudgetExceeded(message)
+        if action == 'log':
+            logger.warning('%s [%.1f ms in queries]', message, recorder.seconds * 1000)
@@ -0,0 +1,112 @@
+"""
+Read-only list representations built from `.values()` rows.
+
+For list responses, `ReadModel.represent` produces the same dicts, in the
+same key order, as the matching ModelSerializer's `.data`, but it skips
+model instances and DRF fields. Each row comes from one `.values()` query.
+Each to-many relation costs one `values_list` query per page, the same as
+the prefetch it replaces, and lists its ids in the same order as that
+prefetch.
+
+The cursor paginator pages `.values()` dicts as it pages instances, so
+`rows` can be paginated before `represent` runs; the rows always carry
+the ordering columns the cursor is built from. Both take the `?fields=`
+of the request (boards/fieldsets.py) and load only those.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+
+from boards.models import Board, Section, Sticker
+from boards.serializers import BoardSerializer, SectionSerializer, StickerSerializer
+
+
+class ReadModel:
+    """
+    `fields` pairs each output key, in serializer order, with its
+    `.values()` column, or with None for a to-many relation whose ids
+    `related_ids` loads for a whole page. `related` maps such a key to the
+    queryset of its rows and their (parent id, id) columns.
+    """
+    fields = ()
+    related = {}
+
+    def selected(self, fields=None):
+        return [(key, column) for key, column in self.fields if fields is None or key in fields]
+
+    def rows(self, queryset, fields=None):
+        """
+        `.values()` of the selected columns, the id and the ordering columns,
+        which the cursor paginator reads; `represent` leaves out the extra ones.
+        """
+        columns = {column for _, column in self.selected(fields) if column} | {'id'}
+        columns |= {name.lstrip('-') for name in queryset.query.order_by if isinstance(name, str)}
+        return queryset.prefetch_related(None).values(*columns)
+
+    def represent(self, rows, fields=None):
+        rows = list(rows)
+        ids = [row['id'] for row in rows]
+        selected = self.selected(fields)
+        related = {key: self.related_ids(key, ids) for key, column in selected if column is None}
+        return [
+            {key: row[column] if column else related[key].get(row['id'], []) for key, column in selected}
+            for row in rows
+        ]
+
+    def related_ids(self, key, ids):
+        queryset, parent, child = self.related[key]
+        return group(queryset.filter(**{parent + '__in': ids}).values_list(parent, child))
+
+
+def group(pairs):
+    grouped = defaultdict(list)
+    for parent_id, child_id in pairs:
+        grouped[parent_id].append(child_id)
+    return grouped
+
+
+class StickerReadModel(ReadModel):
+    fields = (
+        ('id', 'id'), ('title', 'title'), ('text', 'text'), ('section', 'section'),
+        ('assigned_to', 'assigned_to'), ('position', 'position'),
+    )
+
+
+class SectionReadModel(ReadModel):
+    fields = (
+        ('id', 'id'), ('title', 'title'), ('description', 'description'), ('board', 'board'),
+        ('stickers', None), ('position', 'position'),
+    )
+    related = {
+        'stickers': (Sticker.objects.all(), 'section_id', 'id'),
+    }
+
+
+class BoardReadModel(ReadModel):
+    fields = (
+        ('id', 'id'), ('title', 'title'), ('description', 'description'), ('owner', 'owner__username'),
+        ('owner_id', 'owner_id'), ('sections', None), ('users', None), ('invite_link', 'invite_link'),
+        ('version', 'version'),
+    )
+    related = {
+        'sections': (Section.objects.all(), 'board_id', 'id'),
+        # ordered like BoardViewSet's users prefetch
+        'users': (Board.users.through.objects.order_by('user_id'), 'board_id', 'user_id'),
+    }
+
+
+READ_MODELS = {
+    StickerSerializer: StickerReadModel(),
+    SectionSerializer: SectionReadModel(),
+    BoardSerializer: BoardReadModel(),
+}
+
+
+def read_model(serializer_class):
+    """
+    The read model standing in for `serializer_class` in list responses, or
+    None when there is none or READ_MODELS_ENABLED is off.
+    """
+    if not getattr(settings, 'READ_MODELS_ENABLED', True):
+        return None
+    return READ_MODELS.get(serializer_class)
@@ -0,0 +1,187 @@
+"""
+Per-user cache of rendered list responses.
+
+Entries are keyed by the user, the request path with its query string,
+the Accept header and the version of every board the response shows, so
+a write to a board (which always bumps its version) makes its cached
+responses unreachable, whichever process made it. So does a change to the
+username or name of a board's owner or member, which those responses
+render. The signal receivers
+in boards/signals.py also drop them from this process's cache right
+away, to free the memory.
+
+Each process keeps at most RESPONSE_CACHE_MAX_BYTES of bodies, evicting
+the least recently used. With RESPONSE_CACHE_ALIAS naming one of
+CACHES, responses are also shared between processes through that
+backend for RESPONSE_CACHE_TIMEOUT seconds.
+
+Only 200 JSON responses are stored; streamed responses never are.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from rest_framework import status
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TIMEOUT = 300
+
+# response headers kept with the body; ETag is set again by the view
+STORED_HEADERS = ('Link',)
+
+
+class ResponseCache:
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._keys_by_board = {}
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'RESPONSE_CACHE_ENABLED', True)
+
+    @property
+    def max_bytes(self):
+        return getattr(settings, 'RESPONSE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+
+    @staticmethod
+    def shared():
+        alias = getattr(settings, 'RESPONSE_CACHE_ALIAS', None)
+        return caches[alias] if alias else None
+
+    @staticmethod
+    def key(request, versions):
+        """
+        Key of `request`'s response given (board id, version) pairs of the
+        boards it shows.
+        """
+        variant = '{}|{}|{}|{}'.format(request.user.id, request.get_full_path(),
+                                       request.META.get('HTTP_ACCEPT', ''), sorted(versions))
+        return 'boards:response:' + hashlib.sha1(variant.encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        shared = self.shared()
+        stored = shared.get(key) if shared is not None else None
+        with self._lock:
+            if stored is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return stored
+
+    def set(self, key, user_id, board_ids, stored):
+        shared = self.shared()
+        if shared is not None:
+            shared.set(key, stored, getattr(settings, 'RESPONSE_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+        size = len(stored[0])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (stored, user_id, frozenset(board_ids), size)
+            self.bytes += size
+            self._keys_by_user.setdefault(user_id, set()).add(key)
+            for board_id in board_ids:
+                self._keys_by_board.setdefault(board_id, set()).add(key)
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_boards(self, board_ids):
+        with self._lock:
+            for board_id in board_ids:
+                for key in list(self._keys_by_board.get(board_id, ())):
+                    self._remove(key)
+
+    def invalidate_users(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                for key in list(self._keys_by_user.get(user_id, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_board.clear()
+            self._keys_by_user.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'bytes': self.bytes,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        _, user_id, board_ids, size = entry
+        self.bytes -= size
+        for index, owner in [(self._keys_by_user, user_id)] + [(self._keys_by_board, b) for b in board_ids]:
+            keys = index.get(owner)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[owner]
+
+
+response_cache = ResponseCache()
+
+
+class CachedResponseMixin:
+    """
+    `cached_response` answers from the response cache, or calls `build`
+    and stores its response once rendered. List it before
+    InstrumentedViewMixin so that rendering is still timed.
+    """
+    def cached_response(self, versions, build):
+        """
+        `versions` are (board id, version) pairs of every board the
+        response shows.
+        """
+        if not response_cache.enabled:
+            return build()
+        key = response_cache.key(self.request, versions)
+        stored = response_cache.get(key)
+        if stored is not None:
+            content, content_type, headers = stored
+            response = HttpResponse(content, content_type=content_type)
+            for name, value in headers:
+                response[name] = value
+            return response
+        response = build()
+        response.response_cache_entry = (key, [board_id for board_id, _ in versions])
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        entry = getattr(response, 'response_cache_entry', None)
+        renderer = getattr(response, 'accepted_renderer', None)
+        if entry is None or response.status_code != status.HTTP_200_OK or response.streaming \
+                or renderer is None or renderer.format != 'json':
+            return response
+        response.render()
+        headers = [(name, response[name]) for name in STORED_HEADERS if response.has_header(name)]
+        response_cache.set(entry[0], request.user.id, entry[1], (response.content, response['Content-Type'], headers))
+        return response
@@ -1,46 +1,170 @@
+import json
+
 from rest_framework import serializers
-from boards.models import Board, Section, Sticker, SetPasswordField
+from rest_framework.relations import ManyRelatedField
+from boards.fieldsets import ShapedSerializerMixin
+from boards.models import Board, BoardInvite, Job, Section, Sticker, SetPasswordField
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Prefetch
 
 
 WRONG_EMAIL_OR_PASSWORD = 'Incorrect email address and / or password.'
 USERNAME_IS_USED_BY_USER = 'Account with this username already exists.'
 
 
-class BoardSerializer(serializers.ModelSerializer):
+class InBulkRelatedField(ManyRelatedField):
+    """
+    List of primary keys loaded with one query, instead of one per item.
+    """
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        child = self.child_relation
+        queryset = child.get_queryset()
+        pks = []
+        for value in data:
+            try:
+                pks.append(int(value))
+            except (TypeError, ValueError):
+                child.fail('incorrect_type', data_type=type(value).__name__)
+        found = queryset.in_bulk(pks)
+        for pk in pks:
+            if pk not in found:
+                child.fail('does_not_exist', pk_value=pk)
+        return [found[pk] for pk in pks]
+
+
+class BoardSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     owner = serializers.ReadOnlyField(source='owner.username')
-    owner_id = serializers.ReadOnlyField(source='owner.id')
+    owner_id = serializers.ReadOnlyField()
     sections = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    users = InBulkRelatedField(child_relation=serializers.PrimaryKeyRelatedField(queryset=User.objects.all()),
+                               required=False)
     invite_link = serializers.ReadOnlyField()
 
+    expandable = {
+        'owner': ('BoardMemberSerializer', False),
+        'sections': ('SectionSerializer', True),
+        'users': ('BoardMemberSerializer', True),
+    }
+    relations = {
+        'owner': 'owner',
+        'sections': Prefetch('sections', queryset=Section.objects.only('id', 'board_id')),
+        'users': Prefetch('users', queryset=User.objects.only('id').order_by('id')),
+    }
+
     class Meta:
         model = Board
-        fields = ['id', 'title', 'description', 'owner', 'owner_id', 'sections', 'users', 'invite_link']
+        fields = ['id', 'title', 'description', 'owner', 'owner_id', 'sections', 'users', 'invite_link', 'version']
+
+
+class BoardInviteSerializer(serializers.ModelSerializer):
+    expires_in = serializers.IntegerField(min_value=0, required=False, write_only=True)
+    max_uses = serializers.IntegerField(min_value=1, required=False, allow_null=True)
+
+    class Meta:
+        model = BoardInvite
+        fields = ['token', 'board', 'created', 'expires_at', 'expires_in', 'max_uses', 'uses']
+        read_only_fields = ['token', 'board', 'created', 'expires_at', 'uses']
 
 
-class SectionSerializer(serializers.ModelSerializer):
+class JobSerializer(serializers.ModelSerializer):
+    result = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = ['id', 'name', 'target_id', 'state', 'priority', 'attempts', 'max_attempts', 'run_at',
+                  'progress', 'total', 'result', 'error', 'created', 'started', 'finished']
+        read_only_fields = fields
+
+    def get_result(self, job):
+        return None if job.result is None else json.loads(job.result)
+
+
+class SectionSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     stickers = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
 
+    expandable = {
+        'board': ('BoardSerializer', False),
+        'stickers': ('StickerSerializer', True),
+    }
+    relations = {
+        'stickers': Prefetch('stickers', queryset=Sticker.objects.only('id', 'section_id')),
+    }
+
     class Meta:
         model = Section
-        fields = ['id', 'title', 'description', 'board', 'stickers']
+        fields = ['id', 'title', 'description', 'board', 'stickers', 'position']
+        read_only_fields = ['position']
 
 
 class UpdateSectionSerializer(serializers.ModelSerializer):
     stickers = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
-    board = serializers.ReadOnlyField(source='board.id')
+    board = serializers.ReadOnlyField(source='board_id')
 
     class Meta:
         model = Section
-        fields = ['id', 'title', 'description', 'board', 'stickers']
+        fields = ['id', 'title', 'description', 'board', 'stickers', 'position']
+        read_only_fields = ['position']
+
+
+class StickerSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
+    expandable = {
+        'section': ('SectionSerializer', False),
+        'assigned_to': ('BoardMemberSerializer', False),
+    }
+
+    class Meta:
+        model = Sticker
+        fields = ['id', 'title', 'text', 'section', 'assigned_to', 'position']
+        read_only_fields = ['position']
 
 
-class StickerSerializer(serializers.ModelSerializer):
+class BulkStickerSerializer(serializers.ModelSerializer):
+    """
+    Sticker input for bulk operations. Relations are taken as raw ids and
+    checked against rows loaded once per batch instead of one query per item.
+    """
+    section = serializers.IntegerField(source='section_id')
+    assigned_to = serializers.IntegerField(source='assigned_to_id', allow_null=True, required=False)
 
     class Meta:
         model = Sticker
-        fields = ['id', 'title', 'text', 'section', 'assigned_to']
+        fields = ['title', 'text', 'section', 'assigned_to']
+
+
+class BoardMemberSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
+
+    class Meta:
+        model = User
+        fields = ('id', 'username', 'first_name', 'last_name')
+
+
+class SnapshotSectionSerializer(serializers.ModelSerializer):
+    stickers = StickerSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Section
+        fields = ['id', 'title', 'description', 'board', 'stickers', 'position']
+        read_only_fields = ['position']
+
+
+class BoardSnapshotSerializer(serializers.Serializer):
+    """
+    Board, its sections with nested stickers and its members in one payload.
+    Expects sections, sections__stickers and users to be prefetched.
+    """
+    def to_representation(self, instance):
+        members = instance.users.all()
+        return {
+            'board': BoardSerializer(instance).data,
+            'sections': SnapshotSectionSerializer(instance.sections.all(), many=True).data,
+            'members': BoardMemberSerializer(members, many=True).data,
+            'member_count': len(members),
+        }
 
 
 class UserRegisterSerializer(serializers.ModelSerializer):
@@ -70,11 +194,17 @@ class UserRegisterSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(ShapedSerializerMixin, serializers.ModelSerializer):
     boards = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
     guest_boards = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
     password = serializers.CharField(max_length=128, min_length=8,  required=True, write_only=True)
 
+    # anyone may read users, so their boards are never expanded
+    relations = {
+        'boards': Prefetch('boards', queryset=Board.objects.only('id', 'owner_id')),
+        'guest_boards': Prefetch('guest_boards', queryset=Board.objects.only('id')),
+    }
+
     class Meta:
         model = User
         fields = ('id', 'username', 'password', 'boards', 'guest_boards', 'first_name', 'last_name')
@@ -0,0 +1,167 @@
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.db.models.signals import post_init, pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from boards.authentication import credential_cache
+from boards.changes import record_board_changes
+from boards.membership import membership_cache
+from boards.models import Board, BoardAccess, BoardChange, Section, Sticker
+from boards.responsecache import response_cache
+from boards.tokens import deny_list
+
+# User fields that board responses render (owner, ?expand=owner,users)
+PROFILE_FIELDS = ('username', 'first_name', 'last_name')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_credentials(sender, instance, **kwargs):
+    # covers set_password() followed by save(), e.g. in UserSerializer.update
+    credential_cache.invalidate_user(instance.pk)
+
+
+@receiver(pre_save, sender=User)
+def flag_token_revocation(sender, instance, **kwargs):
+    # set_password() leaves the raw password in _password until the save
+    instance._revoke_tokens = instance._password is not None or not instance.is_active
+
+
+@receiver(post_save, sender=User)
+def revoke_tokens_on_save(sender, instance, **kwargs):
+    if getattr(instance, '_revoke_tokens', False):
+        deny_list.revoke_all(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def revoke_tokens_on_delete(sender, instance, **kwargs):
+    deny_list.revoke_all(instance.pk)
+
+
+def profile(instance):
+    # loaded fields only, so deferred ones are not fetched
+    return {name: instance.__dict__[name] for name in PROFILE_FIELDS if name in instance.__dict__}
+
+
+@receiver(post_init, sender=User)
+def remember_profile(sender, instance, **kwargs):
+    instance._loaded_profile = profile(instance)
+
+
+@receiver(pre_save, sender=User)
+def flag_profile_change(sender, instance, update_fields=None, **kwargs):
+    loaded = getattr(instance, '_loaded_profile', {})
+    instance._profile_changed = not instance._state.adding and any(
+        loaded.get(name) != value for name, value in profile(instance).items()
+        if update_fields is None or name in update_fields)
+
+
+@receiver(post_save, sender=User)
+def log_profile_change(sender, instance, **kwargs):
+    instance._loaded_profile = profile(instance)
+    # bumps the versions that cached responses and ETags of these boards are keyed by
+    if not instance._profile_changed:
+        return
+    changes = [
+        (board_id, BoardChange.BOARD, board_id, BoardChange.UPDATED) if role == BoardAccess.OWNER
+        else (board_id, BoardChange.MEMBER, instance.pk, BoardChange.UPDATED)
+        for board_id, role in BoardAccess.objects.filter(user_id=instance.pk).values_list('board_id', 'role')
+    ]
+    if changes:
+        response_cache.invalidate_boards({board_id for board_id, *_ in changes})
+        record_board_changes(changes)
+
+
+@receiver(post_save, sender=Board)
+@receiver(post_delete, sender=Board)
+def invalidate_board_membership(sender, instance, **kwargs):
+    membership_cache.invalidate([instance.pk])
+    response_cache.invalidate_boards([instance.pk])
+
+
+@receiver(post_delete, sender=Board)
+def drop_board_changes(sender, instance, **kwargs):
+    BoardChange.objects.filter(board_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Board)
+def sync_owner_access(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'owner' not in update_fields:
+        return
+    if not created and getattr(instance, 'loaded_owner_id', None) == instance.owner_id:
+        return
+    if created or not BoardAccess.objects.filter(board_id=instance.pk, role=BoardAccess.OWNER) \
+            .update(user_id=instance.owner_id):
+        BoardAccess.objects.create(board_id=instance.pk, user_id=instance.owner_id, role=BoardAccess.OWNER)
+
+
+@receiver(post_save, sender=Board)
+def log_board_save(sender, instance, created, **kwargs):
+    if not created:
+        record_board_changes([(instance.pk, BoardChange.BOARD, instance.pk, BoardChange.UPDATED)])
+
+
+@receiver(post_save, sender=Section)
+@receiver(post_delete, sender=Section)
+def log_section_change(sender, instance, created=None, **kwargs):
+    response_cache.invalidate_boards([instance.board_id])
+    record_board_changes([(instance.board_id, BoardChange.SECTION, instance.pk, _action(created))])
+
+
+@receiver(post_save, sender=Sticker)
+@receiver(post_delete, sender=Sticker)
+def log_sticker_change(sender, instance, created=None, **kwargs):
+    section_field = Sticker._meta.get_field('section')
+    if section_field.is_cached(instance) and instance.section.pk == instance.section_id:
+        board_id = instance.section.board_id
+    else:
+        board_id = Section.objects.filter(pk=instance.section_id).values_list('board_id', flat=True).first()
+    response_cache.invalidate_boards([board_id])
+    record_board_changes([(board_id, BoardChange.STICKER, instance.pk, _action(created))])
+
+
+@receiver(m2m_changed, sender=Board.users.through)
+def board_users_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # clear() does not report which rows it removes
+        if reverse:
+            instance._cleared_ids = set(instance.guest_boards.values_list('id', flat=True))
+        else:
+            instance._cleared_ids = set(instance.users.values_list('id', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_cleared_ids', set())
+    if not pk_set:
+        return
+    change = BoardChange.CREATED if action == 'post_add' else BoardChange.DELETED
+    if reverse:
+        pairs = [(board_id, instance.pk) for board_id in pk_set]
+    else:
+        pairs = [(instance.pk, user_id) for user_id in pk_set]
+    membership_cache.invalidate({board_id for board_id, _ in pairs})
+    # a new member's board list does not show the board yet
+    response_cache.invalidate_boards({board_id for board_id, _ in pairs})
+    response_cache.invalidate_users({user_id for _, user_id in pairs})
+    sync_guest_access(pairs, added=action == 'post_add')
+    record_board_changes([(board_id, BoardChange.MEMBER, user_id, change) for board_id, user_id in pairs])
+
+
+def sync_guest_access(pairs, added):
+    if added:
+        BoardAccess.objects.bulk_create(
+            [BoardAccess(board_id=board_id, user_id=user_id, role=BoardAccess.GUEST) for board_id, user_id in pairs],
+            ignore_conflicts=True,
+        )
+        return
+    query = Q()
+    for board_id, user_id in pairs:
+        query |= Q(board_id=board_id, user_id=user_id)
+    BoardAccess.objects.filter(query, role=BoardAccess.GUEST).delete()
+
+
+def _action(created):
+    if created is None:
+        return BoardChange.DELETED
+    return BoardChange.CREATED if created else BoardChange.UPDATED
@@ -0,0 +1,259 @@
+"""
+SQLite tuning for several worker processes sharing one database file.
+
+Every new SQLite connection gets the SQLITE_PRAGMAS (WAL, relaxed fsync,
+bigger page cache, memory-mapped reads, busy timeout). Write requests run
+in one transaction that takes the write lock up front (BEGIN IMMEDIATE,
+with the boards.backends.sqlite3 engine), so concurrent writers queue on
+busy_timeout instead of failing, and that is retried with bounded,
+jittered backoff if SQLite still reports the database as locked.
+
+With SQLITE_WRITE_QUEUE on, the write requests of opted-in views instead
+go through `WriteQueue`, which group-commits them from a single writer.
+"""
+import functools
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+from django.conf import settings
+from django.db import OperationalError, connections, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework.permissions import SAFE_METHODS
+
+DEFAULT_WRITE_RETRIES = 5
+DEFAULT_RETRY_BACKOFF = 0.01
+DEFAULT_RETRY_BACKOFF_MAX = 0.5
+DEFAULT_QUEUE_BATCH = 64
+DEFAULT_QUEUE_TIMEOUT = 30
+
+
+@receiver(connection_created)
+def apply_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if pragmas:
+        with connection.cursor() as cursor:
+            for name, value in pragmas.items():
+                cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+
+def is_locked(error):
+    message = str(error).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def run_with_write_retry(call, using='default'):
+    """
+    Runs `call` in a transaction, retrying it up to SQLITE_WRITE_RETRIES
+    times while SQLite reports the database as locked.
+    """
+    if connections[using].vendor != 'sqlite' or connections[using].in_atomic_block:
+        return call()
+    retries = getattr(settings, 'SQLITE_WRITE_RETRIES', DEFAULT_WRITE_RETRIES)
+    for attempt in range(retries + 1):
+        try:
+            with immediate(connections[using]), transaction.atomic(using=using):
+                return call()
+        except OperationalError as error:
+            if attempt == retries or not is_locked(error):
+                raise
+        time.sleep(backoff_delay(attempt))
+
+
+def backoff_delay(attempt):
+    backoff = getattr(settings, 'SQLITE_RETRY_BACKOFF', DEFAULT_RETRY_BACKOFF)
+    backoff_max = getattr(settings, 'SQLITE_RETRY_BACKOFF_MAX', DEFAULT_RETRY_BACKOFF_MAX)
+    return random.uniform(0, min(backoff_max, backoff * 2 ** attempt))
+
+
+@contextmanager
+def immediate(connection):
+    """
+    Makes the next transaction of `connection` start with BEGIN IMMEDIATE
+    when it uses the boards.backends.sqlite3 engine.
+    """
+    previous = getattr(connection, 'immediate_transactions', None)
+    if previous is None:
+        yield
+        return
+    connection.immediate_transactions = True
+    try:
+        yield
+    finally:
+        connection.immediate_transactions = previous
+
+
+def retry_writes(view=None, queued=False):
+    """
+    Wraps a view function so that unsafe requests go through
+    `run_with_write_retry`, or through the write queue if `queued` and
+    SQLITE_WRITE_QUEUE is on.
+    """
+    if view is None:
+        return functools.partial(retry_writes, queued=queued)
+
+    @functools.wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return view(request, *args, **kwargs)
+        # buffer the body so that every attempt can parse it again
+        request.body
+        call = functools.partial(view, request, *args, **kwargs)
+        if queued and getattr(settings, 'SQLITE_WRITE_QUEUE', False) \
+                and not connections['default'].in_atomic_block:
+            return write_queue.submit(call, getattr(request, 'query_recorder', None))
+        return run_with_write_retry(call)
+    return wrapped
+
+
+class WriteRetryMixin:
+    """
+    `retry_writes` for class-based views; `queued_writes` opts into the
+    write queue.
+    """
+    queued_writes = False
+
+    @classmethod
+    def as_view(cls, *args, **kwargs):
+        return retry_writes(super().as_view(*args, **kwargs), queued=cls.queued_writes)
+
+
+class WriteQueue:
+    """
+    Single writer for the mutations of this process. Request threads hand
+    their write calls to one writer thread and wait for the result; the
+    writer runs every call waiting at that moment (up to
+    SQLITE_WRITE_QUEUE_BATCH) in one transaction, each call in its own
+    savepoint, and commits once. Across processes the writers take turns
+    through an exclusive lock on SQLITE_WRITE_QUEUE_LOCK, so at most one
+    process is writing and the others sleep instead of polling SQLite.
+
+    A call that raises, or marks the transaction for rollback with
+    `transaction.set_rollback(True)`, only undoes its own savepoint. Results
+    are handed back after the commit; if the batch cannot commit because
+    the database stays locked, it is retried as a whole with the usual
+    backoff. A call still queued after SQLITE_WRITE_QUEUE_TIMEOUT seconds is
+    cancelled and never runs; one the writer has started is waited for.
+    """
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self.batches = 0
+        self.calls = 0
+
+    def submit(self, call, recorder=None):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((call, recorder, future))
+        try:
+            return future.result(timeout=getattr(settings, 'SQLITE_WRITE_QUEUE_TIMEOUT', DEFAULT_QUEUE_TIMEOUT))
+        except TimeoutError:
+            if future.cancel():
+                raise
+            # too late to cancel: the caller must see whether it committed
+            return future.result()
+
+    def stats(self):
+        with self._lock:
+            return {'batches': self.batches, 'calls': self.calls, 'pending': self._queue.qsize()}
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        max_batch = getattr(settings, 'SQLITE_WRITE_QUEUE_BATCH', DEFAULT_QUEUE_BATCH)
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if batch:
+                self._commit(batch)
+
+    def _commit(self, batch):
+        retries = getattr(settings, 'SQLITE_WRITE_RETRIES', DEFAULT_WRITE_RETRIES)
+        for attempt in range(retries + 1):
+            try:
+                results = self._attempt(batch)
+            except OperationalError as error:
+                if attempt < retries and is_locked(error):
+                    time.sleep(backoff_delay(attempt))
+                    continue
+                results = [(False, error)] * len(batch)
+            except Exception as error:
+                results = [(False, error)] * len(batch)
+            finally:
+                connections['default'].close_if_unusable_or_obsolete()
+            break
+        with self._lock:
+            self.batches += 1
+            self.calls += len(batch)
+        for (_, _, future), (ok, value) in zip(batch, results):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _attempt(self, batch):
+        connection = connections['default']
+        results = []
+        with self._process_lock(), immediate(connection), transaction.atomic():
+            for call, recorder, _ in batch:
+                try:
+                    with recording(connection, recorder), transaction.atomic():
+                        results.append((True, call()))
+                except OperationalError as error:
+                    if is_locked(error):
+                        raise
+                    results.append((False, error))
+                except Exception as error:
+                    results.append((False, error))
+        return results
+
+    @contextmanager
+    def _process_lock(self):
+        path = getattr(settings, 'SQLITE_WRITE_QUEUE_LOCK', None)
+        if not path or fcntl is None:
+            yield
+            return
+        if self._lock_file is None:
+            self._lock_file = open(path, 'a')
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+
+write_queue = WriteQueue()
+
+
+@contextmanager
+def recording(connection, recorder):
+    """
+    Counts the queries of a queued call towards its request's QueryRecorder.
+    """
+    if recorder is None:
+        yield
+        return
+    with connection.execute_wrapper(recorder):
+        yield
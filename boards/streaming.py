@@ -0,0 +1,51 @@
+"""
+Streamed JSON lists.
+
+`stream_response` returns the whole queryset as one JSON array, reading
+it with `.iterator(chunk_size=...)` and rendering one row at a time, so
+memory depends on the chunk size rather than on the number of rows, and
+the first rows go out before the last ones are read. The body has the
+same format as JSONRenderer's, without pagination.
+
+Rows are read while the body is written, after the view has returned. A
+streaming body is written on the request thread under WSGI and under
+boards.asyncviews. Django 3.0's ASGI handler writes it from the event
+loop instead, where queries are not allowed, so requests served by that
+handler get the buffered, paginated response.
+"""
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+DEFAULT_STREAM_CHUNK_SIZE = 200
+STREAM_PARAM = 'stream'
+
+
+def wants_stream(request):
+    if request.query_params.get(STREAM_PARAM) not in ('1', 'true'):
+        return False
+    django_request = request._request
+    return not isinstance(django_request, ASGIRequest) or getattr(django_request, 'streaming_supported', False)
+
+
+def json_array(queryset, serializer, chunk_size=None):
+    """
+    Yields the rendered JSON array of `queryset`, one piece per chunk of rows.
+    """
+    chunk_size = chunk_size or getattr(settings, 'STREAM_CHUNK_SIZE', DEFAULT_STREAM_CHUNK_SIZE)
+    render = JSONRenderer().render
+    pieces = [b'[']
+    for index, instance in enumerate(queryset.iterator(chunk_size=chunk_size)):
+        if index:
+            pieces.append(b',')
+        pieces.append(render(serializer.to_representation(instance)))
+        if len(pieces) >= 2 * chunk_size:
+            yield b''.join(pieces)
+            pieces = []
+    pieces.append(b']')
+    yield b''.join(pieces)
+
+
+def stream_response(queryset, serializer, chunk_size=None):
+    return StreamingHttpResponse(json_array(queryset, serializer, chunk_size), content_type='application/json')
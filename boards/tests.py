@@ -1,8 +1,41 @@
+import asyncio
+import base64
+import io
+import json
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from boards.models import Board
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from boards.models import Board, BoardAccess, BoardChange, BoardInvite, Job, Section, Sticker
+from boards.membership import membership_cache
+from boards.responsecache import response_cache
+from boards import ordering
+from boards.authentication import credential_cache
+from boards.tokens import deny_list, issue_tokens
+from boards.serializers import UserSerializer
+from boards.asyncviews import AsyncReadApplication
+from boards.events import BoardEventsApplication, DatabaseBroker, broker
+from boards import benchmark, deletion, jobs, metrics
+from boards.generate import Generator
+from boards.pagination import BoardsCursorPagination
+from boards.sqlite import run_with_write_retry, write_queue
+from boards.querybudget import QueryBudgetExceeded, assert_query_budget, query_shape
+from boards.views import BoardViewSet, JobViewSet, SectionViewSet, StickerViewSet, UserViewSet
+from rest_framework.authtoken.models import Token
 
 
 class UserTests(APITestCase):
@@ -114,3 +147,1417 @@ class InviteTests(APITestCase):
         self.assertNotIn('id', response.data)
         self.assertEqual(board.users.count(), 0)
         self.assertEqual(board.invite_link, key)
+
+
+@override_settings(QUERY_BUDGET_ACTION='raise')
+class BoardInviteTests(APITestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        self.owner = User.objects.create(username="owner")
+        self.guests = [User.objects.create(username="guest{}".format(i)) for i in range(3)]
+        self.board = Board.objects.create(title="test", owner=self.owner)
+
+    def create(self, **data):
+        self.client.force_authenticate(self.owner)
+        response = self.client.post(reverse('board-invites', args=[self.board.id]), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['token']
+
+    def redeem(self, token, user):
+        self.client.force_authenticate(user)
+        return self.client.post(reverse('invite', args=[token]), {}, format='json')
+
+    def test_use_limit(self):
+        token = self.create(max_uses=2)
+        for guest in self.guests[:2]:
+            self.assertEqual(self.redeem(token, guest).data, {'id': self.board.id})
+        # members do not use it up
+        self.assertEqual(self.redeem(token, self.guests[0]).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.redeem(token, self.guests[2]).status_code, status.HTTP_410_GONE)
+        self.assertEqual(set(self.board.users.all()), set(self.guests[:2]))
+        self.assertEqual(BoardAccess.objects.filter(board=self.board, role=BoardAccess.GUEST).count(), 2)
+        self.assertEqual(BoardChange.objects.filter(board=self.board, kind=BoardChange.MEMBER).count(), 2)
+
+    def test_expiry(self):
+        token = self.create(expires_in=60)
+        BoardInvite.objects.filter(token=token).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.redeem(token, self.guests[0]).status_code, status.HTTP_410_GONE)
+        self.assertEqual(self.board.users.count(), 0)
+
+    def test_redeem_does_not_save_board(self):
+        token = self.create()
+        link = Board.objects.get(pk=self.board.pk).invite_link
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.redeem(token, self.guests[0]).status_code, status.HTTP_200_OK)
+        writes = [q['sql'] for q in queries if q['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertFalse([sql for sql in writes if 'SET "title"' in sql])
+        self.assertEqual(len([sql for sql in writes if 'boards_board_users' in sql]), 1)
+        self.assertEqual(Board.objects.get(pk=self.board.pk).invite_link, link)
+
+    def test_unknown_token(self):
+        self.assertEqual(self.redeem('nope', self.guests[0]).status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(DELETION_BATCH_SIZE=3)
+class DeletionTests(APITestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        self.owner = User.objects.create(username="owner")
+        self.guest = User.objects.create(username="guest")
+        self.board = Board.objects.create(title="test", owner=self.owner)
+        self.board.users.add(self.guest)
+        self.other = Board.objects.create(title="other", owner=self.guest)
+        self.other.users.add(self.owner)
+        for board in (self.board, self.other):
+            section = Section.objects.create(title="section", board=board)
+            for i in range(4):
+                Sticker.objects.create(title=str(i), text="text", section=section, assigned_to=self.owner)
+
+    def test_board_is_hidden_then_purged(self):
+        self.client.force_authenticate(self.owner)
+        response = self.client.delete(reverse('board-detail', args=[self.board.id]))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['state'], Job.PENDING)
+        self.assertEqual(self.client.get(reverse('board-detail', args=[self.board.id])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.client.force_authenticate(self.guest)
+        self.assertEqual([b['id'] for b in self.client.get(reverse('board-list')).data], [self.other.id])
+        self.assertEqual(len(self.client.get(reverse('sticker-list')).data), 4)
+        self.assertFalse(membership_cache.has_access(self.board.id, self.guest.id))
+
+        self.assertEqual(jobs.Worker().drain(), 1)
+        self.client.force_authenticate(self.owner)
+        job = self.client.get(response['Location']).data
+        self.assertEqual((job['state'], job['progress'], job['total']), (Job.DONE, 6, 6))
+        self.assertFalse(Board.objects.filter(pk=self.board.id).exists())
+        self.assertEqual(Sticker.objects.count(), 4)
+
+    def test_delete_me(self):
+        self.client.force_authenticate(self.owner)
+        response = self.client.delete(reverse('user-delete-me'))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(User.objects.get(pk=self.owner.pk).is_active)
+        self.client.force_authenticate(self.guest)
+        self.assertEqual(self.client.get(reverse('user-detail', args=[self.owner.id])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        version = Board.objects.get(pk=self.other.pk).version
+
+        jobs.Worker().drain()
+        job = Job.objects.get(pk=response.data['id'])
+        self.assertEqual((job.state, job.progress, job.total), (Job.DONE, 11, 11))
+        self.assertFalse(User.objects.filter(pk=self.owner.pk).exists())
+        self.assertEqual(Sticker.objects.count(), 0)
+        # the surviving board logs the removed stickers and membership
+        self.assertEqual(BoardChange.objects.filter(board=self.other, seq__gt=version).count(), 5)
+
+    def test_boards_created_during_purge_are_removed(self):
+        job = deletion.delete_user(self.owner)
+        remove_board = deletion.remove_board
+
+        def create_late_board(job, board_id):
+            remove_board(job, board_id)
+            if board_id == self.board.id:
+                late = Board.objects.create(title="late", owner=self.owner)
+                Section.objects.create(title="section", board=late)
+        with mock.patch('boards.deletion.remove_board', create_late_board):
+            jobs.Worker().drain()
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.progress, job.total), (Job.DONE, 13, 13))
+        self.assertFalse(User.objects.filter(pk=self.owner.pk).exists())
+        self.assertEqual(list(Board.objects.values_list('id', flat=True)), [self.other.id])
+
+
+@jobs.task
+def record_call(job, value, fail_times=0):
+    if job.attempts <= fail_times:
+        raise ValueError('attempt {}'.format(job.attempts))
+    return value
+
+
+@override_settings(JOBS_RETRY_BACKOFF=10, JOBS_RETRY_BACKOFF_MAX=15)
+class JobTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user")
+        self.worker = jobs.Worker()
+
+    def test_priority_then_age(self):
+        first = jobs.enqueue(record_call, 'first')
+        urgent = jobs.enqueue(record_call, 'urgent', priority=5)
+        later = jobs.enqueue(record_call, 'later', delay=60)
+        self.assertEqual(self.worker.claim().pk, urgent.pk)
+        self.assertEqual(self.worker.claim().pk, first.pk)
+        self.assertIsNone(self.worker.claim())
+        Job.objects.filter(pk=later.pk).update(run_at=timezone.now())
+        self.assertEqual(self.worker.claim().pk, later.pk)
+
+    def test_retry_with_backoff_then_fail(self):
+        job = jobs.enqueue(record_call, 'value', 1, max_attempts=2)
+        self.assertEqual(self.worker.drain(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts, job.error), (Job.PENDING, 1, 'ValueError: attempt 1'))
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=9))
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.assertEqual(self.worker.drain(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts, json.loads(job.result)), (Job.DONE, 2, 'value'))
+
+        job = jobs.enqueue(record_call, 'value', 5, max_attempts=2)
+        self.worker.drain()
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.worker.drain()
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts), (Job.FAILED, 2))
+        self.assertEqual([jobs.retry_delay(n) for n in (1, 2, 3)], [10, 15, 15])
+
+    def test_expired_lease_is_claimed_again(self):
+        job = jobs.enqueue(record_call, 'value')
+        self.assertEqual(self.worker.claim().pk, job.pk)
+        self.assertIsNone(jobs.Worker(name='other').claim())
+        Job.objects.filter(pk=job.pk).update(lease_expires=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(jobs.Worker(name='other').claim().attempts, 2)
+
+    def test_status_api(self):
+        own = jobs.enqueue(record_call, 'value', requested_by=self.user.id)
+        other = jobs.enqueue(record_call, 'value')
+        self.client.force_authenticate(self.user)
+        self.assertEqual([job['id'] for job in self.client.get(reverse('job-list')).data], [own.id])
+        self.assertEqual(self.client.get(reverse('job-detail', args=[other.id])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.worker.drain()
+        data = self.client.get(reverse('job-detail', args=[own.id])).data
+        self.assertEqual((data['state'], data['result']), (Job.DONE, 'value'))
+        self.assertEqual(len(self.client.get(reverse('job-list'), {'state': Job.PENDING}).data), 0)
+
+
+class MembershipCacheTests(APITestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        self.owner = User.objects.create(username="owner")
+        self.guest = User.objects.create(username="guest")
+        self.board = Board.objects.create(title="test", owner=self.owner)
+
+    def test_cached_lookup(self):
+        before = membership_cache.stats()
+        self.assertTrue(membership_cache.is_owner(self.board.id, self.owner.id))
+        with self.assertNumQueries(0):
+            self.assertFalse(membership_cache.has_access(self.board.id, self.guest.id))
+        stats = membership_cache.stats()
+        self.assertEqual(stats['misses'] - before['misses'], 1)
+        self.assertEqual(stats['hits'] - before['hits'], 1)
+
+    def test_invalidated_on_membership_change(self):
+        self.assertFalse(membership_cache.is_member(self.board.id, self.guest.id))
+        self.board.users.add(self.guest)
+        self.assertTrue(membership_cache.is_member(self.board.id, self.guest.id))
+        self.guest.guest_boards.remove(self.board)
+        self.assertFalse(membership_cache.is_member(self.board.id, self.guest.id))
+
+    def test_invalidated_on_owner_change(self):
+        self.assertTrue(membership_cache.is_owner(self.board.id, self.owner.id))
+        self.board.owner = self.guest
+        self.board.save()
+        self.assertTrue(membership_cache.is_owner(self.board.id, self.guest.id))
+
+    def test_writes_see_removals_by_other_processes(self):
+        self.board.users.add(self.guest)
+        section = Section.objects.create(title="section", board=self.board)
+        self.assertTrue(membership_cache.has_access(self.board.id, self.guest.id))
+        # another process does not invalidate this one's cache
+        with mock.patch.object(membership_cache, 'invalidate'):
+            self.board.users.remove(self.guest)
+        self.assertTrue(membership_cache.has_access(self.board.id, self.guest.id))
+        self.client.force_authenticate(self.guest)
+        response = self.client.post(reverse('section-list'), {'title': 's', 'board': self.board.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post(reverse('sticker-list'), {'title': 't', 'text': 'x', 'section': section.id},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post(reverse('sticker-bulk'), {'operations': [
+            {'op': 'create', 'data': {'title': 't', 'text': 'x', 'section': section.id}}]}, format='json')
+        self.assertEqual(response.data['results'][0]['errors'], {'status': 'request was not permitted'})
+        self.assertFalse(Sticker.objects.exists())
+
+
+class SnapshotTests(APITestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        self.owner = User.objects.create(username="owner")
+        self.guest = User.objects.create(username="guest")
+        self.board = Board.objects.create(title="test", owner=self.owner)
+        self.board.users.add(self.guest)
+        self.client.force_authenticate(self.owner)
+
+    def add_section(self, stickers):
+        section = Section.objects.create(title="section", board=self.board)
+        for i in range(stickers):
+            Sticker.objects.create(title=str(i), text="text", section=section)
+        return section
+
+    def test_snapshot(self):
+        section = self.add_section(2)
+        response = self.client.get(reverse('board-snapshot', args=[self.board.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['board']['id'], self.board.id)
+        self.assertEqual(response.data['sections'][0]['id'], section.id)
+        self.assertEqual(len(response.data['sections'][0]['stickers']), 2)
+        self.assertEqual(response.data['members'][0]['username'], 'guest')
+        self.assertEqual(response.data['member_count'], 1)
+
+    def test_snapshot_query_count_is_constant(self):
+        url = reverse('board-snapshot', args=[self.board.id])
+        self.add_section(1)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url)
+        for _ in range(3):
+            self.add_section(5)
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(url)
+        self.assertEqual(len(small), len(large))
+
+
+class PaginationTests(APITestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        self.owner = User.objects.create(username="owner")
+        self.board = Board.objects.create(title="test", owner=self.owner)
+        self.section = Section.objects.create(title="section", board=self.board)
+        self.stickers = [Sticker.objects.create(title=str(i), text="text", section=self.section) for i in range(5)]
+        self.client.force_authenticate(self.owner)
+
+    def collect(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data), 2)
+            ids.extend(item['id'] for item in response.data)
+            match = re.search(r'<([^>]+)>; rel="next"', response.get('Link', ''))
+            url = match.group(1) if match else None
+        return ids
+
+    def test_list_pages(self):
+        self.assertEqual(self.collect(reverse('sticker-list') + '?page_size=2'), [s.id for s in self.stickers])
+
+    def test_action_pages(self):
+        url = reverse('board-stickers', args=[self.board.id]) + '?page_size=2'
+        self.assertEqual(self.collect(url), [s.id for s in self.stickers])
+
+    def test_unpaginated_unless_asked(self):
+        with mock.patch.object(BoardsCursorPagination, 'page_size', 2):
+            for url in (reverse('sticker-list'), reverse('board-stickers', args=[self.board.id])):
+                response = self.client.get(url)
+                self.assertEqual([item['id'] for item in response.data], [s.id for s in self.stickers])
+                self.assertNotIn('Link', response)
+                response = self.client.get(url + '?cursor=')
+                self.assertEqual(len(response.data), 2)
+                self.assertIn('rel="next"', response['Link'])
+
+    @override_settings(STREAM_CHUNK_SIZE=2)
+    def test_stream_returns_every_row(self):
+        paginated = self.client.get(reverse('section-stickers', args=[self.section.id]))
+        for url in (reverse('board-stickers', args=[self.board.id]), reverse('section-stickers', args=[self.section.id])):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url + '?stream=1')
+                body = b''.join(response.streaming_content)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.streaming)
+            self.assertEqual(json.loads(body), json.loads(paginated.content))
+            self.assertNotIn('Link', response)
+            # one query per chunk of 2 rows, whatever serializes them
+            self.assertLessEqual(len(queries), 10)
+
+
+class ReadModelTests(APITestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        self.owner = User.objects.create(username="owner")
+        guests = [User.objects.create(username="guest{}".format(i)) for i in range(3)]
+        for title in ("b\u00e9", "second"):
+            board = Board.objects.create(title=title, description="d\u2028", owner=self.owner)
+            board.users.add(*reversed(guests))
+            for position in (2.5, 1.0):
+                section = Section.objects.create(title="s", board=board, position=position)
+                Sticker.objects.create(title="t", text="x", section=section, assigned_to=guests[0])
+                Sticker.objects.create(title="u", text="y", section=section, position=0.5)
+        self.board = board
+        self.client.force_authenticate(self.owner)
+
+    def test_same_bytes_as_serializers(self):
+        urls = [reverse(name) for name in ('board-list', 'section-list', 'sticker-list')]
+        urls += [reverse(name, args=[self.board.id]) for name in ('board-sections', 'board-stickers')]
+        for url in urls:
+            for query in ('', '?page_size=1'):
+                fast = self.client.get(url + query)
+                with override_settings(READ_MODELS_ENABLED=False):
+                    slow = self.client.get(url + query)
+                self.assertEqual(fast.status_code, status.HTTP_200_OK)
+                self.assertEqual(fast.content, slow.content, url + query)
+                self.assertEqual(fast.get('Link'), slow.get('Link'))
+
+    def test_throughput_benchmark_checks_output(self):
+        results = benchmark.read_model_throughput(repeat=1)
+        self.assertEqual(results['sticker'][0], 8)
+        self.assertEqual(set(results), {'sticker', 'section', 'board'})
+
+
+class StickerBulkTests(APITestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        self.owner = User.objects.create(username="owner")
+        self.other = User.objects.create(username="other")
+        self.board = Board.objects.create(title="test", owner=self.owner)
+        self.first = Section.objects.create(title="first", board=self.board)
+        self.second = Section.objects.create(title="second", board=self.board)
+        foreign_board = Board.objects.create(title="foreign", owner=self.other)
+        self.foreign = Section.objects.create(title="foreign", board=foreign_board)
+        self.stickers = [Sticker.objects.create(title=str(i), text="text", section=self.first) for i in range(3)]
+        self.url = reverse('sticker-bulk')
+        self.client.force_authenticate(self.owner)
+
+    def test_bulk_operations(self):
+        operations = [
+            {'op': 'create', 'data': {'title': 'new', 'text': 'text', 'section': self.second.id}},
+            {'op': 'move', 'id': self.stickers[0].id, 'section': self.second.id},
+            {'op': 'update', 'id': self.stickers[1].id, 'data': {'title': 'renamed'}},
+            {'op': 'delete', 'id': self.stickers[2].id},
+        ]
+        response = self.client.post(self.url, {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([r['status'] for r in results], ['created', 'moved', 'updated', 'deleted'])
+        self.assertTrue(Sticker.objects.filter(pk=results[0]['id'], title='new', section=self.second).exists())
+        self.assertEqual(Sticker.objects.get(pk=self.stickers[0].id).section_id, self.second.id)
+        self.assertEqual(Sticker.objects.get(pk=self.stickers[1].id).title, 'renamed')
+        self.assertFalse(Sticker.objects.filter(pk=self.stickers[2].id).exists())
+
+    def test_per_item_errors(self):
+        operations = [
+            {'op': 'create', 'data': {'title': 'foreign', 'text': 'text', 'section': self.foreign.id}},
+            {'op': 'move', 'id': self.stickers[0].id, 'section': self.foreign.id},
+            {'op': 'delete', 'id': self.stickers[1].id},
+        ]
+        response = self.client.post(self.url, {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertIn('errors', results[0])
+        self.assertIn('errors', results[1])
+        self.assertEqual(results[2]['status'], 'deleted')
+        self.assertFalse(Sticker.objects.filter(pk=self.stickers[1].id).exists())
+
+    def test_atomic_batch_fails_as_a_whole(self):
+        operations = [
+            {'op': 'delete', 'id': self.stickers[0].id},
+            {'op': 'update', 'id': 0, 'data': {'title': 'missing'}},
+        ]
+        response = self.client.post(self.url, {'operations': operations, 'atomic': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(Sticker.objects.filter(pk=self.stickers[0].id).exists())
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        def run(op, count):
+            if op == 'create':
+                operations = [{'op': 'create', 'data': {'title': str(i), 'text': 'text', 'section': self.first.id}}
+                              for i in range(count)]
+            else:
+                stickers = [Sticker.objects.create(title=str(i), text='text', section=self.first) for i in range(count)]
+                operations = [{'op': 'delete', 'id': sticker.id} for sticker in stickers]
+            logged = BoardChange.objects.count()
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(self.url, {'operations': operations}, format='json')
+            # one change log entry per operation
+            self.assertEqual(BoardChange.objects.count(), logged + count)
+            return len(queries)
+        for op in ('create', 'delete'):
+            run(op, 1)
+            self.assertEqual(run(op, 2), run(op, 20))
+
+
+class OrderingTests(APITestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        self.owner = User.objects.create(username="owner")
+        self.board = Board.objects.create(title="test", owner=self.owner)
+        self.section = Section.objects.create(title="first", board=self.board)
+        self.other = Section.objects.create(title="second", board=self.board)
+        self.stickers = [Sticker.objects.create(title=str(i), text="text", section=self.section) for i in range(3)]
+        self.client.force_authenticate(self.owner)
+
+    def order(self, section):
+        return list(section.stickers.values_list('id', flat=True))
+
+    def test_created_in_order(self):
+        self.assertEqual(self.order(self.section), [s.id for s in self.stickers])
+        self.assertEqual(list(self.board.sections.values_list('id', flat=True)), [self.section.id, self.other.id])
+
+    def test_move_writes_one_row(self):
+        first, second, third = self.stickers
+        url = reverse('sticker-move', args=[third.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'after': first.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.order(self.section), [first.id, third.id, second.id])
+        writes = [q for q in queries if q['sql'].startswith(('UPDATE', 'INSERT', 'DELETE'))
+                  and 'boards_sticker' in q['sql']]
+        self.assertEqual(len(writes), 1)
+
+    def test_move_to_other_section(self):
+        first = self.stickers[0]
+        response = self.client.post(reverse('sticker-move', args=[first.id]), {'section': self.other.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.order(self.other), [first.id])
+
+    def test_move_section(self):
+        response = self.client.post(reverse('section-move', args=[self.other.id]), {'before': self.section.id},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(self.board.sections.values_list('id', flat=True)), [self.other.id, self.section.id])
+
+    def test_dense_positions_are_rebalanced(self):
+        first, second, third = self.stickers
+        position, needs_rebalance = ordering.position_between(
+            Sticker.objects.exclude(pk=third.pk), after=first)
+        self.assertFalse(needs_rebalance)
+        Sticker.objects.filter(pk=second.pk).update(position=first.position + ordering.MIN_POSITION_GAP)
+        position, needs_rebalance = ordering.position_between(
+            Sticker.objects.exclude(pk=third.pk), after=first)
+        self.assertTrue(needs_rebalance)
+        ordering.rebalance(Sticker, {'section_id': self.section.id}, self.board.id)
+        self.assertEqual(list(self.section.stickers.values_list('position', flat=True)), [1.0, 2.0, 3.0])
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        self.owner = User.objects.create(username="owner")
+        self.guest = User.objects.create(username="guest")
+        self.board = Board.objects.create(title="test", owner=self.owner)
+        self.section = Section.objects.create(title="section", board=self.board)
+        Sticker.objects.create(title="sticker", text="text", section=self.section)
+        self.url = reverse('board-stickers', args=[self.board.id])
+        self.client.force_authenticate(self.owner)
+
+    def version(self):
+        return Board.objects.get(pk=self.board.pk).version
+
+    def assert_fresh(self, etag):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        return response['ETag']
+
+    def test_not_modified_skips_sticker_query(self):
+        etag = self.client.get(self.url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse([q for q in queries if 'boards_sticker' in q['sql']])
+
+    def test_not_modified_loads_only_the_board(self):
+        for url in (self.url, reverse('board-detail', args=[self.board.id]),
+                    reverse('board-detail', args=[self.board.id]) + '?expand=owner,sections,users',
+                    reverse('board-snapshot', args=[self.board.id])):
+            etag = self.client.get(url)['ETag']
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            # the board lookup, membership being cached
+            self.assertEqual(len(queries), 1)
+            self.assertTrue(queries[0]['sql'].startswith('SELECT "boards_board"."id"'))
+
+    def test_changes_bump_version(self):
+        etag = self.client.get(self.url)['ETag']
+        sticker = Sticker.objects.create(title="new", text="text", section=self.section)
+        etag = self.assert_fresh(etag)
+        sticker.delete()
+        etag = self.assert_fresh(etag)
+        self.board.users.add(self.guest)
+        etag = self.assert_fresh(etag)
+        self.guest.guest_boards.clear()
+        self.assert_fresh(etag)
+
+    def test_stale_instance_does_not_roll_back_version(self):
+        board = Board.objects.get(pk=self.board.pk)
+        Section.objects.create(title="other", board=self.board)
+        version = self.version()
+        board.title = "renamed"
+        board.save()
+        self.assertEqual(self.version(), version + 1)
+
+    def test_section_stickers_etag(self):
+        url = reverse('section-stickers', args=[self.section.id])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.client.post(reverse('sticker-bulk'), {'operations': [
+            {'op': 'create', 'data': {'title': 'bulk', 'text': 'text', 'section': self.section.id}},
+        ]}, format='json')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+
+class ChangeLogTests(APITestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        self.owner = User.objects.create(username="owner")
+        self.guest = User.objects.create(username="guest")
+        self.board = Board.objects.create(title="test", owner=self.owner)
+        self.section = Section.objects.create(title="section", board=self.board)
+        self.sticker = Sticker.objects.create(title="sticker", text="text", section=self.section)
+        self.client.force_authenticate(self.owner)
+
+    def changes(self, since):
+        response = self.client.get(reverse('board-changes', args=[self.board.id]), {'since': since})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def version(self):
+        return Board.objects.get(pk=self.board.pk).version
+
+    def test_deltas_since_version(self):
+        since = self.version()
+        new = Sticker.objects.create(title="new", text="text", section=self.section)
+        new.title = "renamed"
+        new.save()
+        deleted_id = self.sticker.id
+        self.sticker.delete()
+        self.board.users.add(self.guest)
+        data = self.changes(since)
+        self.assertFalse(data['reset'])
+        self.assertEqual(data['version'], self.version())
+        entries = {(c['kind'], c['id']): c for c in data['changes']}
+        self.assertEqual(entries[('sticker', new.id)]['action'], 'created')
+        self.assertEqual(entries[('sticker', new.id)]['data']['title'], 'renamed')
+        self.assertEqual(entries[('sticker', deleted_id)]['action'], 'deleted')
+        self.assertNotIn('data', entries[('sticker', deleted_id)])
+        self.assertEqual(entries[('member', self.guest.id)]['action'], 'created')
+        self.assertEqual(self.changes(data['version'])['changes'], [])
+
+    @override_settings(BOARD_CHANGES_RETAINED=2, BOARD_CHANGES_COMPACT_EVERY=1)
+    def test_compaction_falls_back_to_snapshot(self):
+        since = self.version()
+        for i in range(3):
+            Sticker.objects.create(title=str(i), text="text", section=self.section)
+        self.assertFalse(self.board.changes.filter(seq__lte=since).exists())
+        data = self.changes(since)
+        self.assertTrue(data['reset'])
+        self.assertEqual(data['snapshot']['board']['version'], self.version())
+
+    def test_board_delete_drops_changes(self):
+        self.board.delete()
+        self.assertFalse(BoardChange.objects.exists())
+
+
+class BoardEventsTests(TransactionTestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        self.owner = User.objects.create(username="owner")
+        self.stranger = User.objects.create(username="stranger")
+        self.board = Board.objects.create(title="test", owner=self.owner)
+        self.section = Section.objects.create(title="section", board=self.board)
+        self.app = BoardEventsApplication(None)
+
+    def scope(self, user):
+        return {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/api/boards/{}/events/'.format(self.board.id),
+            'query_string': 'token={}'.format(Token.objects.get(user=user).key).encode(),
+            'headers': [],
+        }
+
+    def test_stream_delivers_committed_changes(self):
+        scope = self.scope(self.owner)
+
+        async def run():
+            communicator = ApplicationCommunicator(self.app, scope)
+            start = await communicator.receive_output(timeout=5)
+            self.assertEqual(start['status'], 200)
+            await communicator.receive_output(timeout=5)
+            sticker = await sync_to_async(Sticker.objects.create, thread_sensitive=True)(
+                title="sticker", text="text", section=self.section)
+            body = (await communicator.receive_output(timeout=5))['body'].decode()
+            await communicator.send_input({'type': 'http.disconnect'})
+            await communicator.wait(timeout=5)
+            return sticker, body
+
+        sticker, body = async_to_sync(run)()
+        self.assertIn('event: change', body)
+        self.assertIn('"id": {}'.format(sticker.id), body)
+
+    def test_stream_requires_board_access(self):
+        scope = self.scope(self.stranger)
+
+        async def run():
+            communicator = ApplicationCommunicator(self.app, scope)
+            start = await communicator.receive_output(timeout=5)
+            await communicator.wait(timeout=5)
+            return start
+
+        self.assertEqual(async_to_sync(run)()['status'], 404)
+
+    def test_slow_consumer_gets_resync(self):
+        async def run():
+            subscription = broker.subscribe(self.board.id, self.owner.id, maxsize=2)
+            for seq in range(5):
+                subscription.push({'type': 'change', 'seq': seq})
+            await asyncio.sleep(0)
+            events = await subscription.get()
+            broker.unsubscribe(subscription)
+            return events
+
+        self.assertEqual(async_to_sync(run)(), [{'type': 'resync', 'board': self.board.id}])
+
+    @override_settings(BOARD_EVENT_POLL_INTERVAL=0.01)
+    def test_database_broker_sees_other_processes(self):
+        # a broker of its own, so nothing is published to it directly
+        other = DatabaseBroker()
+        self.board.refresh_from_db()
+
+        async def run():
+            subscription = other.subscribe(self.board.id, self.owner.id, since=self.board.version)
+            sticker = await sync_to_async(Sticker.objects.create, thread_sensitive=True)(
+                title="sticker", text="text", section=self.section)
+            events = await asyncio.wait_for(subscription.get(), 5)
+            other.unsubscribe(subscription)
+            return sticker, events
+
+        sticker, events = async_to_sync(run)()
+        self.assertEqual([(event['kind'], event['id'], event['action']) for event in events],
+                         [('sticker', sticker.id, 'created')])
+        self.assertEqual(events[0]['seq'], Board.objects.get(pk=self.board.id).version)
+
+
+class AsyncReadTests(TransactionTestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        deny_list.clear()
+        self.owner = User.objects.create(username="owner")
+        self.stranger = User.objects.create(username="stranger")
+        self.board = Board.objects.create(title="test", owner=self.owner)
+        Section.objects.create(title="section", board=self.board)
+        self.fallbacks = []
+        self.app = AsyncReadApplication(self.fallback)
+
+    async def fallback(self, scope, receive, send):
+        self.fallbacks.append(scope['path'])
+        await send({'type': 'http.response.start', 'status': 418, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    def get(self, path, authorization):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(),
+            'server': ('localhost', 80), 'headers': [(b'authorization', authorization.encode()), (b'host', b'localhost')],
+        }
+
+        async def run():
+            communicator = ApplicationCommunicator(self.app, scope)
+            await communicator.send_input({'type': 'http.request'})
+            start = await communicator.receive_output(timeout=5)
+            body = b''
+            while True:
+                message = await communicator.receive_output(timeout=5)
+                body += message['body']
+                if not message.get('more_body'):
+                    return start['status'], body
+
+        return async_to_sync(run)()
+
+    def test_matches_sync_view(self):
+        access, _ = issue_tokens(self.owner)
+        key = Token.objects.get(user=self.owner).key
+        expected = APIClient(SERVER_NAME='localhost')
+        expected.credentials(HTTP_AUTHORIZATION='Token ' + key)
+        for path in ('/boards/{}/'.format(self.board.id), '/api/boards/{}/sections/'.format(self.board.id),
+                     '/boards/', '/stickers/'):
+            sync_body = expected.get(path).content
+            for authorization in ('Bearer ' + access, 'Token ' + key):
+                status_code, body = self.get(path, authorization)
+                self.assertEqual(status_code, 200)
+                self.assertEqual(json.loads(body), json.loads(sync_body))
+        self.assertEqual(self.fallbacks, [])
+
+    def test_streams_from_worker_thread(self):
+        access, _ = issue_tokens(self.owner)
+        section = Section.objects.get(board=self.board)
+        Sticker.objects.create(title="sticker", text="text", section=section)
+        status_code, body = self.get('/boards/{}/stickers/?stream=1'.format(self.board.id), 'Bearer ' + access)
+        self.assertEqual(status_code, 200)
+        self.assertEqual([row['title'] for row in json.loads(body)], ['sticker'])
+
+    def test_stranger_gets_404(self):
+        access, _ = issue_tokens(self.stranger)
+        self.assertEqual(self.get('/boards/{}/'.format(self.board.id), 'Bearer ' + access)[0], 404)
+        self.assertEqual(self.get('/boards/{}/users/'.format(self.board.id), 'Bearer ' + access)[0], 404)
+
+    def test_other_authentication_falls_through(self):
+        basic = 'Basic ' + base64.b64encode(b'owner:password').decode()
+        self.assertEqual(self.get('/boards/', basic)[0], 418)
+        self.assertEqual(self.get('/boards/', 'Bearer invalid')[0], 418)
+        self.assertEqual(self.fallbacks, ['/boards/', '/boards/'])
+
+    def test_inactive_user_is_not_served(self):
+        access, _ = issue_tokens(self.owner)
+        key = Token.objects.get(user=self.owner).key
+        self.owner.is_active = False
+        self.owner.save()
+        for authorization in ('Bearer ' + access, 'Token ' + key):
+            self.assertEqual(self.get('/boards/{}/'.format(self.board.id), authorization)[0], 418)
+        self.assertEqual(len(self.fallbacks), 2)
+
+
+@override_settings(QUERY_BUDGET_ACTION='raise')
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        self.owner = User.objects.create(username="owner")
+        self.guest = User.objects.create(username="guest")
+        self.board = Board.objects.create(title="test", owner=self.owner)
+        self.board.users.add(self.guest)
+        self.section = Section.objects.create(title="section", board=self.board)
+        Sticker.objects.create(title="a", text="text", section=self.section)
+
+    def get(self, url, user):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content), len(queries)
+
+    def test_hit_until_a_write_to_the_board(self):
+        url = reverse('board-stickers', args=[self.board.id])
+        hits = response_cache.stats()['hits']
+        data, misses = self.get(url, self.owner)
+        self.assertEqual(self.get(url, self.owner)[0], data)
+        self.assertEqual(response_cache.stats()['hits'], hits + 1)
+        self.assertLess(self.get(url, self.owner)[1], misses)
+        Sticker.objects.create(title="b", text="text", section=self.section)
+        self.assertEqual(len(self.get(url, self.owner)[0]), 2)
+
+    def test_entries_are_per_user(self):
+        url = reverse('board-list')
+        hits = response_cache.stats()['hits']
+        self.get(url, self.owner)
+        self.get(url, self.guest)
+        self.assertEqual(response_cache.stats()['hits'], hits)
+        self.get(url, self.guest)
+        self.assertEqual(response_cache.stats()['hits'], hits + 1)
+
+    def test_profile_changes_reach_other_processes(self):
+        url = reverse('board-list') + '?expand=owner,users'
+        data = self.get(url, self.guest)[0]
+        self.assertEqual(data[0]['owner']['username'], 'owner')
+        # another process's save cannot clear this process's entries
+        with mock.patch.object(response_cache, 'invalidate_boards'):
+            self.owner.username = 'renamed'
+            self.owner.save()
+            self.guest.first_name = 'Guest'
+            self.guest.save()
+        data = self.get(url, self.guest)[0]
+        self.assertEqual(data[0]['owner']['username'], 'renamed')
+        self.assertEqual(data[0]['users'][0]['first_name'], 'Guest')
+        changes = BoardChange.objects.filter(board=self.board, action=BoardChange.UPDATED)
+        self.assertEqual(sorted(changes.values_list('kind', flat=True)), [BoardChange.BOARD, BoardChange.MEMBER])
+        version = Board.objects.get(pk=self.board.pk).version
+        self.guest.last_login = timezone.now()
+        self.guest.save(update_fields=['last_login'])
+        self.assertEqual(Board.objects.get(pk=self.board.pk).version, version)
+
+    def test_membership_changes_invalidate_lists(self):
+        url = reverse('board-list')
+        other = User.objects.create(username="other")
+        self.assertEqual(self.get(url, other)[0], [])
+        self.board.users.add(other)
+        self.assertEqual([board['id'] for board in self.get(url, other)[0]], [self.board.id])
+        self.assertEqual(self.get(url, self.owner)[0][0]['users'], [self.guest.id, other.id])
+        self.board.users.remove(other)
+        self.assertEqual(self.get(url, other)[0], [])
+
+    def test_memory_is_bounded(self):
+        for index in range(5):
+            Sticker.objects.create(title=str(index) * 100, text="text", section=self.section)
+        evictions = response_cache.stats()['evictions']
+        with self.settings(RESPONSE_CACHE_MAX_BYTES=1000):
+            for page_size in range(1, 6):
+                self.get(reverse('board-stickers', args=[self.board.id]) + '?page_size={}'.format(page_size),
+                         self.owner)
+        stats = response_cache.stats()
+        self.assertLessEqual(stats['bytes'], 1000)
+        self.assertGreater(stats['evictions'], evictions)
+
+
+class FieldsetTests(APITestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        self.owner = User.objects.create(username="owner")
+        self.guest = User.objects.create(username="guest")
+        for index in range(3):
+            board = Board.objects.create(title=str(index), owner=self.owner)
+            board.users.add(self.guest)
+            for position in range(2):
+                section = Section.objects.create(title="section", board=board, position=position)
+                Sticker.objects.create(title="sticker", text="text", section=section, assigned_to=self.guest)
+        self.board = board
+        self.client.force_authenticate(self.owner)
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data, len(queries)
+
+    def test_sparse_fields_run_fewer_queries(self):
+        for url, fields in [(reverse('board-list'), {'id', 'title'}),
+                            (reverse('board-detail', args=[self.board.id]), {'id', 'title'}),
+                            (reverse('user-detail', args=[self.owner.id]), {'id', 'username'})]:
+            _, full_queries = self.get(url)
+            data, queries = self.get(url, fields=','.join(fields))
+            self.assertEqual(set(data[0] if isinstance(data, list) else data), fields)
+            self.assertLess(queries, full_queries)
+
+    def test_sparse_fields_on_pages_ordered_by_position(self):
+        section = self.board.sections.first()
+        for url in (reverse('board-sections', args=[self.board.id]), reverse('section-stickers', args=[section.id])):
+            data, _ = self.get(url, page_size=1, fields='title')
+            self.assertEqual([set(row) for row in data], [{'title'}])
+
+    def test_expand_inlines_related_objects(self):
+        data, _ = self.get(reverse('board-detail', args=[self.board.id]), expand='owner,sections,users')
+        self.assertEqual(data['owner']['username'], 'owner')
+        self.assertEqual([section['position'] for section in data['sections']], [0, 1])
+        self.assertEqual(len(data['sections'][0]['stickers']), 1)
+        self.assertEqual([user['id'] for user in data['users']], [self.guest.id])
+
+        data, _ = self.get(reverse('sticker-list'), fields='id', expand='section,assigned_to')
+        self.assertEqual(set(data[0]), {'id', 'section', 'assigned_to'})
+        self.assertEqual(data[0]['assigned_to']['username'], 'guest')
+        self.assertEqual(data[0]['section']['stickers'], [data[0]['id']])
+
+    def test_user_boards_are_not_expanded(self):
+        url = reverse('user-detail', args=[self.owner.id])
+        outsider = User.objects.create(username="outsider")
+        for user in (None, outsider, self.guest):
+            self.client.force_authenticate(user)
+            data, _ = self.get(url, expand='boards,guest_boards')
+            self.assertTrue(all(isinstance(board, int) for board in data['boards'] + data['guest_boards']))
+            self.assertNotIn('invite_link', str(data))
+
+    def test_expanded_lists_do_not_query_per_row(self):
+        _, queries = self.get(reverse('board-list'), expand='owner,sections,users')
+        board = Board.objects.create(title="more", owner=self.owner)
+        Section.objects.create(title="section", board=board)
+        board.users.add(self.guest)
+        data, more_queries = self.get(reverse('board-list'), expand='owner,sections,users')
+        self.assertEqual(len(data), 4)
+        self.assertEqual(queries, more_queries)
+
+    def test_writes_ignore_the_shape(self):
+        response = self.client.post(reverse('board-list') + '?fields=id', {'title': 'new', 'description': ''})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn('sections', response.data)
+
+
+class BoardAccessTests(APITestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        self.owner = User.objects.create(username="owner")
+        self.guest = User.objects.create(username="guest")
+        self.board = Board.objects.create(title="test", owner=self.owner)
+
+    def access(self):
+        return set(BoardAccess.objects.filter(board=self.board).values_list('user_id', 'role'))
+
+    def test_access_follows_owner_and_members(self):
+        self.assertEqual(self.access(), {(self.owner.id, 'owner')})
+        self.board.users.add(self.guest)
+        self.assertEqual(self.access(), {(self.owner.id, 'owner'), (self.guest.id, 'guest')})
+        self.guest.guest_boards.clear()
+        self.assertEqual(self.access(), {(self.owner.id, 'owner')})
+        self.board.owner = self.guest
+        self.board.save()
+        self.assertEqual(self.access(), {(self.guest.id, 'owner')})
+
+    def test_lists_use_semi_join_without_distinct(self):
+        self.board.users.add(self.guest)
+        section = Section.objects.create(title="section", board=self.board)
+        Sticker.objects.create(title="sticker", text="text", section=section)
+        self.client.force_authenticate(self.guest)
+        for name in ('board-list', 'section-list', 'sticker-list'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(name))
+            self.assertEqual(len(response.data), 1)
+            self.assertFalse([q for q in queries if 'DISTINCT' in q['sql']])
+
+
+class CachedBasicAuthenticationTests(APITestCase):
+    def setUp(self):
+        credential_cache.clear()
+        self.user = User.objects.create(username="basic")
+        self.user.set_password('11111111')
+        self.user.save()
+        self.url = reverse('board-list')
+
+    def get(self, password):
+        credentials = base64.b64encode('basic:{}'.format(password).encode()).decode()
+        return self.client.get(self.url, HTTP_AUTHORIZATION='Basic ' + credentials)
+
+    def test_second_request_skips_hasher(self):
+        before = credential_cache.stats()
+        self.assertEqual(self.get('11111111').status_code, status.HTTP_200_OK)
+        with mock.patch('django.contrib.auth.models.User.check_password') as check_password:
+            self.assertEqual(self.get('11111111').status_code, status.HTTP_200_OK)
+        check_password.assert_not_called()
+        stats = credential_cache.stats()
+        self.assertEqual(stats['hits'] - before['hits'], 1)
+        self.assertEqual(stats['verifications'] - before['verifications'], 1)
+
+    def test_wrong_password_is_not_cached(self):
+        self.get('11111111')
+        self.assertEqual(self.get('wrong-password').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_invalidates(self):
+        self.get('11111111')
+        serializer = UserSerializer(self.user, data={'username': 'basic', 'password': '22222222'})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.assertEqual(self.get('11111111').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.get('22222222').status_code, status.HTTP_200_OK)
+
+    def test_deleted_user_is_rejected(self):
+        self.get('11111111')
+        self.user.delete()
+        self.assertEqual(self.get('11111111').status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class SignedTokenTests(APITestCase):
+    def setUp(self):
+        deny_list.clear()
+        self.user = User.objects.create(username="signed")
+        self.user.set_password('11111111')
+        self.user.save()
+        response = self.client.post('/api/login/', {'username': 'signed', 'password': '11111111'})
+        self.access = response.data['access']
+        self.refresh = response.data['refresh']
+
+    def get(self, access):
+        return self.client.get(reverse('board-list'), HTTP_AUTHORIZATION='Bearer ' + access)
+
+    def test_access_token_needs_no_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get(self.access).status_code, status.HTTP_200_OK)
+        self.assertFalse([q for q in queries if 'authtoken_token' in q['sql'] or 'FROM "auth_user"' in q['sql']])
+
+    def test_revocation_survives_the_process(self):
+        self.assertEqual(self.client.post(reverse('token-revoke'), {'token': self.access}).status_code,
+                         status.HTTP_204_NO_CONTENT)
+        # as seen by another worker, or after a restart
+        deny_list.clear()
+        self.assertEqual(self.client.post(reverse('token-refresh'), {'refresh': self.refresh}).status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+
+    def test_changes_in_other_processes_stop_refresh(self):
+        # without this process's signals, only the access token's lifetime is left
+        for changes in ({'password': make_password('22222222')}, {'is_active': False}):
+            User.objects.filter(pk=self.user.pk).update(**changes)
+            self.assertEqual(self.client.post(reverse('token-refresh'), {'refresh': self.refresh}).status_code,
+                             status.HTTP_401_UNAUTHORIZED)
+            with override_settings(SIGNED_TOKEN_ACCESS_TTL=-1):
+                self.assertEqual(self.get(self.access).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_or_inactive_user_is_refused(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get(self.access).status_code, status.HTTP_401_UNAUTHORIZED)
+        deny_list.clear()
+        User.objects.filter(pk=self.user.pk).delete()
+        self.assertEqual(self.get(self.access).status_code, status.HTTP_401_UNAUTHORIZED)
+        # deleted in another process: refused once the user is loaded
+        user = User.objects.create(username="other")
+        access, _ = issue_tokens(user)
+        with mock.patch.object(deny_list, 'revoke_all'):
+            user.delete()
+        response = self.client.post(reverse('board-list'), {'title': 'board', 'description': 'text'},
+                                    HTTP_AUTHORIZATION='Bearer ' + access)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_refresh_and_revoke(self):
+        response = self.client.post(reverse('token-refresh'), {'refresh': self.refresh})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        access = response.data['access']
+        self.assertEqual(self.get(access).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.post(reverse('token-revoke'), {'token': self.refresh}).status_code,
+                         status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.get(access).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.client.post(reverse('token-refresh'), {'refresh': self.refresh}).status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_revokes(self):
+        self.user.set_password('22222222')
+        self.user.save()
+        self.assertEqual(self.get(self.access).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleting_drf_token_invalidates_refresh(self):
+        Token.objects.filter(user=self.user).delete()
+        self.assertEqual(self.client.post(reverse('token-refresh'), {'refresh': self.refresh}).status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+
+    def test_tampered_token_is_rejected(self):
+        self.assertEqual(self.get(self.access[:-1] + 'x').status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class BenchmarkTests(APITestCase):
+    def test_seed_and_run(self):
+        workload = benchmark.seed(users=6, boards=2, sections_per_board=2, stickers_per_section=3, members_per_board=2)
+        self.assertEqual(Sticker.objects.count(), 12)
+        self.assertEqual(BoardAccess.objects.count(), 6)
+        report = benchmark.run(benchmark.InProcessTarget(), workload, requests=60)
+        self.assertEqual(report['requests'], 60)
+        self.assertEqual(set(report['endpoints']), set(benchmark.DEFAULT_MIX))
+        for row in report['endpoints'].values():
+            self.assertEqual(row['errors'], 0)
+            self.assertGreater(row['queries'], 0)
+
+    def test_compare_flags_regressions(self):
+        baseline = {'endpoints': {'board_list': {'p95_ms': 10.0, 'rps': 100.0}}}
+        report = {'endpoints': {'board_list': {'p95_ms': 12.0, 'rps': 90.0}}}
+        rows, regressed = benchmark.compare(report, baseline, threshold=0.1)
+        self.assertEqual(regressed, ['board_list'])
+        self.assertAlmostEqual(rows[0][3], 0.2)
+
+
+class GenerateDataTests(APITestCase):
+    def generate(self, **options):
+        out = io.StringIO()
+        call_command('generate_data', stdout=out, **options)
+        return out.getvalue()
+
+    def test_generates_consistent_rows(self):
+        output = self.generate(users=20, boards=8, members='2-4', sections='geometric:2', stickers='3',
+                               batch_size=7, prefix='gen')
+        self.assertIn('Created 20 users, 8 boards', output)
+        self.assertEqual(Token.objects.filter(user__username__startswith='gen').count(), 20)
+        guests = Board.users.through.objects.count()
+        self.assertTrue(16 <= guests <= 32)
+        self.assertEqual(BoardAccess.objects.count(), 8 + guests)
+        self.assertEqual(Sticker.objects.count(), 3 * Section.objects.count())
+        for sticker in Sticker.objects.exclude(assigned_to=None).select_related('section__board'):
+            board = sticker.section.board
+            self.assertTrue(sticker.assigned_to_id == board.owner_id
+                            or board.users.filter(pk=sticker.assigned_to_id).exists())
+
+    def test_same_seed_same_data(self):
+        def snapshot():
+            return list(Sticker.objects.order_by('id').values_list(
+                'section__board__owner__username', 'section__position', 'position', 'assigned_to__username'))
+
+        self.generate(users=10, boards=4, seed=3, prefix='a')
+        first = snapshot()
+        Board.objects.all().delete()
+        User.objects.all().delete()
+        self.generate(users=10, boards=4, seed=3, prefix='a')
+        self.assertEqual(snapshot(), first)
+
+    def test_invalid_distribution(self):
+        with self.assertRaises(CommandError):
+            self.generate(members='5-2')
+
+    def test_existing_usernames_are_refused(self):
+        self.generate(users=3, boards=1, prefix='again')
+        with self.assertRaises(CommandError):
+            self.generate(users=3, boards=1, prefix='again')
+        self.assertIn('Created 3 users', self.generate(users=3, boards=1, prefix='other'))
+        self.assertEqual(Token.objects.filter(user__username__startswith='again').count(), 3)
+
+
+@override_settings(QUERY_BUDGET_ACTION='raise')
+class QueryBudgetTests(APITestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        Generator(seed=2).generate(12, 6, members='3', sections='3', stickers='4', assigned=1)
+        self.user = User.objects.get(pk=Board.objects.values_list('owner_id', flat=True).first())
+        Board.objects.filter(pk__in=Board.objects.exclude(owner=self.user).values('pk')[:3]) \
+            .update(owner=self.user)
+        BoardAccess.objects.filter(role=BoardAccess.OWNER).update(user=self.user)
+        self.board = Board.objects.filter(owner=self.user).first()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.get(user=self.user).key)
+
+    def test_query_shape(self):
+        self.assertEqual(query_shape("SELECT a FROM t WHERE id IN (%s, %s, %s) AND name = 'x' LIMIT 21"),
+                         'SELECT a FROM t WHERE id IN (%s, ...) AND name = %s LIMIT %s')
+
+    def test_list_endpoints_stay_within_budget(self):
+        for url in [reverse('board-list'), reverse('section-list'), reverse('sticker-list'),
+                    reverse('board-sections', args=[self.board.pk]), reverse('board-users', args=[self.board.pk])]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertGreater(len(response.data), 1)
+
+    def test_every_budgeted_endpoint_stays_within_budget(self):
+        board, user = self.board, self.user
+        members = list(User.objects.exclude(pk=user.pk)[:4])
+        board.users.set(members)
+        section = board.sections.first()
+        sticker = section.stickers.first()
+        invite = BoardInvite.objects.create(board=board, created_by=user)
+        job = jobs.enqueue(deletion.purge_board, 0, requested_by=user.pk)
+        outsiders = iter(User.objects.exclude(pk=user.pk).exclude(board_access__board=board))
+        sticker_data = {'title': 't', 'text': 'x', 'section': section.pk, 'assigned_to': members[0].pk}
+        requests = [
+            ('BoardViewSet', 'list', 'get', reverse('board-list'), None),
+            ('BoardViewSet', 'retrieve', 'get', reverse('board-detail', args=[board.pk]), None),
+            ('BoardViewSet', 'create', 'post', reverse('board-list'), {'title': 'new'}),
+            ('BoardViewSet', 'update', 'put', reverse('board-detail', args=[board.pk]),
+             {'title': 'put', 'users': [member.pk for member in members]}),
+            ('BoardViewSet', 'partial_update', 'patch', reverse('board-detail', args=[board.pk]), {'title': 'patch'}),
+            ('BoardViewSet', 'snapshot', 'get', reverse('board-snapshot', args=[board.pk]), None),
+            ('BoardViewSet', 'sections', 'get', reverse('board-sections', args=[board.pk]), None),
+            ('BoardViewSet', 'users', 'get', reverse('board-users', args=[board.pk]), None),
+            ('BoardViewSet', 'stickers', 'get', reverse('board-stickers', args=[board.pk]), None),
+            ('BoardViewSet', 'invites', 'get', reverse('board-invites', args=[board.pk]), None),
+            ('BoardViewSet', 'invites', 'post', reverse('board-invites', args=[board.pk]), {}),
+            ('SectionViewSet', 'list', 'get', reverse('section-list'), None),
+            ('SectionViewSet', 'retrieve', 'get', reverse('section-detail', args=[section.pk]), None),
+            ('SectionViewSet', 'create', 'post', reverse('section-list'), {'title': 'new', 'board': board.pk}),
+            ('SectionViewSet', 'update', 'put', reverse('section-detail', args=[section.pk]), {'title': 'put'}),
+            ('SectionViewSet', 'partial_update', 'patch', reverse('section-detail', args=[section.pk]),
+             {'title': 'patch'}),
+            ('SectionViewSet', 'stickers', 'get', reverse('section-stickers', args=[section.pk]), None),
+            ('SectionViewSet', 'move', 'post', reverse('section-move', args=[section.pk]), {'after': None}),
+            ('StickerViewSet', 'list', 'get', reverse('sticker-list'), None),
+            ('StickerViewSet', 'retrieve', 'get', reverse('sticker-detail', args=[sticker.pk]), None),
+            ('StickerViewSet', 'create', 'post', reverse('sticker-list'), sticker_data),
+            ('StickerViewSet', 'update', 'put', reverse('sticker-detail', args=[sticker.pk]), sticker_data),
+            ('StickerViewSet', 'move', 'post', reverse('sticker-move', args=[sticker.pk]), {'after': None}),
+            ('StickerViewSet', 'destroy', 'delete', reverse('sticker-detail', args=[sticker.pk]), None),
+            # every kind of change since the start, then a reset to a snapshot
+            ('BoardViewSet', 'changes', 'get', reverse('board-changes', args=[board.pk]) + '?since=0', None),
+            ('BoardViewSet', 'changes', 'get', reverse('board-changes', args=[board.pk]) + '?since=-5000', None),
+            ('UserViewSet', 'retrieve', 'get', reverse('user-detail', args=[user.pk]), None),
+            ('JobViewSet', 'list', 'get', reverse('job-list'), None),
+            ('JobViewSet', 'retrieve', 'get', reverse('job-detail', args=[job.pk]), None),
+            ('invite', None, 'post', reverse('invite', args=[invite.token]), {}),
+            ('invite', None, 'post', reverse('invite', args=[board.invite_link]), {}),
+            ('registration', None, 'post', reverse('registration'), {'username': 'new', 'password': 'Secret123x', 'boards': [], 'guest_boards': []}),
+        ]
+        covered = set()
+        for view, action, method, url, data in requests:
+            client = APIClient()
+            if view == 'invite':
+                client.force_authenticate(next(outsiders))
+            elif view != 'registration':
+                client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.get(user=user).key)
+            # the worst case: nothing cached
+            membership_cache.invalidate()
+            response_cache.clear()
+            response = getattr(client, method)(url, data, format='json')
+            self.assertLess(response.status_code, 300, (method, url, response.data))
+            covered.add((view, action))
+        budgeted = {(view.__name__, action) for view in (BoardViewSet, SectionViewSet, StickerViewSet, UserViewSet,
+                                                         JobViewSet) for action in view.query_budget}
+        self.assertEqual(covered, budgeted | {('invite', None), ('registration', None)})
+
+    def test_middleware_raises_over_budget(self):
+        with mock.patch.object(BoardViewSet, 'query_budget', {'list': 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('board-list'))
+
+    def test_assert_query_budget_reports_n_plus_one(self):
+        with self.assertRaisesRegex(AssertionError, 'N\\+1'):
+            with assert_query_budget():
+                [board.owner.username for board in Board.objects.all()]
+        with assert_query_budget(max_queries=1):
+            [board.owner.username for board in Board.objects.select_related('owner')]
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        metrics.registry.clear()
+        self.user = User.objects.create(username='owner')
+        self.board = Board.objects.create(title='board', owner=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.get(user=self.user).key)
+
+    @override_settings(METRICS_TOKEN='scraper')
+    def test_routes_and_phases(self):
+        self.client.get(reverse('board-detail', args=[self.board.pk]))
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer scraper')
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('boards_http_requests_total{route="board-detail",method="GET",status="200"} 1', body)
+        self.assertIn('boards_http_request_duration_seconds_count{route="board-detail",method="GET"} 1', body)
+        for phase in ('auth', 'permissions', 'db', 'serialization'):
+            self.assertIn('boards_http_request_phase_seconds_count{{route="board-detail",phase="{}"}} 1'
+                          .format(phase), body)
+        self.assertIn('boards_http_request_phase_seconds_bucket{route="board-detail",phase="db",le="+Inf"} 1', body)
+
+    @override_settings(METRICS_TOKEN='scraper', METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_only_staff_allowlisted_addresses_and_token_may_read(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+        self.client.credentials()
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1').status_code, 200)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    def test_multiprocess_files_are_added_up(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_MULTIPROCESS_DIR=directory):
+            other = metrics.Registry()
+            other.inc('boards_http_requests_total', ('board-list', 'GET', '200'), 2)
+            other.observe('boards_http_request_duration_seconds', ('board-list', 'GET'), 0.003)
+            with mock.patch('os.getpid', return_value=-1):
+                other.flush()
+            metrics.registry.inc('boards_http_requests_total', ('board-list', 'GET', '200'))
+            metrics.registry.flush()
+            counters, histograms = metrics.collect()
+        self.assertEqual(counters[('boards_http_requests_total', ('board-list', 'GET', '200'))], 3)
+        buckets, total, count = histograms[('boards_http_request_duration_seconds', ('board-list', 'GET'))]
+        self.assertEqual(count, 1)
+        self.assertEqual(buckets[metrics.BUCKETS.index(0.005)], 1)
+
+
+class SQLiteProfileTests(TransactionTestCase):
+    def test_pragmas_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def test_write_retry(self):
+        owner = User.objects.create(username='owner')
+        attempts = []
+
+        def write():
+            attempts.append(Board.objects.create(title='board', owner=owner).pk)
+            if len(attempts) < 3:
+                raise OperationalError('database is locked')
+            return attempts[-1]
+
+        with CaptureQueriesContext(connection) as queries, override_settings(SQLITE_RETRY_BACKOFF=0):
+            pk = run_with_write_retry(write)
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(list(Board.objects.values_list('pk', flat=True)), [pk])
+        self.assertIn('BEGIN IMMEDIATE', [q['sql'] for q in queries])
+
+    def test_other_errors_are_not_retried(self):
+        calls = []
+
+        def write():
+            calls.append(1)
+            raise OperationalError('no such table: nope')
+
+        with self.assertRaises(OperationalError):
+            run_with_write_retry(write)
+        self.assertEqual(len(calls), 1)
+
+
+@override_settings(SQLITE_WRITE_QUEUE=True, SQLITE_RETRY_BACKOFF=0)
+class WriteQueueTests(TransactionTestCase):
+    def setUp(self):
+        membership_cache.invalidate()
+        response_cache.clear()
+        self.owner = User.objects.create(username='owner')
+
+    def run_batch(self, *calls):
+        """
+        Runs `calls` as one batch: the first submitted call holds the writer
+        until the others are queued behind it.
+        """
+        release = threading.Event()
+        results = {}
+
+        def blocker():
+            release.wait(5)
+            return 'first'
+
+        def submit(name, call):
+            try:
+                results[name] = write_queue.submit(call)
+            except Exception as error:
+                results[name] = error
+
+        threads = [threading.Thread(target=submit, args=('first', blocker))]
+        threads[0].start()
+        while write_queue.stats()['pending']:
+            time.sleep(0.001)
+        for index, call in enumerate(calls):
+            threads.append(threading.Thread(target=submit, args=(index, call)))
+            threads[-1].start()
+        while write_queue.stats()['pending'] < len(calls):
+            time.sleep(0.001)
+        before = write_queue.stats()['batches']
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        return results, write_queue.stats()['batches'] - before
+
+    def test_group_commit_isolates_failures(self):
+        def create(title, fail=False):
+            def call():
+                board = Board.objects.create(title=title, owner_id=self.owner.pk)
+                if fail:
+                    raise ValueError(title)
+                return board.pk
+            return call
+
+        results, batches = self.run_batch(create('a'), create('b', fail=True), create('c'))
+        self.assertEqual(batches, 2)
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(sorted(Board.objects.values_list('title', flat=True)), ['a', 'c'])
+        self.assertEqual(results[0], Board.objects.get(title='a').pk)
+
+    def test_set_rollback_undoes_only_its_call(self):
+        def create(title, rollback=False):
+            def call():
+                Board.objects.create(title=title, owner_id=self.owner.pk)
+                transaction.set_rollback(rollback)
+                return title
+            return call
+
+        results, batches = self.run_batch(create('a'), create('b', rollback=True), create('c'))
+        self.assertEqual(batches, 2)
+        self.assertEqual(results[1], 'b')
+        self.assertEqual(sorted(Board.objects.values_list('title', flat=True)), ['a', 'c'])
+
+    def test_timed_out_call_never_runs(self):
+        release = threading.Event()
+        ran = []
+        first = threading.Thread(target=write_queue.submit, args=(lambda: release.wait(5),))
+        first.start()
+        while write_queue.stats()['pending']:
+            time.sleep(0.001)
+        with self.settings(SQLITE_WRITE_QUEUE_TIMEOUT=0.01):
+            with self.assertRaises(TimeoutError):
+                write_queue.submit(lambda: ran.append(Board.objects.create(title='late', owner_id=self.owner.pk)))
+        release.set()
+        first.join(5)
+        write_queue.submit(lambda: None)
+        self.assertEqual(ran, [])
+        self.assertFalse(Board.objects.filter(title='late').exists())
+
+    def test_queued_view_returns_result(self):
+        board = Board.objects.create(title='board', owner=self.owner)
+        section = Section.objects.create(title='section', board=board)
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        calls = write_queue.stats()['calls']
+        response = client.post(reverse('sticker-list'), {'title': 't', 'text': 'x', 'section': section.pk},
+                               format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Sticker.objects.filter(pk=response.data['id']).exists())
+        self.assertEqual(write_queue.stats()['calls'], calls + 1)
@@ -0,0 +1,217 @@
+"""
+Short-lived signed access tokens and their refresh tokens.
+
+Both are `django.core.signing` payloads, so verifying one is an HMAC check
+in memory with no database query:
+
+    {'u': user id, 'g': generation, 't': 'a' | 'r', 'i': issued at}
+
+A generation is shared by a refresh token and every access token minted
+from it; revoking it logs that client out. Both kinds also carry a
+fingerprint of the user's password hash, and refresh tokens one of the
+user's DRF Token key.
+
+Authenticating with an access token runs no query: the user is only
+loaded if the view needs more than its id. Revocation goes through the
+deny list and the short access lifetime instead. Changing a user's
+password, deactivating or deleting them revokes all their tokens in the
+process that saved it (boards/signals.py), and the other processes refuse
+the access tokens once they expire (SIGNED_TOKEN_ACCESS_TTL). Refreshing
+is where the durable state is checked: it reads the user, the Token row
+and the revoked generations (RevokedToken), so a refresh token of an
+inactive user, a changed password or a revoked generation stops working
+everywhere, even after a restart.
+"""
+import functools
+import hashlib
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from django.utils.functional import SimpleLazyObject
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from boards.models import RevokedToken
+
+ACCESS = 'a'
+REFRESH = 'r'
+SALT = 'boards.tokens'
+
+DEFAULT_ACCESS_TTL = 300
+DEFAULT_REFRESH_TTL = 7 * 24 * 3600
+
+
+def access_ttl():
+    return getattr(settings, 'SIGNED_TOKEN_ACCESS_TTL', DEFAULT_ACCESS_TTL)
+
+
+def refresh_ttl():
+    return getattr(settings, 'SIGNED_TOKEN_REFRESH_TTL', DEFAULT_REFRESH_TTL)
+
+
+class TokenDenyList:
+    """
+    Per-process record of revoked generations and of users whose tokens
+    issued up to some moment are all revoked, refusing their access tokens
+    without a query. Entries expire together with the longest-lived token
+    they could match.
+    """
+    def __init__(self):
+        self._generations = {}
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def revoke(self, user_id, generation):
+        with self._lock:
+            self._purge()
+            self._generations[(user_id, generation)] = time.time() + refresh_ttl()
+
+    def revoke_all(self, user_id):
+        now = time.time()
+        with self._lock:
+            self._purge()
+            self._users[user_id] = (now, now + refresh_ttl())
+
+    def is_revoked(self, user_id, generation, issued_at):
+        with self._lock:
+            if (user_id, generation) in self._generations:
+                return True
+            revoked = self._users.get(user_id)
+            return revoked is not None and issued_at <= revoked[0]
+
+    def clear(self):
+        with self._lock:
+            self._generations.clear()
+            self._users.clear()
+
+    def __len__(self):
+        return len(self._generations) + len(self._users)
+
+    def _purge(self):
+        now = time.time()
+        for key in [key for key, expires in self._generations.items() if expires < now]:
+            del self._generations[key]
+        for key in [key for key, (_, expires) in self._users.items() if expires < now]:
+            del self._users[key]
+
+
+deny_list = TokenDenyList()
+
+
+def key_fingerprint(key):
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def issue_tokens(user, token=None):
+    """
+    Returns a new (access, refresh) pair for `user` under a new generation.
+    """
+    if token is None:
+        token, _ = Token.objects.get_or_create(user=user)
+    generation = get_random_string(12)
+    password = key_fingerprint(user.password)
+    refresh = _sign(user.pk, generation, REFRESH, k=key_fingerprint(token.key), p=password)
+    return issue_access_token(user.pk, generation, password), refresh
+
+
+def issue_access_token(user_id, generation, password):
+    return _sign(user_id, generation, ACCESS, p=password)
+
+
+def verify_access_token(value):
+    """
+    Returns the payload of a validly signed access token that this process
+    has not seen revoked, or None. See `access_token_user`.
+    """
+    return _verify(value, ACCESS, access_ttl())
+
+
+class TokenUser(SimpleLazyObject):
+    """
+    User of a verified access token. The id and authentication flags are
+    answered from the token; anything else loads the user on first use.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id):
+        self.__dict__['id'] = user_id
+        self.__dict__['pk'] = user_id
+        super().__init__(functools.partial(load_token_user, user_id))
+
+    def __bool__(self):
+        return True
+
+
+def load_token_user(user_id):
+    user = User.objects.filter(pk=user_id).first()
+    if user is None:
+        # deleted by another process within the access token's lifetime
+        raise AuthenticationFailed('Invalid or expired token.')
+    return user
+
+
+def access_token_user(value):
+    """
+    Returns a TokenUser for a valid access token, or None; no query runs.
+    """
+    payload = verify_access_token(value)
+    return None if payload is None else TokenUser(payload['u'])
+
+
+def refresh_access_token(value):
+    """
+    Exchanges a refresh token for a new access token, or returns None. The
+    user must still be active with an unchanged password and own the Token
+    row the refresh token was issued against, and its generation must not
+    have been revoked.
+    """
+    payload = _verify(value, REFRESH, refresh_ttl())
+    if payload is None:
+        return None
+    if RevokedToken.objects.filter(generation=payload['g']).exists():
+        return None
+    rows = Token.objects.filter(user_id=payload['u'], user__is_active=True).values_list('key', 'user__password')
+    for key, password in rows:
+        if key_fingerprint(key) == payload.get('k') and key_fingerprint(password) == payload.get('p'):
+            return issue_access_token(payload['u'], payload['g'], payload['p'])
+    return None
+
+
+def revoke_token(value):
+    """
+    Revokes the generation of an access or refresh token. Returns whether the
+    token was valid.
+    """
+    for kind, ttl in ((REFRESH, refresh_ttl()), (ACCESS, access_ttl())):
+        payload = _verify(value, kind, ttl)
+        if payload is not None:
+            deny_list.revoke(payload['u'], payload['g'])
+            now = timezone.now()
+            RevokedToken.objects.filter(expires_at__lt=now).delete()
+            RevokedToken.objects.get_or_create(generation=payload['g'], defaults={
+                'user_id': payload['u'], 'expires_at': now + timedelta(seconds=refresh_ttl())})
+            return True
+    return False
+
+
+def _sign(user_id, generation, kind, **extra):
+    return signing.dumps(dict(u=user_id, g=generation, t=kind, i=round(time.time(), 3), **extra), salt=SALT)
+
+
+def _verify(value, kind, max_age):
+    try:
+        payload = signing.loads(value, salt=SALT, max_age=max_age)
+    except signing.BadSignature:
+        return None
+    if not isinstance(payload, dict) or payload.get('t') != kind:
+        return None
+    if deny_list.is_revoked(payload['u'], payload['g'], payload['i']):
+        return None
+    return payload
@@ -7,9 +7,12 @@ router.register(r'boards', views.BoardViewSet)
 router.register(r'sections', views.SectionViewSet)
 router.register(r'users', views.UserViewSet)
 router.register(r'stickers', views.StickerViewSet)
+router.register(r'jobs', views.JobViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
     path('invite/<slug:invite_id>/', views.invite, name='invite'),
-    path('registration/', views.registration, name='registration')
+    path('registration/', views.registration, name='registration'),
+    path('token/refresh/', views.token_refresh, name='token-refresh'),
+    path('token/revoke/', views.token_revoke, name='token-revoke'),
 ]
@@ -1,74 +1,193 @@
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.viewsets import GenericViewSet
 
-from boards.models import Board, Section, Sticker
+from boards.models import Board, BoardAccess, Job, Section, Sticker, next_position
+from boards import deletion, invites, ordering, tokens
 from boards.serializers import BoardSerializer, UserSerializer, SectionSerializer, StickerSerializer, \
-    UpdateSectionSerializer, UserRegisterSerializer
-from rest_framework.decorators import action, api_view, permission_classes
+    UpdateSectionSerializer, UserRegisterSerializer, BoardSnapshotSerializer, BoardInviteSerializer, \
+    JobSerializer
+from rest_framework.decorators import action, api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
 from django.contrib.auth.models import User
 from rest_framework import viewsets
 from rest_framework import mixins
 from rest_framework import permissions
+from boards.bulk import StickerBulkProcessor, max_bulk_operations
+from boards.changes import changes_since, is_retained
+from boards.conditional import BoardConditionalMixin
+from boards.fieldsets import shape_lookups, shape_queryset
+from boards.metrics import InstrumentedViewMixin, PhaseTimer
+from boards.pagination import PaginatedActionMixin
+from boards.querybudget import query_budget
+from boards.responsecache import CachedResponseMixin
+from boards.sqlite import WriteRetryMixin, retry_writes
 from boards.perm import IsOwnerOrBoardUser, IsSectionUser, IsStickerUser, IsAdminOrReadOnly
-from django.db.models import Q
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import status
 from rest_framework.authtoken.models import Token
+from django.db import transaction
+from django.urls import reverse
 from rest_framework.permissions import IsAuthenticated
-from django.utils.crypto import get_random_string
 
 
-class BoardViewSet(viewsets.ModelViewSet):
+class BoardViewSet(WriteRetryMixin, CachedResponseMixin, InstrumentedViewMixin, BoardConditionalMixin,
+                   PaginatedActionMixin, viewsets.ModelViewSet):
     """
     ViewSet for listing, creating,
     deleting updating and watching
     detailed information
     """
+    queued_writes = True
     queryset = Board.objects.all()
     serializer_class = BoardSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrBoardUser]
+    # what each action needs with nothing cached: 1 query to authenticate, 1
+    # to load the object, 2 to load its membership for reads or 1 to check it
+    # for writes, 3 to log a change, plus the action's own reads and writes
+    query_budget = {
+        'list': 5, 'retrieve': 6, 'create': 5, 'update': 12, 'partial_update': 10,
+        'snapshot': 7, 'changes': 12, 'sections': 6, 'users': 7, 'stickers': 5, 'invites': 5,
+    }
+
+    @property
+    def cursor_ordering(self):
+        if self.action == 'sections':
+            return ('position', 'id')
+        return None
 
     def get_queryset(self):
         queryset = super().get_queryset()
         user = self.request.user
         if not user.is_anonymous:
-            queryset = self.request.user.boards.all() | self.request.user.guest_boards.all()
+            queryset = queryset.filter(id__in=BoardAccess.board_ids(user))
         else:
             queryset = queryset.none()
-        return queryset.distinct()
+        # to-many relations are prefetched once the ETag has been checked
+        if self.action == 'snapshot':
+            queryset = queryset.select_related('owner')
+        elif self.action == 'retrieve':
+            selects, _ = shape_lookups(BoardSerializer, self.request)
+            if selects:
+                queryset = queryset.select_related(*selects)
+        return queryset
+
+    def serialize(self, serializer_class, instance):
+        with PhaseTimer(self.request, 'serialization'):
+            return serializer_class(instance).data
+
+    @staticmethod
+    def snapshot_prefetch():
+        return [Prefetch('sections', queryset=Section.objects.prefetch_related('stickers')), 'users']
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
+    def destroy(self, request, *args, **kwargs):
+        board = self.get_object()
+        return job_response(deletion.delete_board(board.pk, request.user.id))
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        versions = list(queryset.prefetch_related(None).values_list('id', 'version'))
+        return self.cached_response(versions, lambda: super(BoardViewSet, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        board = self.get_object()
+
+        def build():
+            prefetch_related_objects([board], *shape_lookups(BoardSerializer, request)[1])
+            return Response(self.get_serializer(board).data)
+        return self.conditional_response(board, build)
+
+    @action(detail=True, methods=['GET'])
+    def snapshot(self, request, pk=None):
+        board = self.get_object()
+
+        def build():
+            prefetch_related_objects([board], *self.snapshot_prefetch())
+            return Response(self.serialize(BoardSnapshotSerializer, board))
+        return self.conditional_response(board, build)
+
+    @action(detail=True, methods=['GET'])
+    def changes(self, request, pk=None):
+        board = self.get_object()
+        try:
+            since = int(request.query_params['since'])
+        except (KeyError, ValueError):
+            return Response({'since': ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        if not is_retained(board, since):
+            # too old to replay, the client has to start over from a snapshot
+            prefetch_related_objects([board], *self.snapshot_prefetch())
+            return Response({
+                'version': board.version,
+                'since': since,
+                'reset': True,
+                'snapshot': self.serialize(BoardSnapshotSerializer, board),
+            })
+        return Response({
+            'version': board.version,
+            'since': since,
+            'reset': False,
+            'changes': changes_since(board, since),
+        })
+
     @action(detail=True, methods=['GET'])
     def sections(self, request, pk=None):
         board = self.get_object()
-        return Response(SectionSerializer(board.sections.all(), many=True).data)
+        return self.conditional_response(
+            board, lambda: self.paginated_response(board.sections.all(), SectionSerializer))
 
     @action(detail=True, methods=['GET'])
     def users(self, request, pk=None):
         board = self.get_object()
-        return Response(UserSerializer(board.users.all(), many=True).data)
+        return self.paginated_response(board.users.all(), UserSerializer)
+
+    @action(detail=True, methods=['GET', 'POST'])
+    def invites(self, request, pk=None):
+        board = self.get_object()
+        if request.method == 'POST':
+            serializer = BoardInviteSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            invite = invites.create_invite(board, request.user.id, **serializer.validated_data)
+            return Response(BoardInviteSerializer(invite).data, status=status.HTTP_201_CREATED)
+        return self.paginated_response(board.invites.all(), BoardInviteSerializer)
 
     @action(detail=True, methods=['GET'])
     def stickers(self, request, pk=None):
         board = self.get_object()
-        return Response(StickerSerializer(Sticker.objects.all().filter(section__board=board), many=True).data)
+        return self.conditional_response(board, lambda: self.cached_response(
+            [(board.pk, board.version)], lambda: self.paginated_response(
+                Sticker.objects.all().filter(section__board=board), StickerSerializer, streamable=True)))
 
 
-class SectionViewSet(viewsets.ModelViewSet):
+class SectionViewSet(WriteRetryMixin, InstrumentedViewMixin, BoardConditionalMixin, PaginatedActionMixin,
+                     viewsets.ModelViewSet):
+    queued_writes = True
     queryset = Section.objects.all()
     serializer_class = SectionSerializer
     permission_classes = [permissions.IsAuthenticated, IsSectionUser]
+    query_budget = {
+        'list': 3, 'retrieve': 5, 'create': 10, 'update': 8, 'partial_update': 8, 'stickers': 5, 'move': 9,
+    }
+
+    @property
+    def cursor_ordering(self):
+        if self.action == 'stickers':
+            return ('position', 'id')
+        return None
 
     def get_queryset(self):
         queryset = super().get_queryset()
         user = self.request.user
         if not user.is_anonymous:
-            queryset = queryset.filter(Q(board__users__id=user.id) | Q(board__owner__id=user.id))
+            queryset = queryset.filter(board_id__in=BoardAccess.board_ids(user))
+            if self.action == 'stickers':
+                queryset = queryset.select_related('board')
+            elif self.action == 'retrieve':
+                queryset = shape_queryset(queryset, SectionSerializer, self.request)
         else:
             queryset = queryset.none()
-        return queryset.distinct()
+        return queryset
 
     def create(self, request, *args, **kwargs):
         board_id = request.data['board']
@@ -86,7 +205,19 @@ class SectionViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['GET'])
     def stickers(self, request, pk=None):
         section = self.get_object()
-        return Response(StickerSerializer(section.stickers.all(), many=True).data)
+        return self.conditional_response(
+            section.board, lambda: self.paginated_response(section.stickers.all(), StickerSerializer, streamable=True))
+
+    @action(detail=True, methods=['POST'])
+    def move(self, request, pk=None):
+        section = self.get_object()
+        scope = {'board_id': section.board_id}
+        with transaction.atomic():
+            after, before, errors = ordering.resolve_neighbours(Section, scope, request.data)
+            if errors:
+                return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+            position = ordering.move(Section, section.pk, scope, section.board_id, after=after, before=before)
+        return Response({'id': section.pk, 'board': section.board_id, 'position': position})
 
     def get_serializer_class(self):
         if self.action == 'update':
@@ -94,10 +225,13 @@ class SectionViewSet(viewsets.ModelViewSet):
         return super().get_serializer_class()
 
 
-class StickerViewSet(viewsets.ModelViewSet):
+class StickerViewSet(WriteRetryMixin, InstrumentedViewMixin, PaginatedActionMixin, viewsets.ModelViewSet):
+    queued_writes = True
     queryset = Sticker.objects.all()
     serializer_class = StickerSerializer
     permission_classes = [permissions.IsAuthenticated, IsStickerUser]
+    # bulk runs a savepoint per operation, so only its repeated shapes are checked
+    query_budget = {'list': 2, 'retrieve': 4, 'create': 10, 'update': 10, 'destroy': 7, 'move': 10}
 
     def update(self, request, *args, **kwargs):
         sticker = self.get_object()
@@ -108,31 +242,76 @@ class StickerViewSet(viewsets.ModelViewSet):
             }
             return Response(content, status=status.HTTP_403_FORBIDDEN)
         section = sections[0]
-        if str(sticker.section.board.id) != str(section.board.id):
+        if sticker.section.board_id != section.board_id:
             content = {
                 'status': 'request was not permitted'
             }
             return Response(content, status=status.HTTP_403_FORBIDDEN)
-        if not IsStickerUser().has_object_permission(request, self, sticker):
-            content = {
-                'status': 'request was not permitted'
-            }
-            return Response(content, status=status.HTTP_403_FORBIDDEN)
-        return super().update(request, *args, **kwargs)
+        # not super().update(), which would load the sticker and check its permissions again
+        serializer = self.get_serializer(sticker, data=request.data, partial=kwargs.pop('partial', False))
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+        return Response(serializer.data)
 
     def get_queryset(self):
         queryset = super().get_queryset()
         user = self.request.user
         if not user.is_anonymous:
-            queryset = queryset.filter(Q(section__board__users__id=user.id) | Q(section__board__owner__id=user.id))
+            queryset = queryset.filter(section__board_id__in=BoardAccess.board_ids(user))
+            queryset = queryset.select_related('section')
+            if self.action == 'retrieve':
+                queryset = shape_queryset(queryset, StickerSerializer, self.request)
         else:
             queryset = queryset.none()
-        return queryset.distinct()
+        return queryset
+
+    def perform_update(self, serializer):
+        section = serializer.validated_data.get('section')
+        if section is not None and section.pk != serializer.instance.section_id:
+            serializer.save(position=next_position(section.stickers.all()))
+        else:
+            serializer.save()
+
+    @action(detail=True, methods=['POST'])
+    def move(self, request, pk=None):
+        sticker = self.get_object()
+        section = Section.objects.filter(pk=request.data.get('section', sticker.section_id)).first()
+        if section is None:
+            content = {
+                'section': ['Such section does not exist']
+            }
+            return Response(content, status=status.HTTP_403_FORBIDDEN)
+        if section.board_id != sticker.section.board_id:
+            content = {
+                'status': 'request was not permitted'
+            }
+            return Response(content, status=status.HTTP_403_FORBIDDEN)
+        scope = {'section_id': section.pk}
+        with transaction.atomic():
+            after, before, errors = ordering.resolve_neighbours(Sticker, scope, request.data)
+            if errors:
+                return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+            position = ordering.move(Sticker, sticker.pk, scope, section.board_id, after=after, before=before)
+        return Response({'id': sticker.pk, 'section': section.pk, 'position': position})
+
+    @action(detail=False, methods=['POST'])
+    def bulk(self, request):
+        operations = request.data.get('operations')
+        if not isinstance(operations, list) or not operations:
+            return Response({'operations': ['Expected a non-empty list of operations.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(operations) > max_bulk_operations():
+            return Response({'operations': ['At most {} operations are allowed.'.format(max_bulk_operations())]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        atomic = str(request.data.get('atomic', '')).lower() in ('1', 'true')
+        results, ok = StickerBulkProcessor(request.user, operations).run(atomic=atomic)
+        if not ok and atomic:
+            return Response({'results': results}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'results': results})
 
     def create(self, request, *args, **kwargs):
         section_id = request.data['section']
         section = Section.objects.filter(pk=section_id)[0]
-        board = section.board
         if not IsSectionUser().has_object_permission(request, self, section):
             content = {
                 'status': 'request was not permitted'
@@ -141,7 +320,7 @@ class StickerViewSet(viewsets.ModelViewSet):
         return super().create(request, *args, **kwargs)
 
 
-class UserViewSet(GenericViewSet,
+class UserViewSet(WriteRetryMixin, InstrumentedViewMixin, GenericViewSet,
                   mixins.RetrieveModelMixin,
                   mixins.CreateModelMixin,
                   mixins.DestroyModelMixin,
@@ -149,12 +328,21 @@ class UserViewSet(GenericViewSet,
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAdminOrReadOnly]
+    query_budget = {'retrieve': 4}
+
+    def get_queryset(self):
+        queryset = super().get_queryset().exclude(pk__in=deletion.pending_user_ids())
+        if self.action == 'retrieve':
+            queryset = shape_queryset(queryset, UserSerializer, self.request)
+        return queryset
+
+    def destroy(self, request, *args, **kwargs):
+        return job_response(deletion.delete_user(self.get_object(), request.user.id))
 
     @action(detail=False, methods=['DELETE'], permission_classes=[IsAuthenticated])
     def delete_me(self, request):
         user = User.objects.get(id=request.user.id)
-        user.delete()
-        return Response('Successfully deleted', status=status.HTTP_200_OK)
+        return job_response(deletion.delete_user(user, user.id))
 
     # permission class gives no permission for POST requests from default user,
     # however user creates instead
@@ -164,29 +352,53 @@ class UserViewSet(GenericViewSet,
         return super().create(request, *args, **kwargs)
 
 
+class JobViewSet(InstrumentedViewMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, GenericViewSet):
+    """
+    Status of background jobs (boards/jobs.py), for the user who queued
+    them; superusers see every job. `?state=` filters the list.
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+    query_budget = {'list': 2, 'retrieve': 2}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        state = self.request.query_params.get('state')
+        if state:
+            queryset = queryset.filter(state=state)
+        if self.request.user.is_superuser:
+            return queryset
+        return queryset.filter(requested_by_id=self.request.user.id)
+
+
+def job_response(job):
+    """
+    202 Accepted for work queued as `job`, pointing at its status.
+    """
+    return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED,
+                    headers={'Location': reverse('job-detail', args=[job.pk])})
+
+
+@retry_writes(queued=True)
+@query_budget(9)
 @api_view(http_method_names=['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def invite(request, invite_id):
-    pk = invite_id
-    board = Board.objects.filter(invite_link=pk)
-    if board:
-        board = board[0]
-        user = request.user
-        if user not in board.users.all() and user != board.owner:
-            board.invite_link = get_random_string()
-            board.users.add(user)
-            board.save()
-        content = {
-            'id': board.id
-        }
-        return Response(content)
-    else:
+    try:
+        board_id = invites.redeem(invite_id, request.user.id)
+    except invites.InviteUnavailable as error:
+        return Response({'detail': str(error)}, status=status.HTTP_410_GONE)
+    if board_id is None:
         content = {
             'detail': 'Such invite token does not exist'
         }
         return Response(content, status=status.HTTP_404_NOT_FOUND)
+    return Response({'id': board_id})
 
 
+@retry_writes
+@query_budget(8)
 @api_view(http_method_names=['POST'])
 def registration(request):
     username = request.data.get('username')
@@ -201,15 +413,38 @@ def registration(request):
     return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class CustomAuthToken(ObtainAuthToken):
+class CustomAuthToken(WriteRetryMixin, InstrumentedViewMixin, ObtainAuthToken):
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data,
                                            context={'request': request})
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
         token, created = Token.objects.get_or_create(user=user)
+        access, refresh = tokens.issue_tokens(user, token)
         return Response({
             'token': token.key,
             'user_id': user.pk,
+            'access': access,
+            'refresh': refresh,
+            'expires_in': tokens.access_ttl(),
         })
 
+
+@retry_writes
+@api_view(http_method_names=['POST'])
+@authentication_classes([])
+def token_refresh(request):
+    access = tokens.refresh_access_token(request.data.get('refresh', ''))
+    if access is None:
+        return Response({'detail': 'Invalid or expired refresh token'}, status=status.HTTP_401_UNAUTHORIZED)
+    return Response({'access': access, 'expires_in': tokens.access_ttl()})
+
+
+@retry_writes
+@api_view(http_method_names=['POST'])
+@authentication_classes([])
+def token_revoke(request):
+    if not tokens.revoke_token(request.data.get('token', '')):
+        return Response({'detail': 'Invalid or expired token'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
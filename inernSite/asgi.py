@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'inernSite.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported once Django is set up
+from boards.asyncviews import AsyncReadApplication  # noqa: E402
+from boards.events import BoardEventsApplication  # noqa: E402
+
+application = BoardEventsApplication(AsyncReadApplication(django_application))
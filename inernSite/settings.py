@@ -53,6 +53,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'boards.metrics.MetricsMiddleware',
+    'boards.querybudget.QueryBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'inernSite.urls'
@@ -81,8 +83,12 @@ WSGI_APPLICATION = 'inernSite.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'ENGINE': 'boards.backends.sqlite3',
+        'NAME': os.environ.get('BOARDS_DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+        # seconds a connection is reused across requests (0 closes it after
+        # every request); the writer, job and event threads close or recycle
+        # their own connections, so they do not hold them past this either
+        'CONN_MAX_AGE': int(os.environ.get('BOARDS_CONN_MAX_AGE', 600)),
     }
 }
 
@@ -132,11 +138,134 @@ STATIC_URL = '/static/'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
+        'boards.authentication.SignedTokenAuthentication',
+        'boards.authentication.CachedBasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_RENDERER_CLASSES': (
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ),
+    'DEFAULT_PAGINATION_CLASS': 'boards.pagination.BoardsCursorPagination',
+    # default page size of requests that ask for pages with ?cursor=
+    'PAGE_SIZE': 100,
+}
+
+# Upper bound for the ?page_size= query parameter
+BOARDS_MAX_PAGE_SIZE = 1000
+
+# Seconds a board membership entry may be served from the per-process cache
+BOARD_MEMBERSHIP_CACHE_TTL = 60
+
+# Board change log: number of latest versions kept for /boards/{id}/changes/
+# and how often (in versions) older entries are compacted away
+BOARD_CHANGES_RETAINED = 1000
+BOARD_CHANGES_COMPACT_EVERY = 100
+
+# Board event stream (boards/events.py): broker class, per-connection buffer
+# size in events, keepalive interval and change log polling interval in
+# seconds. InProcessBroker only sees this process's changes.
+BOARD_EVENT_BROKER = 'boards.events.DatabaseBroker'
+BOARD_EVENT_BUFFER_SIZE = 256
+BOARD_EVENT_HEARTBEAT = 15
+BOARD_EVENT_POLL_INTERVAL = 0.5
+
+# Seconds a verified Basic auth username/password pair skips the password
+# hasher, and the maximum number of remembered pairs per process
+BASIC_AUTH_CACHE_TTL = 300
+BASIC_AUTH_CACHE_SIZE = 10000
+
+# Lifetime in seconds of signed access and refresh tokens (boards/tokens.py)
+SIGNED_TOKEN_ACCESS_TTL = 300
+SIGNED_TOKEN_REFRESH_TTL = 7 * 24 * 3600
+
+# Query budgets (boards/querybudget.py): how many times one query shape may
+# repeat within a request, and whether a request over budget is logged
+# ('log'), fails ('raise') or is ignored (None)
+QUERY_BUDGET_MAX_REPEATS = 3
+QUERY_BUDGET_ACTION = 'log'
+
+# Request metrics (boards/metrics.py): directory shared by the worker
+# processes for /metrics to add up (unset: this process only), and how often
+# in seconds each process writes its values there
+METRICS_MULTIPROCESS_DIR = os.environ.get('BOARDS_METRICS_DIR')
+METRICS_FLUSH_INTERVAL = 1.0
+
+# Who may read /metrics besides staff users: client addresses (comma
+# separated in BOARDS_METRICS_ALLOWED_IPS) and a bearer token for scrapers
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.environ.get('BOARDS_METRICS_ALLOWED_IPS', '').split(',') if ip.strip()]
+METRICS_TOKEN = os.environ.get('BOARDS_METRICS_TOKEN')
+
+# SQLite profile (boards/sqlite.py): pragmas run on every new connection and
+# bounded retries with jittered exponential backoff (seconds) for write
+# requests that find the database locked. synchronous=NORMAL keeps the
+# database consistent in WAL mode but may lose the last commits on power loss.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+}
+SQLITE_WRITE_RETRIES = 5
+SQLITE_RETRY_BACKOFF = 0.01
+SQLITE_RETRY_BACKOFF_MAX = 0.5
+
+# Optional single-writer path (boards/sqlite.py WriteQueue): board, section,
+# sticker and invite writes are group-committed by one writer thread per
+# process, and the writers of all processes take turns through a file lock
+SQLITE_WRITE_QUEUE = os.environ.get('BOARDS_WRITE_QUEUE', '') == '1'
+SQLITE_WRITE_QUEUE_BATCH = 64
+SQLITE_WRITE_QUEUE_TIMEOUT = 30
+SQLITE_WRITE_QUEUE_LOCK = DATABASES['default']['NAME'] + '.writer-lock'
+
+# Async read endpoints (boards/asyncviews.py): token-authenticated GETs of
+# board list/detail/sections/stickers/users and the sticker list are served
+# by the ASGI application directly, through MIDDLEWARE without the session,
+# CSRF and metrics middleware
+ASYNC_READ_ENDPOINTS = True
+
+# Rows read per query and rendered per written piece by ?stream=1 list
+# responses (boards/streaming.py)
+STREAM_CHUNK_SIZE = 200
+
+# Build board, section and sticker list responses from .values() rows
+# instead of model instances and serializers (boards/readmodels.py)
+READ_MODELS_ENABLED = True
+
+# Default lifetime in seconds of invites created through
+# /boards/{id}/invites/ (boards/invites.py)
+BOARD_INVITE_TTL = 7 * 24 * 3600
+
+# Rows removed per statement and transaction by the background deletion of
+# boards and users (boards/deletion.py)
+DELETION_BATCH_SIZE = 500
+
+# Background jobs (boards/jobs.py). Each process also runs the jobs it
+# queues in a background thread unless BOARDS_JOBS_IN_PROCESS=0, e.g. when
+# `manage.py run_jobs` workers are deployed. Failed jobs run again after
+# JOBS_RETRY_BACKOFF seconds, doubling up to JOBS_RETRY_BACKOFF_MAX, until
+# they have run JOBS_MAX_ATTEMPTS times; a worker that dies leaves its job
+# to be claimed again after JOBS_LEASE seconds.
+JOBS_IN_PROCESS = os.environ.get('BOARDS_JOBS_IN_PROCESS', '1') == '1'
+JOBS_MAX_ATTEMPTS = 3
+JOBS_RETRY_BACKOFF = 5
+JOBS_RETRY_BACKOFF_MAX = 600
+JOBS_LEASE = 600
+JOBS_POLL_INTERVAL = 1.0
+
+# Per-user cache of board list and board sticker list responses
+# (boards/responsecache.py): at most RESPONSE_CACHE_MAX_BYTES of bodies per
+# process. Set RESPONSE_CACHE_ALIAS to a shared backend in CACHES (e.g.
+# memcached or a file-based cache) to share responses between workers.
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+RESPONSE_CACHE_ALIAS = None
+RESPONSE_CACHE_TIMEOUT = 300
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
 }
@@ -20,9 +20,11 @@ from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from rest_framework.authtoken import views
 from rest_framework.urls import url
 import boards
+from boards.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('', include('boards.urls')),
     path('api/', include('boards.urls')),
 ]